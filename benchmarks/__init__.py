@@ -0,0 +1,127 @@
+"""Benchmark harness shared by the benchmark suites"""
+import gc
+import os
+import sys
+import json
+import timeit
+import argparse
+
+class Benchmark(object):
+    """Named callable processing size bytes per call"""
+    
+    def __init__(self, name, function, size=0):
+        self.name = name
+        self.function = function
+        self.size = size
+
+def _timeit(function, number):
+    timer = timeit.default_timer
+    start = timer()
+    for i in xrange(number):
+        function()
+    return timer() - start
+
+def _allocs(function, number):
+    """Returns gc-tracked objects allocated per call that are alive with its result"""
+    enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.get_count()[0]
+        results = [function() for i in xrange(number)]
+        after = gc.get_count()[0]
+        del results
+    finally:
+        if enabled:
+            gc.enable()
+    # the results list itself is tracked too
+    return float(after - before - 1) / number
+
+def measure(benchmark, mintime=0.2, repeat=3):
+    """Returns ops/s, bytes/s and allocations per op for the benchmark"""
+    function = benchmark.function
+    number = 1
+    while True:
+        elapsed = _timeit(function, number)
+        if elapsed >= mintime / 10:
+            break
+        number *= 2
+    number = max(1, int(number * mintime / max(elapsed, 1e-9)))
+    best = min(_timeit(function, number) for i in xrange(repeat))
+    ops = number / best
+    return {
+        'ops': ops,
+        'bytes': ops * benchmark.size,
+        'allocs': _allocs(function, min(number, 1000)),
+    }
+
+def compare(results, baseline, threshold):
+    """Returns (name, current ops, baseline ops) for regressions beyond threshold"""
+    regressions = []
+    for name, result in sorted(results.iteritems()):
+        base = baseline.get(name)
+        if base and result['ops'] < base['ops'] * (1 - threshold):
+            regressions.append((name, result['ops'], base['ops']))
+    return regressions
+
+def _format_rate(value, unit):
+    for prefix in ('', 'K', 'M', 'G'):
+        if value < 1000:
+            break
+        value /= 1000.0
+    return '%7.2f %s%s' % (value, prefix, unit)
+
+def report(results, baseline=None, out=sys.stdout):
+    for name, result in sorted(results.iteritems()):
+        line = '%-40s %s  %s  %8.1f allocs' % (name, _format_rate(result['ops'], 'ops/s'), _format_rate(result['bytes'], 'B/s'), result['allocs'])
+        base = baseline and baseline.get(name)
+        if base:
+            line += '  %+6.1f%%' % ((result['ops'] / base['ops'] - 1) * 100)
+        print >>out, line
+
+def load_baseline(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except IOError:
+        return {}
+
+def save_baseline(filename, results):
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True, separators=(',', ': '))
+        f.write('\n')
+
+def add_arguments(parser, baseline=None):
+    """Adds the options setup.py bench passes to every suite"""
+    parser.add_argument('-k', '--filter', default='', help="run benchmarks with names containing this string")
+    parser.add_argument('-b', '--baseline', default=baseline, help="baseline file (default: %(default)s)")
+    parser.add_argument('-t', '--threshold', type=float, default=0.1, help="allowed slowdown fraction (default: %(default)s)")
+    parser.add_argument('-s', '--save', action='store_true', help="save results as the new baseline")
+
+def main(benchmarks, baseline, argv=None):
+    """Runs benchmarks, returns non-zero exit status on regressions"""
+    parser = argparse.ArgumentParser()
+    add_arguments(parser, baseline)
+    parser.add_argument('--mintime', type=float, default=0.2, help="minimum time per measurement in seconds")
+    options = parser.parse_args(argv)
+    results = {}
+    for benchmark in benchmarks:
+        if options.filter in benchmark.name:
+            results[benchmark.name] = measure(benchmark, options.mintime)
+    if not options.save and not os.path.exists(options.baseline):
+        # without a baseline nothing can regress, so the gate must not pass
+        print >>sys.stderr, "ERROR: baseline %s does not exist, run with --save to create it" % (options.baseline,)
+        return 1
+    baseline = load_baseline(options.baseline)
+    report(results, baseline)
+    if options.save:
+        baseline.update(results)
+        save_baseline(options.baseline, baseline)
+        return 0
+    for name in sorted(results):
+        if name not in baseline:
+            print >>sys.stderr, "WARNING: %s has no baseline, run with --save to add it" % (name,)
+    regressions = compare(results, baseline, options.threshold)
+    for name, current, base in regressions:
+        print >>sys.stderr, "REGRESSION: %s %.0f ops/s (baseline %.0f ops/s)" % (name, current, base)
+    return regressions and 1 or 0
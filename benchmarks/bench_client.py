@@ -0,0 +1,55 @@
+"""Per-request overhead of HTTPClient and Agent over the in-memory transport"""
+import os
+import sys
+from kitsu.http.headers import Headers
+from kitsu.http.request import Request
+from kitsu.http.response import Response
+from kitsu.http.client import Agent, HTTPClient
+from kitsu.http.memory import MemoryTransport
+from benchmarks import Benchmark, main as _main
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline_client.json')
+
+def _response(size, chunked=False):
+    body = 'x' * size
+    headers = Headers([('Server', 'bench'), ('Content-Type', 'text/plain')])
+    if chunked:
+        headers['Transfer-Encoding'] = 'chunked'
+        body = ''.join('%X\r\n%s\r\n' % (len(body[i:i+8192]), body[i:i+8192]) for i in xrange(0, len(body), 8192)) + '0\r\n\r\n'
+    else:
+        headers['Content-Length'] = str(len(body))
+    return Response(headers=headers).toString() + body
+
+SMALL_RESPONSE = _response(1024)
+LARGE_CHUNKED = _response(64 * 1024, chunked=True)
+
+def client_request(data, fragment=None):
+    transport = MemoryTransport(lambda request: data, fragment=fragment, record=False)
+    client = HTTPClient(transport.create_socket(('example.com', 80)))
+    request = Request(headers={'Host': 'example.com'})
+    def run():
+        return client.makeRequest(request)
+    return run
+
+def agent_request(data, fragment=None, **kwargs):
+    transport = MemoryTransport(lambda request: data, fragment=fragment, record=False)
+    agent = transport.install(Agent(**kwargs))
+    def run():
+        return agent.makeRequest('http://example.com/index.html')
+    return run
+
+def benchmarks():
+    return [
+        Benchmark('client.small', client_request(SMALL_RESPONSE), len(SMALL_RESPONSE)),
+        Benchmark('client.small.packets', client_request(SMALL_RESPONSE, 64), len(SMALL_RESPONSE)),
+        Benchmark('client.chunked', client_request(LARGE_CHUNKED), len(LARGE_CHUNKED)),
+        Benchmark('agent.small', agent_request(SMALL_RESPONSE), len(SMALL_RESPONSE)),
+        Benchmark('agent.small.lazy', agent_request(SMALL_RESPONSE, lazyheaders=True), len(SMALL_RESPONSE)),
+        Benchmark('agent.chunked', agent_request(LARGE_CHUNKED), len(LARGE_CHUNKED)),
+    ]
+
+def main(argv=None):
+    return _main(benchmarks(), BASELINE, argv)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,262 @@
+"""End-to-end load benchmark against a local keep-alive server"""
+import os
+import sys
+import ssl
+import socket
+import select
+import httplib
+import argparse
+import threading
+import timeit
+from kitsu.http.headers import Headers
+from kitsu.http.request import Request, RequestParser
+from kitsu.http.response import Response
+from kitsu.http.client import Agent, HTTPClient, Connector
+from kitsu.http.sockopts import LATENCY, THROUGHPUT
+
+SOCKOPTS = {
+    'default': None,
+    'latency': LATENCY,
+    'throughput': THROUGHPUT,
+}
+
+CERTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'certs')
+SERVER_KEYFILE = os.path.join(CERTS, 'server.key')
+SERVER_CERTFILE = os.path.join(CERTS, 'server.crt')
+
+def _chunked(data, size=8192):
+    chunks = ['%X\r\n%s\r\n' % (len(data[i:i+size]), data[i:i+size]) for i in xrange(0, len(data), size)]
+    return ''.join(chunks) + '0\r\n\r\n'
+
+class Server(threading.Thread):
+    """Keep-alive server answering every request with the same response"""
+    
+    def __init__(self, size=1024, chunked=False, secure=False, host='127.0.0.1'):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, 0))
+        self.sock.listen(128)
+        self.host, self.port = self.sock.getsockname()
+        self.secure = secure
+        body = 'x' * size
+        headers = Headers()
+        if chunked:
+            headers['Transfer-Encoding'] = 'chunked'
+            body = _chunked(body)
+        else:
+            headers['Content-Length'] = len(body)
+        self.response = Response(headers=headers).toString() + body
+    
+    def run(self):
+        while True:
+            sock, addr = self.sock.accept()
+            thread = threading.Thread(target=self.serve, args=(sock,))
+            thread.daemon = True
+            thread.start()
+    
+    def serve(self, sock):
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.secure:
+                sock = ssl.wrap_socket(sock, keyfile=SERVER_KEYFILE, certfile=SERVER_CERTFILE, server_side=True)
+            parser = RequestParser()
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                while data:
+                    if not parser.parse(data):
+                        break
+                    data = parser.clear()
+                    parser = RequestParser()
+                    sock.sendall(self.response)
+        except (socket.error, ssl.SSLError):
+            pass
+        finally:
+            sock.close()
+
+class ProxyServer(threading.Thread):
+    """CONNECT proxy relaying data between client and target"""
+    
+    def __init__(self, host='127.0.0.1'):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, 0))
+        self.sock.listen(128)
+        self.host, self.port = self.sock.getsockname()
+    
+    def run(self):
+        while True:
+            sock, addr = self.sock.accept()
+            thread = threading.Thread(target=self.serve, args=(sock,))
+            thread.daemon = True
+            thread.start()
+    
+    def serve(self, sock):
+        target = None
+        try:
+            parser = RequestParser()
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    return
+                request = parser.parse(data)
+                if request:
+                    request = request[0]
+                    break
+            host, port = request.target.rsplit(':', 1)
+            target = socket.create_connection((host, int(port)))
+            for s in (sock, target):
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.sendall('HTTP/1.1 200 OK\r\n\r\n')
+            data = parser.clear()
+            if data:
+                target.sendall(data)
+            while True:
+                r, w, e = select.select([sock, target], [], [])
+                for (src, dst) in ((sock, target), (target, sock)):
+                    if src in r:
+                        data = src.recv(65536)
+                        if not data:
+                            return
+                        dst.sendall(data)
+        except socket.error:
+            pass
+        finally:
+            sock.close()
+            if target is not None:
+                target.close()
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+def agent_worker(options, url, proxy):
+    agent = Agent(proxy=proxy, keepalive=True, poolsize=1, sockopts=SOCKOPTS[options.sockopts])
+    def request():
+        response = agent.makeRequest(url)
+        assert response.code == 200
+        return len(response.body)
+    return request, agent.close
+
+def client_worker(options, url, proxy):
+    host, port = options.address
+    sockopts = SOCKOPTS[options.sockopts]
+    connector = Connector(proxy=proxy, sockopts=sockopts)
+    sock = connector.connect((host, port), ssl=options.tls)
+    client = HTTPClient(sock, packetsize=sockopts and sockopts.packetsize or 4096)
+    def request():
+        response = client.makeRequest(Request(headers={'Host': '%s:%s' % (host, port)}))
+        assert response.code == 200
+        return len(response.body)
+    return request, client.close
+
+def httplib_worker(options, url, proxy):
+    host, port = options.address
+    cls = options.tls and httplib.HTTPSConnection or httplib.HTTPConnection
+    if proxy:
+        connection = cls(options.proxyaddress[0], options.proxyaddress[1])
+        connection.set_tunnel(host, port)
+    else:
+        connection = cls(host, port)
+    def request():
+        connection.request('GET', '/')
+        response = connection.getresponse()
+        body = response.read()
+        assert response.status == 200
+        return len(body)
+    return request, connection.close
+
+WORKERS = {
+    'agent': agent_worker,
+    'client': client_worker,
+    'httplib': httplib_worker,
+}
+
+def run(options, kind):
+    """Runs options.requests requests over options.concurrency workers, returns (latencies, bytes, elapsed)"""
+    scheme = options.tls and 'https' or 'http'
+    url = '%s://%s:%s/' % (scheme, options.address[0], options.address[1])
+    proxy = options.proxyaddress and 'https://%s:%s' % options.proxyaddress or None
+    remaining = [options.requests]
+    lock = threading.Lock()
+    latencies = []
+    received = [0]
+    errors = []
+    timer = timeit.default_timer
+    def worker():
+        local = []
+        size = 0
+        try:
+            request, close = WORKERS[kind](options, url, proxy)
+            try:
+                while True:
+                    with lock:
+                        if remaining[0] <= 0 or errors:
+                            break
+                        remaining[0] -= 1
+                    start = timer()
+                    size += request()
+                    local.append(timer() - start)
+            finally:
+                close()
+        except Exception:
+            errors.append(sys.exc_info())
+        finally:
+            with lock:
+                latencies.extend(local)
+                received[0] += size
+    threads = [threading.Thread(target=worker) for i in xrange(options.concurrency)]
+    start = timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = timer() - start
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    latencies.sort()
+    return latencies, received[0], elapsed
+
+def report(kind, latencies, received, elapsed, out=sys.stdout):
+    print >>out, "%-8s %8.0f req/s %8.2f MB/s  p50 %7.3f ms  p90 %7.3f ms  p99 %7.3f ms  p99.9 %7.3f ms" % (
+        kind, len(latencies) / elapsed, received / elapsed / 1e6,
+        percentile(latencies, 0.5) * 1000, percentile(latencies, 0.9) * 1000,
+        percentile(latencies, 0.99) * 1000, percentile(latencies, 0.999) * 1000)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--requests', type=int, default=2000, help="total number of requests (default: %(default)s)")
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help="number of concurrent connections (default: %(default)s)")
+    parser.add_argument('--size', type=int, default=1024, help="response body size (default: %(default)s)")
+    parser.add_argument('--chunked', action='store_true', help="use chunked transfer encoding")
+    parser.add_argument('--tls', action='store_true', help="use TLS with the certificates in tests/certs")
+    parser.add_argument('--proxy', action='store_true', help="connect through a local CONNECT proxy")
+    parser.add_argument('--sockopts', choices=sorted(SOCKOPTS), default='default', help="socket options profile (default: %(default)s)")
+    parser.add_argument('--client', choices=sorted(WORKERS), default='agent', help="client to benchmark (default: %(default)s)")
+    parser.add_argument('--httplib', action='store_true', help="also run the same load with httplib for reference")
+    options = parser.parse_args(argv)
+    server = Server(options.size, options.chunked, options.tls)
+    server.start()
+    options.address = (server.host, server.port)
+    options.proxyaddress = None
+    if options.proxy:
+        proxy = ProxyServer()
+        proxy.start()
+        options.proxyaddress = (proxy.host, proxy.port)
+    kinds = [options.client]
+    if options.httplib and options.client != 'httplib':
+        kinds.append('httplib')
+    for kind in kinds:
+        report(kind, *run(options, kind))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""Micro-benchmarks for parsers, headers and decoders"""
+import os
+import sys
+import zlib
+from kitsu.http.headers import Headers
+from kitsu.http.request import RequestParser
+from kitsu.http.response import ResponseParser
+from kitsu.http.decoders import *
+from benchmarks import Benchmark, main as _main
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline_parsers.json')
+
+SMALL_HEADERS = [
+    ('Date', 'Mon, 01 Jan 2001 00:00:00 GMT'),
+    ('Server', 'Apache/2.2.22 (Ubuntu)'),
+    ('Content-Type', 'text/html; charset=utf-8'),
+    ('Content-Length', '1024'),
+    ('Connection', 'keep-alive'),
+    ('Cache-Control', 'private, max-age=0'),
+    ('ETag', '"5d8c72a5edda8d6a"'),
+]
+
+LARGE_HEADERS = SMALL_HEADERS + [
+    ('X-Header-%d' % i, 'value-%d ' % i * 8) for i in xrange(40)
+] + [
+    ('Set-Cookie', 'cookie%d=%s; path=/; domain=.example.com; HttpOnly' % (i, 'x' * 200)) for i in xrange(10)
+]
+
+def _head(first, headers):
+    return first + '\r\n' + ''.join('%s: %s\r\n' % item for item in headers) + '\r\n'
+
+SMALL_RESPONSE = _head('HTTP/1.1 200 OK', SMALL_HEADERS)
+LARGE_RESPONSE = _head('HTTP/1.1 200 OK', LARGE_HEADERS)
+SMALL_REQUEST = _head('GET /index.html?q=1 HTTP/1.1', [('Host', 'www.example.com'), ('Accept', '*/*'), ('User-Agent', 'kitsu.http')])
+LARGE_REQUEST = _head('POST /submit HTTP/1.1', LARGE_HEADERS)
+
+def _fragments(data, size):
+    return [data[i:i+size] for i in xrange(0, len(data), size)]
+
+def _chunked(data, size):
+    chunks = ['%X\r\n%s\r\n' % (len(chunk), chunk) for chunk in _fragments(data, size)]
+    return ''.join(chunks) + '0\r\n\r\n'
+
+LARGE_BODY = os.urandom(512 * 1024).encode('hex')[:1024 * 1024]
+TINY_CHUNKED = _chunked(LARGE_BODY[:64 * 1024], 16)
+SHORT_CHUNKED = _chunked(LARGE_BODY[:2048], 16)
+LARGE_CHUNKED = _chunked(LARGE_BODY, 16 * 1024)
+DEFLATED = zlib.compress(LARGE_BODY)
+CHUNKED_DEFLATED = _chunked(DEFLATED, 4096)
+
+def parse(parser_class, packets):
+    def run():
+        parser = parser_class()
+        for packet in packets:
+            result = parser.parse(packet)
+            if result:
+                return result
+        raise AssertionError("incomplete message")
+    return run
+
+def decode(decoder_factory, packets):
+    def run():
+        decoder = decoder_factory()
+        for packet in packets:
+            for chunk in decoder.parse(packet):
+                pass
+        for chunk in decoder.finish():
+            pass
+        assert decoder.done
+    return run
+
+def headers_parse(lines):
+    def run():
+        headers = Headers()
+        for line in lines:
+            headers.parseLine(line)
+        return headers
+    return run
+
+def headers_lookup(headers):
+    def run():
+        headers.get('Content-Length')
+        headers.getlist('Transfer-Encoding')
+        'Connection' in headers
+        headers.get('set-cookie')
+    return run
+
+def headers_update(headers, data):
+    def run():
+        Headers(headers).update(data)
+    return run
+
+def headers_to_string(headers):
+    def run():
+        headers.toString()
+    return run
+
+def benchmarks():
+    small = Headers(SMALL_HEADERS)
+    large = Headers(LARGE_HEADERS)
+    small_lines = SMALL_RESPONSE.split('\r\n')[1:]
+    large_lines = LARGE_RESPONSE.split('\r\n')[1:]
+    return [
+        Benchmark('response.small', parse(ResponseParser, [SMALL_RESPONSE]), len(SMALL_RESPONSE)),
+        Benchmark('response.small.1byte', parse(ResponseParser, _fragments(SMALL_RESPONSE, 1)), len(SMALL_RESPONSE)),
+        Benchmark('response.large', parse(ResponseParser, [LARGE_RESPONSE]), len(LARGE_RESPONSE)),
+        Benchmark('response.small.lazy', parse(lambda: ResponseParser(lazy=True), [SMALL_RESPONSE]), len(SMALL_RESPONSE)),
+        Benchmark('response.large.lazy', parse(lambda: ResponseParser(lazy=True), [LARGE_RESPONSE]), len(LARGE_RESPONSE)),
+        Benchmark('response.large.packets', parse(ResponseParser, _fragments(LARGE_RESPONSE, 1460)), len(LARGE_RESPONSE)),
+        Benchmark('request.small', parse(RequestParser, [SMALL_REQUEST]), len(SMALL_REQUEST)),
+        Benchmark('request.small.1byte', parse(RequestParser, _fragments(SMALL_REQUEST, 1)), len(SMALL_REQUEST)),
+        Benchmark('request.large', parse(RequestParser, [LARGE_REQUEST]), len(LARGE_REQUEST)),
+        Benchmark('headers.parse.small', headers_parse(small_lines), len(SMALL_RESPONSE)),
+        Benchmark('headers.parse.large', headers_parse(large_lines), len(LARGE_RESPONSE)),
+        Benchmark('headers.lookup.small', headers_lookup(small)),
+        Benchmark('headers.lookup.large', headers_lookup(large)),
+        Benchmark('headers.update.small', headers_update(small, {'Content-Length': '0', 'X-New': 'value'})),
+        Benchmark('headers.update.large', headers_update(large, {'Content-Length': '0', 'X-New': 'value'})),
+        Benchmark('headers.tostring.small', headers_to_string(small)),
+        Benchmark('headers.tostring.large', headers_to_string(large)),
+        Benchmark('identity.packets', decode(lambda: IdentityDecoder(len(LARGE_BODY)), _fragments(LARGE_BODY, 4096)), len(LARGE_BODY)),
+        Benchmark('identity.1byte', decode(lambda: IdentityDecoder(4096), _fragments(LARGE_BODY[:4096], 1)), 4096),
+        Benchmark('chunked.tiny', decode(ChunkedDecoder, _fragments(TINY_CHUNKED, 4096)), len(TINY_CHUNKED)),
+        Benchmark('chunked.large', decode(ChunkedDecoder, _fragments(LARGE_CHUNKED, 4096)), len(LARGE_CHUNKED)),
+        Benchmark('chunked.1byte', decode(ChunkedDecoder, _fragments(SHORT_CHUNKED, 1)), len(SHORT_CHUNKED)),
+        Benchmark('deflate.packets', decode(DeflateDecoder, _fragments(DEFLATED, 4096)), len(DEFLATED)),
+        Benchmark('compound.chunked.deflate', decode(lambda: CompoundDecoder(ChunkedDecoder(), DeflateDecoder()), _fragments(CHUNKED_DEFLATED, 4096)), len(CHUNKED_DEFLATED)),
+    ]
+
+def main(argv=None):
+    return _main(benchmarks(), BASELINE, argv)
+
+if __name__ == '__main__':
+    sys.exit(main())
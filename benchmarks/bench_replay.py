@@ -0,0 +1,49 @@
+"""Parser throughput on captured traffic replayed without sockets"""
+import os
+import sys
+import glob
+from StringIO import StringIO
+from kitsu.http.client import Agent
+from kitsu.http.memory import MemoryTransport
+from kitsu.http.capture import CaptureWriter, load_capture, Replay
+from benchmarks import Benchmark, main as _main
+from benchmarks.bench_client import SMALL_RESPONSE, LARGE_CHUNKED
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline_replay.json')
+
+# captures recorded with Agent(capture=CaptureWriter(filename)), the
+# corpus directory is not part of the repository
+CORPUS = os.environ.get('KITSU_CORPUS') or os.path.join(os.path.dirname(__file__), 'corpus')
+
+def _synthetic():
+    """Returns a capture of mixed responses received in 1400 byte packets"""
+    f = StringIO()
+    capture = CaptureWriter(f)
+    transport = MemoryTransport([SMALL_RESPONSE, LARGE_CHUNKED] * 8, fragment=1400)
+    agent = transport.install(Agent(capture=capture))
+    for i in xrange(16):
+        agent.makeRequest('http://example.com/%d' % i)
+    capture.close()
+    f.seek(0)
+    return f
+
+def captures():
+    """Returns (name, file) for every capture of the corpus"""
+    filenames = sorted(glob.glob(os.path.join(CORPUS, '*.khcap')) + glob.glob(os.path.join(CORPUS, '*.khcap.gz')))
+    if not filenames:
+        return [('synthetic', _synthetic())]
+    return [(os.path.basename(filename).split('.')[0], filename) for filename in filenames]
+
+def benchmarks():
+    result = []
+    for name, file in captures():
+        streams = load_capture(file)
+        for suffix, replay in (('', Replay(streams)), ('.4k', Replay(streams, 4096)), ('.lazy', Replay(streams, lazyheaders=True))):
+            result.append(Benchmark('replay.%s%s' % (name, suffix), replay.run, replay.size))
+    return result
+
+def main(argv=None):
+    return _main(benchmarks(), BASELINE, argv)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""Import time benchmark enforcing a startup budget"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+from benchmarks import add_arguments
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that must only be loaded on first use
+LAZY_MODULES = ('pkg_resources', 'ssl', 'urlparse', 'ctypes', 'zlib', 'Queue', 'kitsu.http.download')
+
+SCRIPT = """
+import sys, json, timeit
+start = timeit.default_timer()
+import %s
+elapsed = timeit.default_timer() - start
+json.dump({'elapsed': elapsed, 'modules': sorted(sys.modules)}, sys.stdout)
+"""
+
+def measure(module, python=sys.executable):
+    """Imports module in a fresh interpreter, returns (seconds, loaded module names)"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    output = subprocess.check_output([python, '-c', SCRIPT % (module,)], env=env)
+    result = json.loads(output)
+    return result['elapsed'], set(result['modules'])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-m', '--module', default='kitsu.http.client', help="module to import (default: %(default)s)")
+    parser.add_argument('-n', '--runs', type=int, default=10, help="number of interpreter runs (default: %(default)s)")
+    parser.add_argument('--budget', type=float, default=50.0, help="allowed median import time in ms (default: %(default)s)")
+    # the budget replaces a baseline, the shared options are accepted and ignored
+    add_arguments(parser)
+    options = parser.parse_args(argv)
+    timings = []
+    modules = set()
+    for i in xrange(options.runs):
+        elapsed, loaded = measure(options.module)
+        timings.append(elapsed)
+        modules |= loaded
+    timings.sort()
+    median = timings[len(timings) // 2]
+    print "import %s: min %.2f ms  median %.2f ms  max %.2f ms  (%d modules)" % (
+        options.module, timings[0] * 1000, median * 1000, timings[-1] * 1000, len(loaded))
+    failed = False
+    eager = [name for name in LAZY_MODULES if name in modules and name != options.module]
+    if eager:
+        print "eagerly imported: %s" % (', '.join(eager),)
+        failed = True
+    if median * 1000 > options.budget:
+        print "over budget: %.2f ms > %.2f ms" % (median * 1000, options.budget)
+        failed = True
+    return failed and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
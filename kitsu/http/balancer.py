@@ -0,0 +1,97 @@
+__all__ = [
+    'Endpoint',
+    'Upstream',
+]
+
+import random
+import threading
+from kitsu.http.timing import monotonic
+
+class Endpoint(object):
+    """One address of an upstream with its passive health state"""
+    __slots__ = ('netloc', 'outstanding', 'latency', 'failures', 'ejected')
+    
+    def __init__(self, netloc):
+        self.netloc = netloc
+        self.outstanding = 0
+        self.latency = None
+        self.failures = 0
+        self.ejected = None
+    
+    def __repr__(self):
+        return "<Endpoint(%r, outstanding=%d, latency=%r, failures=%d)>" % (self.netloc, self.outstanding, self.latency, self.failures)
+
+class Upstream(object):
+    """Set of addresses serving one logical host name"""
+    
+    strategies = ('round-robin', 'least-outstanding', 'p2c')
+    failureCodes = frozenset([502, 503, 504])
+    
+    def __init__(self, addresses, strategy='round-robin', maxfailures=5, cooldown=30.0, decay=0.3):
+        if strategy not in self.strategies:
+            raise ValueError("unknown balancing strategy %r" % (strategy,))
+        self.endpoints = [Endpoint(netloc) for netloc in addresses]
+        if not self.endpoints:
+            raise ValueError("upstream needs at least one address")
+        self.strategy = strategy
+        self.maxfailures = maxfailures
+        self.cooldown = cooldown
+        self.decay = decay
+        self.__lock = threading.Lock()
+        self.__counter = 0
+    
+    def __healthy(self, now):
+        healthy = []
+        for endpoint in self.endpoints:
+            if endpoint.ejected is not None:
+                if endpoint.ejected > now:
+                    continue
+                # after the cool-down a single failure ejects it again
+                endpoint.ejected = None
+                endpoint.failures = self.maxfailures - 1
+            healthy.append(endpoint)
+        # with every endpoint ejected it is better to try than to fail
+        return healthy or self.endpoints
+    
+    def choose(self):
+        """Returns an endpoint for the next request"""
+        with self.__lock:
+            endpoints = self.__healthy(monotonic())
+            counter = self.__counter
+            self.__counter += 1
+            if self.strategy == 'round-robin' or len(endpoints) == 1:
+                return endpoints[counter % len(endpoints)]
+            if self.strategy == 'least-outstanding':
+                # rotate, so idle endpoints take turns
+                offset = counter % len(endpoints)
+                endpoints = endpoints[offset:] + endpoints[:offset]
+                return min(endpoints, key=lambda endpoint: endpoint.outstanding)
+            a, b = random.sample(endpoints, 2)
+            return min(a, b, key=self.__cost)
+    
+    @staticmethod
+    def __cost(endpoint):
+        # endpoints without latency samples are tried first
+        return (endpoint.outstanding + 1) * (endpoint.latency or 0)
+    
+    def start(self, endpoint):
+        with self.__lock:
+            endpoint.outstanding += 1
+    
+    def finish(self, endpoint, latency=None, failed=False):
+        """Records the outcome of a request, returns True if the endpoint got ejected"""
+        with self.__lock:
+            endpoint.outstanding -= 1
+            if failed:
+                endpoint.failures += 1
+                if endpoint.failures >= self.maxfailures and endpoint.ejected is None:
+                    endpoint.ejected = monotonic() + self.cooldown
+                    return True
+                return False
+            endpoint.failures = 0
+            if latency is not None:
+                if endpoint.latency is None:
+                    endpoint.latency = latency
+                else:
+                    endpoint.latency += self.decay * (latency - endpoint.latency)
+            return False
@@ -0,0 +1,553 @@
+__all__ = [
+    'CacheEntry',
+    'MemoryCacheStorage',
+    'DiskCacheStorage',
+    'HTTPCache',
+]
+
+import os
+import time
+import mmap
+import errno
+import marshal
+import tempfile
+import threading
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from collections import OrderedDict
+from email.utils import parsedate_tz, mktime_tz
+from kitsu.http.headers import Headers
+from kitsu.http.response import Response
+
+def _parse_date(value):
+    if not value:
+        return None
+    try:
+        value = parsedate_tz(value)
+        if value is None:
+            return None
+        return mktime_tz(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def _parse_cache_control(value):
+    """Parses Cache-Control header value into a dict"""
+    directives = {}
+    if not value:
+        return directives
+    for directive in value.split(','):
+        name, _, arg = directive.partition('=')
+        name = name.strip().lower()
+        if name:
+            directives[name] = arg.strip().strip('"') or None
+    return directives
+
+def _parse_seconds(value, default=None):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return default
+
+class CacheEntry(object):
+    """Stored response with the request headers it varies on"""
+    __slots__ = ('url', 'version', 'code', 'phrase', 'headers', 'body', 'vary', 'request_time', 'response_time')
+    
+    def __init__(self, url, version, code, phrase, headers, body, vary=(), request_time=None, response_time=None):
+        self.url = url
+        self.version = version
+        self.code = code
+        self.phrase = phrase
+        self.headers = list(headers)
+        self.body = body
+        self.vary = tuple(vary)
+        self.request_time = request_time
+        self.response_time = response_time
+    
+    @classmethod
+    def from_response(cls, url, response, vary=(), request_time=None, response_time=None):
+        return cls(url, response.version, response.code, response.phrase, response.headers.iteritems(), response.body, vary, request_time, response_time)
+    
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+    
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+    
+    def size(self):
+        size = len(self.url) + len(self.body or '')
+        for name, value in self.headers:
+            size += len(name) + len(value) + 4
+        return size
+    
+    def toResponse(self):
+        return Response(version=self.version, code=self.code, phrase=self.phrase, headers=self.headers, body=self.body)
+
+class MemoryCacheStorage(object):
+    """In-memory LRU storage bounded by entry count and total size"""
+    
+    def __init__(self, maxentries=1024, maxbytes=64*1024*1024):
+        self.maxentries = maxentries
+        self.maxbytes = maxbytes
+        self.size = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self.__entries)
+    
+    def get(self, key):
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is not None:
+                self.__entries[key] = entry
+            return entry
+    
+    def set(self, key, entry):
+        size = entry.size()
+        with self.__lock:
+            self.__remove(key)
+            if size > self.maxbytes:
+                return
+            self.__entries[key] = entry
+            self.size += size
+            while len(self.__entries) > self.maxentries or self.size > self.maxbytes:
+                self.__remove(next(iter(self.__entries)))
+    
+    def delete(self, key):
+        with self.__lock:
+            self.__remove(key)
+    
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.size = 0
+    
+    def __remove(self, key):
+        entry = self.__entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size()
+
+def _replace(source, target):
+    """Renames source to target, replacing target if it exists"""
+    try:
+        os.rename(source, target)
+    except OSError:
+        # rename does not replace existing files on Windows
+        if os.name != 'nt' or not os.path.exists(target):
+            raise
+        os.unlink(target)
+        os.rename(source, target)
+
+class DiskCacheStorage(object):
+    """On-disk storage shared between processes of the same user"""
+    
+    # lock files of platforms without fcntl older than this were left by crashed processes
+    staleLockAge = 60
+    
+    def __init__(self, path, maxentries=65536, maxbytes=1024*1024*1024, mapsize=None):
+        # Bodies of at least mapsize bytes are returned as read-only mmaps,
+        # they are not copied into memory but are not strings either and
+        # stay mapped until closed or garbage collected. The index is read
+        # with marshal, the directory is created private to the user and
+        # must not be writable by others.
+        self.path = path
+        self.maxentries = maxentries
+        self.maxbytes = maxbytes
+        self.mapsize = mapsize
+        self.__lock = threading.Lock()
+        # The index is a snapshot with a journal of later changes appended
+        # to it, other processes only read the records they have not seen.
+        # Entries are kept in the order of their last use for eviction.
+        self.__index = OrderedDict()
+        self.__indexstat = None
+        self.__total = 0
+        self.__seq = 0
+        self.__journalpos = 0
+        self.__journalcount = 0
+        try:
+            os.makedirs(path, 0700)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        self.__lockfile = open(os.path.join(path, 'lock'), 'a')
+    
+    def __acquireFile(self):
+        """Exclusive lock between processes for platforms without fcntl"""
+        filename = os.path.join(self.path, 'lock.exclusive')
+        delay = 0.001
+        while True:
+            try:
+                os.close(os.open(filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+            try:
+                if time.time() - os.stat(filename).st_mtime > self.staleLockAge:
+                    self.__unlink('lock.exclusive')
+                    continue
+            except OSError:
+                continue
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+    
+    @contextmanager
+    def __locked(self, exclusive=False):
+        """Serializes access between threads and processes"""
+        with self.__lock:
+            if fcntl is not None:
+                fcntl.flock(self.__lockfile.fileno(), exclusive and fcntl.LOCK_EX or fcntl.LOCK_SH)
+            else:
+                self.__acquireFile()
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self.__lockfile.fileno(), fcntl.LOCK_UN)
+                else:
+                    self.__unlink('lock.exclusive')
+    
+    def __apply(self, record):
+        """Applies a ('set', key, item), ('touch', key) or ('delete', key) record"""
+        index = self.__index
+        self.__seq += 1
+        if record[0] == 'touch':
+            item = index.pop(record[1], None)
+            if item is not None:
+                index[record[1]] = item[:3] + (self.__seq,)
+            return
+        old = index.pop(record[1], None)
+        if old is not None:
+            self.__total -= old[1]
+        if record[0] == 'set':
+            state, size, bodyname = record[2]
+            index[record[1]] = (state, size, bodyname, self.__seq)
+            self.__total += size
+    
+    def __load(self):
+        """Returns the current index, reading only changes made since the last call"""
+        filename = os.path.join(self.path, 'index')
+        try:
+            st = os.stat(filename)
+            indexstat = (st.st_ino, st.st_size, st.st_mtime)
+        except OSError:
+            indexstat = None
+        if indexstat != self.__indexstat:
+            # the snapshot has been replaced together with its journal
+            seq, items = 0, ()
+            if indexstat is not None:
+                try:
+                    with open(filename, 'rb') as f:
+                        seq, items = marshal.load(f)
+                except (IOError, EOFError, ValueError, TypeError):
+                    seq, items = 0, ()
+            self.__index = OrderedDict(items)
+            self.__indexstat = indexstat
+            self.__total = sum(item[1] for item in self.__index.itervalues())
+            self.__seq = seq
+            self.__journalpos = 0
+            self.__journalcount = 0
+        try:
+            f = open(os.path.join(self.path, 'journal'), 'rb')
+        except IOError:
+            return self.__index
+        with f:
+            f.seek(self.__journalpos)
+            while True:
+                try:
+                    record = marshal.load(f)
+                except (EOFError, ValueError, TypeError):
+                    # the end, or a record cut short by a crash
+                    break
+                self.__apply(record)
+                self.__journalpos = f.tell()
+                self.__journalcount += 1
+        return self.__index
+    
+    def __append(self, records):
+        """Appends records to the journal, must be called with an up to date index"""
+        data = ''.join(marshal.dumps(record) for record in records)
+        fd = os.open(os.path.join(self.path, 'journal'), os.O_RDWR | os.O_CREAT, 0600)
+        try:
+            # drops a record cut short by a crash
+            os.ftruncate(fd, self.__journalpos)
+            os.lseek(fd, self.__journalpos, 0)
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
+        self.__load()
+        if self.__journalcount > max(256, len(self.__index)):
+            self.__save()
+    
+    def __write(self, data, suffix=''):
+        """Atomically writes data into a new file, returns its name"""
+        fd, tmpname = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            name = os.path.basename(tmpname)[:-4] + suffix
+            os.rename(tmpname, os.path.join(self.path, name))
+        except:
+            os.unlink(tmpname)
+            raise
+        return name
+    
+    def __save(self, items=None):
+        """Replaces the snapshot with items or the current index and starts a new journal"""
+        if items is None:
+            items = self.__index.items()
+        name = self.__write(marshal.dumps((self.__seq, items)), '.index')
+        _replace(os.path.join(self.path, name), os.path.join(self.path, 'index'))
+        # replaying a journal left by a crash here would only repeat changes
+        self.__unlink('journal')
+        self.__load()
+    
+    def __unlink(self, name):
+        try:
+            os.unlink(os.path.join(self.path, name))
+        except OSError:
+            pass
+    
+    def __len__(self):
+        with self.__locked():
+            return len(self.__load())
+    
+    @property
+    def size(self):
+        with self.__locked():
+            self.__load()
+            return self.__total
+    
+    def get(self, key):
+        with self.__locked():
+            index = self.__load()
+            item = index.get(key)
+            # only entries outside the recently used half are moved,
+            # hits on popular entries do not write to the journal
+            stale = item is not None and self.__seq - item[3] >= len(index) // 2
+        if item is None:
+            return None
+        state, size, bodyname, seq = item
+        entry = CacheEntry(*state)
+        filename = os.path.join(self.path, bodyname)
+        try:
+            with open(filename, 'rb') as f:
+                length = os.fstat(f.fileno()).st_size
+                if self.mapsize is not None and length and length >= self.mapsize:
+                    entry.body = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    entry.body = f.read()
+        except (IOError, OSError, mmap.error):
+            # replaced or evicted by another process
+            return None
+        if stale:
+            with self.__locked(True):
+                if key in self.__load():
+                    self.__append([('touch', key)])
+        return entry
+    
+    def set(self, key, entry):
+        size = entry.size()
+        if size > self.maxbytes:
+            self.delete(key)
+            return
+        bodyname = self.__write(entry.body or '', '.body')
+        state = entry.__getstate__()
+        state = state[:5] + (None,) + state[6:]
+        try:
+            with self.__locked(True):
+                index = self.__load()
+                old = index.get(key)
+                evicted = self.__evict(index, key, size - (old is not None and old[1] or 0))
+                garbage = [index[name][2] for name in evicted]
+                self.__append([('set', key, (state, size, bodyname))] + [('delete', name) for name in evicted])
+        except:
+            self.__unlink(bodyname)
+            raise
+        if old is not None:
+            garbage.append(old[2])
+        for name in garbage:
+            self.__unlink(name)
+    
+    def __evict(self, index, keep, added):
+        """Returns least recently used keys to remove for the index to stay within limits after adding keep"""
+        count = len(index) + (keep not in index and 1 or 0)
+        total = self.__total + added
+        evicted = []
+        for key, item in index.iteritems():
+            if count <= self.maxentries and total <= self.maxbytes:
+                break
+            if key != keep:
+                count -= 1
+                total -= item[1]
+                evicted.append(key)
+        return evicted
+    
+    def delete(self, key):
+        with self.__locked(True):
+            item = self.__load().get(key)
+            if item is None:
+                return
+            self.__append([('delete', key)])
+        self.__unlink(item[2])
+    
+    def clear(self):
+        with self.__locked(True):
+            index = dict(self.__load())
+            self.__save([])
+        for item in index.itervalues():
+            self.__unlink(item[2])
+
+class HTTPCache(object):
+    """Private HTTP cache following RFC 7234 for GET requests"""
+    
+    cacheableCodes = frozenset((200, 203, 204, 300, 301, 404, 405, 410, 414, 501))
+    notUpdatedHeaders = frozenset(('content-length', 'content-encoding', 'transfer-encoding', 'content-range'))
+    heuristicFraction = 0.1
+    heuristicLimit = 86400
+    
+    def __init__(self, storage=None, shared=False):
+        if storage is None:
+            storage = MemoryCacheStorage()
+        self.storage = storage
+        self.shared = shared
+    
+    def __key(self, url):
+        return url.split('#', 1)[0]
+    
+    def __vary(self, response, headers):
+        names = []
+        for value in response.headers.getlist('Vary'):
+            names.extend(name.strip().lower() for name in value.split(','))
+        return tuple((name, headers.get(name)) for name in names if name)
+    
+    def lifetime(self, entry):
+        headers = Headers(entry.headers)
+        cc = _parse_cache_control(headers.get('Cache-Control'))
+        if self.shared and 's-maxage' in cc:
+            return _parse_seconds(cc['s-maxage'], 0)
+        if 'max-age' in cc:
+            return _parse_seconds(cc['max-age'], 0)
+        date = _parse_date(headers.get('Date')) or entry.response_time
+        if 'Expires' in headers:
+            expires = _parse_date(headers.get('Expires'))
+            if expires is None:
+                return 0
+            return max(0, expires - date)
+        modified = _parse_date(headers.get('Last-Modified'))
+        if modified is not None and entry.code in self.cacheableCodes:
+            return min(self.heuristicLimit, max(0, date - modified) * self.heuristicFraction)
+        return 0
+    
+    def age(self, entry, now=None):
+        if now is None:
+            now = time.time()
+        headers = Headers(entry.headers)
+        date = _parse_date(headers.get('Date')) or entry.response_time
+        apparent = max(0, entry.response_time - date)
+        corrected = _parse_seconds(headers.get('Age'), 0) + (entry.response_time - entry.request_time)
+        return max(apparent, corrected) + (now - entry.response_time)
+    
+    def isFresh(self, entry, headers):
+        """Checks if entry may be served without revalidation"""
+        cc = _parse_cache_control(Headers(entry.headers).get('Cache-Control'))
+        if 'no-cache' in cc:
+            return False
+        reqcc = _parse_cache_control(headers.get('Cache-Control'))
+        if 'no-cache' in reqcc or 'no-cache' in [value.strip().lower() for value in headers.getlist('Pragma')]:
+            return False
+        lifetime = self.lifetime(entry)
+        age = self.age(entry)
+        if 'max-age' in reqcc and age > _parse_seconds(reqcc['max-age'], 0):
+            return False
+        if 'min-fresh' in reqcc:
+            age += _parse_seconds(reqcc['min-fresh'], 0)
+        if 'max-stale' in reqcc and 'must-revalidate' not in cc:
+            lifetime += _parse_seconds(reqcc['max-stale'], self.heuristicLimit)
+        return age < lifetime
+    
+    def isStorable(self, method, headers, response):
+        if method != 'GET' or response.code not in self.cacheableCodes:
+            return False
+        if not isinstance(response.body, basestring):
+            return False
+        if 'no-store' in _parse_cache_control(headers.get('Cache-Control')):
+            return False
+        cc = _parse_cache_control(response.headers.get('Cache-Control'))
+        if 'no-store' in cc or (self.shared and 'private' in cc):
+            return False
+        if self.shared and 'Authorization' in headers and not ('public' in cc or 's-maxage' in cc or 'must-revalidate' in cc):
+            return False
+        if '*' in [name.strip() for name in response.headers.get('Vary', '').split(',')]:
+            return False
+        return bool('max-age' in cc or (self.shared and 's-maxage' in cc) or
+            'Expires' in response.headers or 'Last-Modified' in response.headers or 'ETag' in response.headers)
+    
+    def lookup(self, url, headers):
+        """Returns stored entry matching request headers, or None"""
+        entry = self.storage.get(self.__key(url))
+        if entry is None:
+            return None
+        for name, value in entry.vary:
+            if headers.get(name) != value:
+                return None
+        return entry
+    
+    def validators(self, entry):
+        """Returns conditional request headers for revalidating entry"""
+        headers = Headers(entry.headers)
+        validators = []
+        if 'ETag' in headers:
+            validators.append(('If-None-Match', headers['ETag']))
+        if 'Last-Modified' in headers:
+            validators.append(('If-Modified-Since', headers['Last-Modified']))
+        return validators
+    
+    def store(self, url, method, headers, response, request_time, response_time=None):
+        if response_time is None:
+            response_time = time.time()
+        if not self.isStorable(method, headers, response):
+            if method == 'GET' and 'no-store' in _parse_cache_control(response.headers.get('Cache-Control')):
+                self.storage.delete(self.__key(url))
+            return None
+        entry = CacheEntry.from_response(self.__key(url), response, self.__vary(response, headers), request_time, response_time)
+        self.storage.set(self.__key(url), entry)
+        return entry
+    
+    def update(self, url, entry, response, request_time, response_time=None):
+        """Updates stored entry using a 304 response, returns the new entry"""
+        if response_time is None:
+            response_time = time.time()
+        headers = Headers(entry.headers)
+        seen = set()
+        for name in response.headers:
+            key = name.lower()
+            if key not in seen and key not in self.notUpdatedHeaders:
+                headers[name] = response.headers.getlist(name)
+            seen.add(key)
+        entry = CacheEntry(entry.url, entry.version, entry.code, entry.phrase, headers.iteritems(), entry.body, entry.vary, request_time, response_time)
+        self.storage.set(self.__key(url), entry)
+        return entry
+    
+    def invalidate(self, url):
+        self.storage.delete(self.__key(url))
+    
+    def request(self, url, headers, send):
+        """Returns a cached response, or calls send(conditional headers) and caches its result"""
+        entry = self.lookup(url, headers)
+        if entry is not None and self.isFresh(entry, headers):
+            return entry.toResponse()
+        validators = ()
+        if entry is not None and not ('If-None-Match' in headers or 'If-Modified-Since' in headers):
+            validators = self.validators(entry)
+        request_time = time.time()
+        response = send(validators)
+        if validators and response.code == 304:
+            return self.update(url, entry, response, request_time).toResponse()
+        self.store(url, 'GET', headers, response, request_time)
+        return response
@@ -0,0 +1,174 @@
+__all__ = [
+    'CaptureWriter',
+    'read_capture',
+    'load_capture',
+    'Replay',
+]
+
+import struct
+import threading
+from collections import deque
+from kitsu.http.headers import Headers
+from kitsu.http.request import Request, RequestParser
+from kitsu.http.response import ResponseParser
+from kitsu.http.decoders import CompoundDecoder
+
+# A capture is the magic line followed by records of kind ('S' for sent,
+# 'R' for received), stream id and length, each followed by the data of
+# a single send or recv call.
+_magic = 'KHCAP1\n'
+_record = struct.Struct('!cII')
+
+def _open(filename, mode):
+    if filename.endswith('.gz'):
+        import gzip
+        return gzip.open(filename, mode)
+    return open(filename, mode)
+
+class CaptureWriter(object):
+    """Writes raw byte streams of connections with their send and recv boundaries"""
+    
+    def __init__(self, file):
+        self.owned = isinstance(file, basestring)
+        if self.owned:
+            file = _open(file, 'wb')
+        self.file = file
+        self.file.write(_magic)
+        self.__lock = threading.Lock()
+        self.__streams = 0
+    
+    def stream(self):
+        """Returns id of a new stream"""
+        with self.__lock:
+            self.__streams += 1
+            return self.__streams
+    
+    def write(self, stream, kind, data):
+        if not data:
+            return
+        with self.__lock:
+            self.file.write(_record.pack(kind, stream, len(data)))
+            self.file.write(data)
+    
+    def flush(self):
+        with self.__lock:
+            self.file.flush()
+    
+    def close(self):
+        with self.__lock:
+            if self.owned:
+                self.file.close()
+            else:
+                self.file.flush()
+
+def read_capture(file):
+    """Yields (stream, kind, data) records of a capture"""
+    if isinstance(file, basestring):
+        with _open(file, 'rb') as f:
+            for record in read_capture(f):
+                yield record
+        return
+    if file.read(len(_magic)) != _magic:
+        raise ValueError("not a capture file")
+    while True:
+        header = file.read(_record.size)
+        if not header:
+            break
+        if len(header) != _record.size:
+            raise ValueError("truncated capture file")
+        kind, stream, length = _record.unpack(header)
+        data = file.read(length)
+        if len(data) != length:
+            raise ValueError("truncated capture file")
+        yield stream, kind, data
+
+def _parse_requests(data):
+    """Returns requests sent in data, skipping their bodies"""
+    requests = []
+    parser = RequestParser()
+    decoder = None
+    while data:
+        if decoder is None:
+            parsed = parser.parse(data)
+            if not parsed:
+                break
+            requests.append(parsed[0])
+            data = parser.clear()
+            parser = RequestParser()
+            decoder = CompoundDecoder.from_request(parsed[0])
+            continue
+        decoder.parse(data)
+        if not decoder.done:
+            break
+        data = decoder.clear()
+        decoder = None
+    return requests
+
+def load_capture(file):
+    """Returns (requests, received packets) of every stream that received data"""
+    sent = {}
+    received = {}
+    for stream, kind, data in read_capture(file):
+        if kind == 'S':
+            sent.setdefault(stream, []).append(data)
+        elif kind == 'R':
+            received.setdefault(stream, []).append(data)
+    return [(_parse_requests(''.join(sent.get(stream, ()))), received[stream]) for stream in sorted(received)]
+
+class Replay(object):
+    """Feeds captured responses through ResponseParser and CompoundDecoder"""
+    
+    # responses without a matching captured request
+    defaultRequest = Request()
+    
+    def __init__(self, streams, packetsize=None, lazyheaders=False):
+        if packetsize:
+            streams = [(requests, self.__fragment(''.join(packets), packetsize)) for (requests, packets) in streams]
+        self.streams = streams
+        self.lazyheaders = lazyheaders
+        self.size = sum(len(packet) for (requests, packets) in streams for packet in packets)
+    
+    @staticmethod
+    def __fragment(data, size):
+        return [data[index:index+size] for index in xrange(0, len(data), size)]
+    
+    def run(self):
+        """Parses every stream, returns the number of responses"""
+        count = 0
+        for requests, packets in self.streams:
+            count += self.__replay(deque(requests), packets)
+        return count
+    
+    def __replay(self, requests, packets):
+        count = 0
+        parser = None
+        decoder = None
+        for data in packets:
+            while data:
+                if decoder is None:
+                    if parser is None:
+                        parser = ResponseParser(self.lazyheaders)
+                    responses = parser.parse(data)
+                    if not responses:
+                        break
+                    response = responses[0]
+                    data = parser.clear()
+                    parser = None
+                    request = requests and requests.popleft() or self.defaultRequest
+                    decoder = CompoundDecoder.from_response(request, response)
+                    if decoder is None:
+                        count += 1
+                        continue
+                for chunk in decoder.parse(data):
+                    if isinstance(chunk, Headers):
+                        response.headers.update(chunk, merge=True)
+                if not decoder.done:
+                    break
+                data = decoder.clear()
+                decoder = None
+                count += 1
+        if decoder is not None:
+            # body delimited by the end of the connection
+            decoder.finish()
+            count += 1
+        return count
@@ -5,19 +5,12 @@ __all__ = [
 
 import re
 import sys
+import time
 import errno
-import base64
 import socket
-import urlparse
-try:
-    import ssl
-except ImportError:
-    # if import _ssl in sll fails, then subsequent
-    # import ssl statements would succeed
-    # workaround that, so other modules have
-    # a chance to detect ssl support
-    sys.modules.pop('ssl', None)
-    ssl = None
+import select
+import binascii
+import threading
 try:
     from cStringIO import StringIO
 except ImportError:
@@ -27,14 +20,32 @@ from kitsu.http.headers import *
 from kitsu.http.request import *
 from kitsu.http.response import *
 from kitsu.http.decoders import *
+from kitsu.http.coalesce import *
+from kitsu.http.timing import *
+from kitsu.http.events import notify
+
+_TCP_QUICKACK = getattr(socket, 'TCP_QUICKACK', None)
 
 class HTTPClient(object):
-    def __init__(self, sock, sizelimit=None, bodylimit=None, packetsize=4096):
+    sendChunkSize = 65536
+    
+    def __init__(self, sock, sizelimit=None, bodylimit=None, packetsize=4096, observers=(), lazyheaders=False, capture=None, quickack=False):
         self.sock = sock
         self.data = ''
         self.sizelimit = sizelimit
         self.bodylimit = bodylimit
         self.packetsize = packetsize
+        self.lazyheaders = lazyheaders
+        self.observers = observers
+        self.bytessent = 0
+        self.bytesreceived = 0
+        self.readtimeout = None
+        self.deadline = None
+        self.continuetimeout = 1.0
+        self.bodyskipped = False
+        self.capture = capture
+        self.stream = capture is not None and capture.stream() or None
+        self.quickack = quickack and _TCP_QUICKACK is not None
     
     def __del__(self):
         self.close()
@@ -51,14 +62,94 @@ class HTTPClient(object):
         data, self.data = self.data, ''
         return data
     
+    def __timeout(self, phase):
+        """Bounds socket timeout by the deadline, returns the phase that would expire"""
+        remaining = self.deadline - monotonic()
+        if remaining <= 0:
+            raise HTTPTimeoutError('deadline')
+        if self.readtimeout is None or remaining < self.readtimeout:
+            self.sock.settimeout(remaining)
+            return 'deadline'
+        self.sock.settimeout(self.readtimeout)
+        return phase
+    
     def __recv(self):
-        data = self.sock.recv(self.packetsize)
+        phase = 'read'
+        if self.deadline is not None:
+            phase = self.__timeout(phase)
+        try:
+            data = self.sock.recv(self.packetsize)
+        except socket.timeout:
+            if self.readtimeout is None and self.deadline is None:
+                raise
+            raise HTTPTimeoutError(phase)
         #print "<- %r" % (data,)
+        if self.quickack:
+            # linux turns quick acks off again after it has delayed an ack
+            try:
+                self.sock.setsockopt(socket.IPPROTO_TCP, _TCP_QUICKACK, 1)
+            except socket.error:
+                self.quickack = False
+        self.bytesreceived += len(data)
+        if self.capture is not None:
+            self.capture.write(self.stream, 'R', data)
         return data
     
+    def __sendall(self, data, phase):
+        try:
+            self.sock.sendall(data)
+        except socket.timeout:
+            if self.readtimeout is None and self.deadline is None:
+                raise
+            raise HTTPTimeoutError(phase)
+    
     def __send(self, data):
         #print "-> %r" % (data,)
-        return self.sock.sendall(data)
+        if self.deadline is None:
+            self.__sendall(data, 'write')
+        else:
+            # a single sendall of a large body could block past the deadline
+            size = self.sendChunkSize
+            for index in xrange(0, len(data), size):
+                self.__sendall(data[index:index+size], self.__timeout('write'))
+        self.bytessent += len(data)
+        if self.capture is not None:
+            self.capture.write(self.stream, 'S', data)
+    
+    def __awaitContinue(self):
+        """Waits for 100 Continue, returns False if the server has sent its final response instead"""
+        timeout = self.continuetimeout
+        if self.deadline is not None:
+            remaining = self.deadline - monotonic()
+            if remaining <= 0:
+                raise HTTPTimeoutError('deadline')
+            if timeout is None or remaining < timeout:
+                timeout = remaining
+        # received data stays buffered for the response parser
+        probe = ResponseParser()
+        data = self.data
+        previous = self.sock.gettimeout()
+        self.sock.settimeout(timeout)
+        try:
+            while True:
+                if data:
+                    if probe.parse(data):
+                        return False
+                    if probe.interim:
+                        return True
+                try:
+                    data = self.sock.recv(self.packetsize)
+                except socket.timeout:
+                    # servers that ignore Expect get the body anyway
+                    return True
+                if not data:
+                    raise HTTPDataError("not enough data for response")
+                self.bytesreceived += len(data)
+                if self.capture is not None:
+                    self.capture.write(self.stream, 'R', data)
+                self.data += data
+        finally:
+            self.sock.settimeout(previous)
     
     def __sendBody(self, body):
         if body is None:
@@ -70,18 +161,39 @@ class HTTPClient(object):
             return
         while True:
             # assume it's a file
-            data = body.read(packetsize)
+            data = body.read(self.packetsize)
             if not data:
                 break
             self.__send(data)
     
-    def makeRequest(self, request):
+    def makeRequest(self, request, output=None, timing=None):
+        if not self.observers:
+            return self.__makeRequest(request, output, timing)
+        sent, received = self.bytessent, self.bytesreceived
+        try:
+            return self.__makeRequest(request, output, timing)
+        except HTTPLimitError, e:
+            notify(self.observers, 'limit.error', error=e)
+            raise
+        finally:
+            notify(self.observers, 'bytes', sent=self.bytessent - sent, received=self.bytesreceived - received)
+    
+    def __makeRequest(self, request, output, timing):
         sizelimit = self.sizelimit
         self.__send(request.toString())
-        self.__sendBody(request.body)
-        parser = ResponseParser()
+        self.bodyskipped = False
+        if request.body is not None and '100-continue' in request.headers.get('Expect', '').lower() and not self.__awaitContinue():
+            # the server has answered before it has seen the body
+            self.bodyskipped = True
+        else:
+            self.__sendBody(request.body)
+        if timing is not None:
+            timing.mark('sent')
+        parser = ResponseParser(self.lazyheaders)
         if not self.data:
             self.data = self.__recv()
+        if timing is not None:
+            timing.mark('firstbyte')
         while True:
             if not self.data:
                 raise HTTPDataError("not enough data for response")
@@ -101,18 +213,29 @@ class HTTPClient(object):
             if sizelimit is not None and sizelimit <= 0:
                 raise HTTPLimitError()
             self.data = self.__recv()
+        if timing is not None:
+            timing.mark('headers')
+            response.timing = timing
         decoder = CompoundDecoder.from_response(request, response)
         if not decoder:
             # response has no body
             response.body = ''
+            if timing is not None:
+                timing.mark('done')
             return response
-        response.body = StringIO()
+        # output may redirect the body into a file-like object
+        body = output is not None and output(response) or None
+        if body is None:
+            response.body = StringIO()
+        else:
+            response.body = body
+        bodystart = response.body.tell()
         def process_chunk(chunk):
             if isinstance(chunk, Headers):
                 response.headers.update(chunk, merge=True)
             else:
                 response.body.write(chunk)
-                if self.bodylimit is not None and response.body.tell() > self.bodylimit:
+                if self.bodylimit is not None and response.body.tell() - bodystart > self.bodylimit:
                     raise HTTPLimitError()
         def process_chunks(chunks):
             for chunk in chunks:
@@ -136,7 +259,10 @@ class HTTPClient(object):
             sizelimit += len(self.data)
             if sizelimit < 0:
                 raise HTTPLimitError()
-        response.body = response.body.getvalue()
+        if body is None:
+            response.body = response.body.getvalue()
+        if timing is not None:
+            timing.mark('done')
         return response
 
 class HTTPProxyClient(object):
@@ -144,12 +270,14 @@ class HTTPProxyClient(object):
         '_HTTPProxyClient__sock',
         '_HTTPProxyClient__headers',
         '_HTTPProxyClient__peername',
+        '_HTTPProxyClient__capture',
     )
     
-    def __init__(self, sock, headers=()):
+    def __init__(self, sock, headers=(), capture=None):
         self.__sock = sock
         self.__headers = Headers(headers)
         self.__peername = None
+        self.__capture = capture
     
     @property
     def __class__(self):
@@ -182,6 +310,10 @@ class HTTPProxyClient(object):
                 break
         return s.getvalue()
     
+    def __record(self, stream, kind, data):
+        if self.__capture is not None:
+            self.__capture.write(stream, kind, data)
+    
     def connect(self, address):
         if self.__peername is not None:
             raise socket.error(errno.EISCONN, 'Socket is already connected')
@@ -192,13 +324,18 @@ class HTTPProxyClient(object):
         # it's only added here for consistency
         request.headers['Host'] = target
         request.headers.update(self.__headers)
-        self.__sock.sendall(request.toString())
+        data = request.toString()
+        self.__sock.sendall(data)
+        stream = self.__capture is not None and self.__capture.stream() or None
+        self.__record(stream, 'S', data)
         limit = 65536
         parser = ResponseParser()
         while True:
             data = self.__readline(limit)
             if not data:
                 raise HTTPDataError("not enough data for response")
+            # recorded by line, the exchange is read one byte at a time
+            self.__record(stream, 'R', data)
             limit -= len(data)
             response = parser.parse(data)
             if response:
@@ -226,15 +363,71 @@ class HTTPProxyClient(object):
             raise socket.error(errno.ENOTCONN, 'Socket is not connected')
         return self.__peername
 
-def create_socket(address=None, timeout=None):
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
-    if timeout is not None:
-        sock.settimeout(timeout)
-    if address is not None:
-        sock.connect(address)
+def _connect_socket(family, address, timeout, options):
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        if timeout is not None:
+            sock.settimeout(timeout)
+        if options is not None:
+            options.apply(sock)
+        if address is not None:
+            sock.connect(address)
+    except:
+        sock.close()
+        raise
     return sock
 
+def create_socket(address=None, timeout=None, options=None):
+    if isinstance(address, basestring):
+        # path of a unix domain socket
+        return _connect_socket(socket.AF_UNIX, address, timeout, options)
+    if address is None:
+        return _connect_socket(socket.AF_INET, None, timeout, options)
+    # every address of the host is tried in turn, so
+    # hosts with both IPv6 and IPv4 addresses still work
+    # when one of the families is unreachable
+    error = None
+    for family, socktype, proto, canonname, sockaddr in _getaddrinfo(address):
+        try:
+            return _connect_socket(family, sockaddr, timeout, options)
+        except socket.error, e:
+            error = e
+    raise error
+
+def _getaddrinfo(address):
+    host, port = address[:2]
+    try:
+        addresses = socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    except socket.gaierror, e:
+        raise HTTPDNSError("%s: %s" % (host, e.args[-1]))
+    if not addresses:
+        raise HTTPDNSError(host)
+    return addresses
+
+def resolve_address(address):
+    """Returns socket addresses of (host, port) in the order they should be tried"""
+    result = []
+    for family, socktype, proto, canonname, sockaddr in _getaddrinfo(address):
+        if sockaddr not in result:
+            result.append(sockaddr)
+    return result
+
+def _import_ssl():
+    # ssl is imported on first use, it is expensive
+    # and not needed for plain http connections
+    try:
+        import ssl
+    except ImportError:
+        # if import _ssl in sll fails, then subsequent
+        # import ssl statements would succeed
+        # workaround that, so other modules have
+        # a chance to detect ssl support
+        sys.modules.pop('ssl', None)
+        return None
+    return ssl
+
 def wrap_ssl(sock, keyfile=None, certfile=None, **kwargs):
+    ssl = _import_ssl()
     if ssl is None:
         return socket.ssl(sock, keyfile, certfile)
     # Work around http://bugs.python.org/issue5103 on Python 2.6
@@ -245,7 +438,13 @@ def wrap_ssl(sock, keyfile=None, certfile=None, **kwargs):
         sslsock.getpeername()
     except:
         return sslsock # not connected
-    sslsock.do_handshake()
+    try:
+        sslsock.do_handshake()
+    except ssl.SSLError, e:
+        # handshake timeouts are not reported as socket.timeout on Python 2
+        if 'timed out' in str(e):
+            raise socket.timeout(str(e))
+        raise
     return sslsock
 
 def _parse_netloc(netloc, default_port=None):
@@ -260,7 +459,21 @@ def _parse_netloc(netloc, default_port=None):
         host, port = netloc, default_port
     return host, port
 
+def _unix_path(netloc):
+    """Returns socket path from the percent-encoded netloc of an http+unix url"""
+    import urllib
+    return urllib.unquote(netloc)
+
+def _join_url(url, location):
+    import urlparse
+    scheme, sep, rest = url.partition('://')
+    if scheme.lower() != 'http+unix' or urlparse.urlsplit(location).scheme:
+        return urlparse.urljoin(url, location)
+    # urljoin does not resolve relative locations for unknown schemes
+    return scheme + urlparse.urljoin('http://' + rest, location)[4:]
+
 def _parse_uri(uri):
+    import urlparse
     if '://' not in uri:
         uri = 'http://' + uri
     scheme, netloc, path, query, fragment = urlparse.urlsplit(uri)
@@ -294,6 +507,194 @@ def _make_uri(scheme, auth, netloc, path='', fragment=''):
         uri += '#' + fragment
     return uri
 
+_originPattern = re.compile(r'^([A-Za-z][A-Za-z0-9+.\-]*://[^/?#]*)(.*)$', re.S)
+
+def _basic_auth(auth):
+    return 'Basic %s' % binascii.b2a_base64(auth)[:-1]
+
+def _parse_proxy(proxy):
+    """Returns (type, netloc, authorization) for the proxy uri"""
+    proxytype, proxyauth, proxynetloc, proxypath, proxyfragment = _parse_uri(proxy)
+    proxytype = proxytype.lower()
+    if proxytype not in ('http', 'https'):
+        raise HTTPError("Unsupported proxy type %r" % (proxytype,))
+    return proxytype, proxynetloc, proxyauth and _basic_auth(proxyauth) or None
+
+_poll = getattr(select, 'poll', None)
+
+def _is_stale(client):
+    """Returns True if an idle client cannot be reused"""
+    if client.sock is None or client.data:
+        return True
+    # An idle connection has nothing to read unless the server closed
+    # it or sent something unsolicited, either way it cannot be used.
+    # Data buffered by ssl is invisible to select, check it first.
+    pending = getattr(client.sock, 'pending', None)
+    if pending is not None and pending():
+        return True
+    try:
+        fileno = client.sock.fileno()
+    except (AttributeError, socket.error):
+        return False
+    try:
+        if _poll is not None:
+            # select cannot check descriptors above FD_SETSIZE
+            poller = _poll()
+            poller.register(fileno, select.POLLIN | select.POLLPRI)
+            return bool(poller.poll(0))
+        readable, writable, failed = select.select([fileno], [], [], 0)
+    except select.error:
+        return True
+    except ValueError:
+        # nothing can be known about this descriptor, reuse it
+        return False
+    return bool(readable)
+
+class ConnectionPool(object):
+    """Pool of idle keep-alive connections keyed by address"""
+    
+    def __init__(self, maxsize=10, observers=()):
+        self.maxsize = maxsize
+        self.observers = observers
+        self.__lock = threading.Lock()
+        self.__idle = [] # (address, client) pairs, most recent last
+    
+    def __len__(self):
+        return len(self.__idle)
+    
+    def count(self, address):
+        with self.__lock:
+            return sum(1 for (key, client) in self.__idle if key == address)
+    
+    def acquire(self, address):
+        """Returns an idle client for address or None, discarding stale clients"""
+        while True:
+            with self.__lock:
+                for index in xrange(len(self.__idle) - 1, -1, -1):
+                    if self.__idle[index][0] == address:
+                        client = self.__idle.pop(index)[1]
+                        break
+                else:
+                    return None
+            if not _is_stale(client):
+                return client
+            client.close()
+            if self.observers:
+                notify(self.observers, 'connection.closed', address=address, reason='stale')
+    
+    def release(self, address, client):
+        """Returns client to the pool, closing the oldest idle clients if pool is full"""
+        with self.__lock:
+            self.__idle.append((address, client))
+            if len(self.__idle) > self.maxsize:
+                expired = self.__idle[:-self.maxsize]
+                del self.__idle[:-self.maxsize]
+            else:
+                expired = ()
+        for key, client in expired:
+            client.close()
+            if self.observers:
+                notify(self.observers, 'connection.closed', address=key, reason='pool-full')
+    
+    def discard(self, address, reason='discard'):
+        """Closes all idle clients for address"""
+        with self.__lock:
+            idle = [item for item in self.__idle if item[0] == address]
+            self.__idle = [item for item in self.__idle if item[0] != address]
+        for key, client in idle:
+            client.close()
+            if self.observers:
+                notify(self.observers, 'connection.closed', address=key, reason=reason)
+    
+    def clear(self):
+        with self.__lock:
+            idle, self.__idle = self.__idle, []
+        for key, client in idle:
+            client.close()
+            if self.observers:
+                notify(self.observers, 'connection.closed', address=key, reason='pool-clear')
+
+class _Warmer(object):
+    """Opens connections in the background until a pool has enough idle ones"""
+    
+    def __init__(self, pool, observers=()):
+        self.pool = pool
+        self.observers = observers
+        self.__lock = threading.Lock()
+        self.__opening = {}
+    
+    def warm(self, address, count, connect):
+        """Starts threads calling connect until address has count idle clients, returns them"""
+        with self.__lock:
+            opening = self.__opening.get(address, 0)
+            needed = count - self.pool.count(address) - opening
+            if needed <= 0:
+                return []
+            self.__opening[address] = opening + needed
+        threads = []
+        for i in xrange(needed):
+            thread = threading.Thread(target=self.__open, args=(address, connect))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        return threads
+    
+    def __open(self, address, connect):
+        try:
+            client = connect()
+        except Exception, e:
+            if self.observers:
+                notify(self.observers, 'preconnect.failed', address=address, error=e)
+        else:
+            self.pool.release(address, client)
+        finally:
+            with self.__lock:
+                self.__opening[address] -= 1
+                if not self.__opening[address]:
+                    del self.__opening[address]
+
+class _Attempt(object):
+    """Connection used by one of the hedged copies of a request"""
+    __slots__ = ('lock', 'client', 'timing', 'cancelled')
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.client = None
+        self.timing = None
+        self.cancelled = False
+    
+    def attach(self, client, timing):
+        with self.lock:
+            self.client = client
+            self.timing = timing
+            if self.cancelled:
+                self.__abort()
+    
+    def detach(self):
+        """Called when the request is over, returns True if it has been cancelled"""
+        with self.lock:
+            self.client = None
+            return self.cancelled
+    
+    def responding(self):
+        timing = self.timing
+        return timing is not None and timing.headers is not None
+    
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            if self.client is not None:
+                self.__abort()
+    
+    def __abort(self):
+        # shutdown wakes up the thread blocked reading this socket
+        sock = self.client.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
 class Agent(object):
     no_redirect_headers = (
         'Transfer-Encoding',
@@ -307,37 +708,215 @@ class Agent(object):
         'Host',
     )
     
-    def __init__(self, proxy=None, headers=(), timeout=30, keepalive=None, sizelimit=None, bodylimit=None, redirectlimit=20):
+    idempotent_methods = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS', 'TRACE'])
+    
+    # errors counted against the health of an upstream endpoint
+    endpoint_errors = (socket.error, HTTPDNSError, HTTPDataError, HTTPTimeoutError)
+    
+    # number of parsed origins kept by each agent
+    origin_cache_size = 256
+    
+    def __init__(self, proxy=None, headers=(), timeout=30, keepalive=None, sizelimit=None, bodylimit=None, redirectlimit=20, poolsize=10, cache=None, coalesce=False, observers=(), lazyheaders=False, sockopts=None, retry=None, hedge=None,
+                 connecttimeout=None, tlstimeout=None, readtimeout=None, deadline=None, upstreams=None, scheduler=None,
+                 expectcontinue=None, continuetimeout=1.0, minidle=0, capture=None, resolve=False):
+        self.__origins = {}
         self.proxy = proxy
         self.headers = Headers(headers)
         self.timeout = timeout
+        self.connecttimeout = connecttimeout
+        self.tlstimeout = tlstimeout
+        self.readtimeout = readtimeout
+        self.deadline = deadline
+        self.expectcontinue = expectcontinue
+        self.continuetimeout = continuetimeout
         self.keepalive = keepalive
         self.sizelimit = sizelimit
         self.bodylimit = bodylimit
         self.redirectlimit = redirectlimit
-        self.__current_address = None
-        self.__current_client = None
+        self.lazyheaders = lazyheaders
+        self.sockopts = sockopts
+        self.capture = capture
+        self.retry = retry
+        self.hedge = hedge
+        self.upstreams = dict((name.lower(), upstream) for (name, upstream) in (upstreams or {}).iteritems())
+        self.scheduler = scheduler
+        self.observers = list(observers)
+        self.pool = ConnectionPool(poolsize, self.observers)
+        self.minidle = minidle
+        self.__warmer = _Warmer(self.pool, self.observers)
+        self.cache = cache
+        self.coalescer = coalesce and Coalescer() or None
+        # with resolve the agent looks up addresses itself, timing DNS
+        # separately, and passes numeric addresses to create_socket
+        self.resolve = resolve
+        self.resolve_address = resolve_address
         self.create_socket = create_socket
         self.wrap_ssl = wrap_ssl
     
     def close(self):
-        self.__current_address = None
-        if self.__current_client is not None:
-            self.__current_client.close()
-            self.__current_client = None
-    
-    def __makeRequest(self, url, method='GET', version=(1, 1), headers=(), body=None, referer=None, keyfile=None, certfile=None, ignore_content_length=False):
-        scheme, auth, netloc, path, fragment = _parse_uri(url)
-        scheme = scheme.lower()
-        if scheme not in ('http', 'https'):
-            raise HTTPError("Unsupported scheme %r: %s" % (scheme, url))
+        self.pool.clear()
+    
+    def __getProxy(self):
+        return self.__proxy
+    
+    def __setProxy(self, proxy):
+        self.__proxyconfig = proxy and _parse_proxy(proxy) or None
+        self.__proxy = proxy
+    
+    proxy = property(__getProxy, __setProxy)
+    
+    def __parseURL(self, url):
+        """Returns (scheme, netloc, authorization, path) using cached origins"""
+        match = _originPattern.match(url)
+        if match is None:
+            origin, path = url, None
+            parsed = None
+        else:
+            origin, path = match.groups()
+            parsed = self.__origins.get(origin)
+        if parsed is None:
+            scheme, auth, netloc, originpath, fragment = _parse_uri(origin)
+            scheme = scheme.lower()
+            if scheme not in ('http', 'https', 'http+unix'):
+                raise HTTPError("Unsupported scheme %r: %s" % (scheme, url))
+            parsed = (scheme, netloc, auth and _basic_auth(auth) or None)
+            if path is None:
+                return parsed + (originpath,)
+            if len(self.__origins) >= self.origin_cache_size:
+                self.__origins.clear()
+            self.__origins[origin] = parsed
+        index = path.find('#')
+        if index >= 0:
+            path = path[:index]
+        if path.endswith('?') and path.find('?') == len(path) - 1:
+            path = path[:-1]
+        return parsed + (path,)
+    
+    def __createSocket(self, address, timeout):
+        if self.sockopts is None:
+            # keeps replacement create_socket functions without options working
+            return self.create_socket(address, timeout)
+        return self.create_socket(address, timeout, self.sockopts)
+    
+    def __timeout(self, timeout, expires, phase):
+        """Returns (timeout, phase) for a connection phase, bounded by the deadline"""
+        if timeout is None:
+            timeout = self.timeout
+        if expires is None:
+            return timeout, phase
+        remaining = expires - monotonic()
+        if remaining <= 0:
+            raise HTTPTimeoutError('deadline')
+        if timeout is None or remaining < timeout:
+            return remaining, 'deadline'
+        return timeout, phase
+    
+    def __packetsize(self):
+        if self.sockopts is None:
+            return 4096
+        return self.sockopts.packetsize
+    
+    def __open(self, sockaddrs, expires):
+        """Connects to the first reachable of sockaddrs"""
+        error = None
+        for sockaddr in sockaddrs:
+            timeout, phase = self.__timeout(self.connecttimeout, expires, 'connect')
+            try:
+                return self.__createSocket(sockaddr, timeout)
+            except socket.timeout:
+                error = HTTPTimeoutError(phase)
+            except socket.error, e:
+                error = e
+        raise error
+    
+    def __connect(self, address, scheme, tunnel, proxyauthorization, keyfile, certfile, timing, expires):
+        tscheme, tnetloc = address[0]
+        if tscheme == 'http+unix':
+            sockaddrs = [_unix_path(tnetloc)]
+        else:
+            sockaddrs = [_parse_netloc(tnetloc, tscheme == 'https' and 443 or 80)]
+            if self.resolve:
+                sockaddrs = self.resolve_address(sockaddrs[0])
+                timing.mark('dns')
+        sock = self.__open(sockaddrs, expires)
+        timing.mark('connect')
+        if tunnel:
+            tscheme, tnetloc = address[1]
+            proxyheaders = Headers(self.headers)
+            if proxyauthorization:
+                proxyheaders['Proxy-Authorization'] = proxyauthorization
+            timeout, phase = self.__timeout(self.connecttimeout, expires, 'proxy')
+            sock.settimeout(timeout)
+            sock = HTTPProxyClient(sock, proxyheaders, self.capture)
+            try:
+                sock.connect(_parse_netloc(tnetloc, tscheme == 'https' and 443 or 80))
+            except socket.timeout:
+                sock.close()
+                raise HTTPTimeoutError(phase)
+            timing.mark('proxy')
+        if scheme == 'https':
+            timeout, phase = self.__timeout(self.tlstimeout, expires, 'tls')
+            sock.settimeout(timeout)
+            try:
+                sock = self.wrap_ssl(sock, keyfile, certfile)
+            except socket.timeout:
+                sock.close()
+                raise HTTPTimeoutError(phase)
+            timing.mark('tls')
+        quickack = self.sockopts is not None and self.sockopts.quickack and address[0][0] != 'http+unix'
+        client = HTTPClient(sock, sizelimit=self.sizelimit, bodylimit=self.bodylimit, packetsize=self.__packetsize(), observers=self.observers, lazyheaders=self.lazyheaders, capture=self.capture, quickack=quickack)
+        if self.observers:
+            notify(self.observers, 'connection.opened', address=address, timing=timing)
+        return client
+    
+    def __route(self, scheme, target):
+        """Returns (address, tunnel, proxyauthorization) of connections to target"""
+        if self.__proxyconfig is None or scheme == 'http+unix':
+            return ((scheme, target),), False, None
+        proxytype, proxynetloc, proxyauthorization = self.__proxyconfig
+        if 'https' in (scheme, proxytype):
+            return ((proxytype, proxynetloc), (scheme, target)), True, proxyauthorization
+        return ((proxytype, proxynetloc),), False, proxyauthorization
+    
+    def __warm(self, url, address, scheme, tunnel, proxyauthorization, keyfile, certfile, count):
+        def connect():
+            return self.__connect(address, scheme, tunnel, proxyauthorization, keyfile, certfile, Timing(url), None)
+        return self.__warmer.warm(address, count, connect)
+    
+    def preconnect(self, urls, count=1, keyfile=None, certfile=None):
+        """Opens up to count idle connections per origin in the background, returns the started threads"""
+        if isinstance(urls, basestring):
+            urls = [urls]
+        threads = []
+        for url in urls:
+            url = url.strip()
+            scheme, netloc, authorization, path = self.__parseURL(url)
+            upstream = self.upstreams and self.upstreams.get(netloc.split(':', 1)[0].lower())
+            # every address of an upstream gets its own connections
+            targets = upstream and [endpoint.netloc for endpoint in upstream.endpoints] or [netloc]
+            for target in targets:
+                address, tunnel, proxyauthorization = self.__route(scheme, target)
+                threads.extend(self.__warm(url, address, scheme, tunnel, proxyauthorization, keyfile, certfile, count))
+        return threads
+    
+    def __isRetryable(self, request, error):
+        if request.method not in self.idempotent_methods:
+            return False
+        if request.body is not None and not isinstance(request.body, basestring):
+            # file bodies have been consumed
+            return False
+        if isinstance(error, (socket.timeout, HTTPTimeoutError)):
+            return False
+        return isinstance(error, (socket.error, HTTPDataError))
+    
+    def __makeRequest(self, url, method='GET', version=(1, 1), headers=(), body=None, referer=None, keyfile=None, certfile=None, ignore_content_length=False, output=None, expires=None, attempt=None):
+        scheme, netloc, authorization, path = self.__parseURL(url)
         request = Request(method=method, target=path or '/', version=version, headers=self.headers, body=body)
         request.headers.update(headers)
-        if auth and 'Authorization' not in request.headers:
-            auth = re.sub(r"\s", "", base64.encodestring(auth))
-            request.headers['Authorization'] = 'Basic %s' % auth
+        if authorization and 'Authorization' not in request.headers:
+            request.headers['Authorization'] = authorization
         if netloc and 'Host' not in request.headers:
-            request.headers['Host'] = netloc
+            request.headers['Host'] = scheme != 'http+unix' and netloc or 'localhost'
         if referer and 'Referer' not in request.headers:
             request.headers['Referer'] = referer
         if ignore_content_length:
@@ -346,46 +925,103 @@ class Agent(object):
             request.ignore_content_length = True
         elif self.keepalive is not None and 'Connection' not in request.headers:
             request.headers['Connection'] = self.keepalive and 'keep-alive' or 'close'
-        if self.proxy:
-            proxytype, proxyauth, proxynetloc, proxypath, proxyfragment = _parse_uri(self.proxy)
-            proxytype = proxytype.lower()
-            if proxytype not in ('http', 'https'):
-                raise HTTPError("Unsupported proxy type %r" % (proxytype,))
-            proxyheaders = Headers(self.headers)
-            if proxyauth:
-                proxyauth = re.sub(r"\s", "", base64.encodestring(proxyauth))
-                proxyheaders['Proxy-Authorization'] = 'Basic %s' % proxyauth
-            if 'https' in (scheme, proxytype):
-                address = ((proxytype, proxynetloc), (scheme, netloc))
+        if self.expectcontinue is not None and body is not None and version >= (1, 1) and 'Expect' not in request.headers:
+            if isinstance(body, basestring):
+                size = len(body)
             else:
-                request.target = url
-                request.headers.update(proxyheaders)
-                address = ((proxytype, proxynetloc),)
-        else:
-            address = ((scheme, netloc),)
-        if self.__current_address != address:
-            self.close()
-        if self.__current_client is None:
-            tscheme, tnetloc = address[0]
-            sock = self.create_socket(_parse_netloc(tnetloc, tscheme == 'https' and 443 or 80), self.timeout)
-            if self.proxy and 'https' in (scheme, proxytype):
-                tscheme, tnetloc = address[1]
-                sock = HTTPProxyClient(sock, proxyheaders)
-                sock.connect(_parse_netloc(tnetloc, tscheme == 'https' and 443 or 80))
-            if scheme == 'https':
-                sock = self.wrap_ssl(sock, keyfile, certfile)
-            client = self.__current_client = HTTPClient(sock, sizelimit=self.sizelimit, bodylimit=self.bodylimit)
-            self.__current_address = address
+                # size of a file is only known from Content-Length
+                size = request.headers.get('Content-Length', '').strip()
+                size = size.isdigit() and int(size) or None
+            if size is None or size >= self.expectcontinue:
+                request.headers['Expect'] = '100-continue'
+        upstream = endpoint = None
+        if self.upstreams:
+            upstream = self.upstreams.get(netloc.split(':', 1)[0].lower())
+            if upstream is not None:
+                endpoint = upstream.choose()
+        target = endpoint is None and netloc or endpoint.netloc
+        address, tunnel, proxyauthorization = self.__route(scheme, target)
+        if self.__proxyconfig is not None and not tunnel and scheme != 'http+unix':
+            request.target = endpoint is None and url or '%s://%s%s' % (scheme, target, path or '/')
+            if proxyauthorization:
+                request.headers['Proxy-Authorization'] = proxyauthorization
+        if endpoint is None:
+            return self.__exchange(url, request, address, scheme, tunnel, proxyauthorization, keyfile, certfile, ignore_content_length, output, expires, attempt)
+        upstream.start(endpoint)
+        try:
+            response = self.__exchange(url, request, address, scheme, tunnel, proxyauthorization, keyfile, certfile, ignore_content_length, output, expires, attempt)
+        except Exception, e:
+            cancelled = attempt is not None and attempt.cancelled
+            if upstream.finish(endpoint, failed=not cancelled and isinstance(e, self.endpoint_errors)):
+                self.__eject(address, endpoint)
+            raise
+        timing = response.timing
+        latency = timing is not None and timing.headers is not None and timing.headers - timing.start or None
+        if upstream.finish(endpoint, latency, failed=response.code in upstream.failureCodes):
+            self.__eject(address, endpoint)
+        return response
+    
+    def __eject(self, address, endpoint):
+        if self.observers:
+            notify(self.observers, 'upstream.ejected', netloc=endpoint.netloc, failures=endpoint.failures)
+        self.pool.discard(address, 'ejected')
+    
+    def __exchange(self, url, request, address, scheme, tunnel, proxyauthorization, keyfile, certfile, ignore_content_length, output, expires, attempt):
+        """Sends request over a pooled or new connection to address"""
+        method = request.method
+        timing = Timing(url)
+        client = self.pool.acquire(address)
+        if self.minidle:
+            self.__warm(url, address, scheme, tunnel, proxyauthorization, keyfile, certfile, self.minidle)
+        if client is None:
+            client = self.__connect(address, scheme, tunnel, proxyauthorization, keyfile, certfile, timing, expires)
         else:
-            client = self.__current_client
+            timing.reused = True
             client.sizelimit = self.sizelimit
             client.bodylimit = self.bodylimit
-        try:
-            response = client.makeRequest(request)
-        except:
-            self.close()
-            raise
+            client.lazyheaders = self.lazyheaders
+            client.packetsize = self.__packetsize()
+            if self.observers:
+                notify(self.observers, 'connection.reused', address=address)
+        if self.observers:
+            notify(self.observers, 'request.started', url=url, method=method)
+        while True:
+            if attempt is not None:
+                attempt.attach(client, timing)
+            readtimeout = self.readtimeout
+            if readtimeout is None:
+                readtimeout = self.timeout
+            client.sock.settimeout(readtimeout)
+            client.readtimeout = readtimeout
+            client.deadline = expires
+            client.continuetimeout = self.continuetimeout
+            received = client.bytesreceived
+            try:
+                response = client.makeRequest(request, output, timing)
+                break
+            except Exception, e:
+                client.close()
+                if attempt is not None and attempt.detach():
+                    if self.observers:
+                        notify(self.observers, 'connection.closed', address=address, reason='hedge-cancelled')
+                    raise
+                if self.observers:
+                    notify(self.observers, 'connection.closed', address=address, reason='error')
+                # A reused connection may have been closed by the server
+                # while the request was in flight, in which case nothing
+                # has been received and it is safe to retry once.
+                if not timing.reused or client.bytesreceived != received or not self.__isRetryable(request, e):
+                    if self.observers:
+                        notify(self.observers, 'request.failed', url=url, method=method, error=e)
+                    raise
+                if self.observers:
+                    notify(self.observers, 'request.retried', url=url, method=method, error=e)
+            timing = Timing(url)
+            client = self.__connect(address, scheme, tunnel, proxyauthorization, keyfile, certfile, timing, expires)
+        if self.observers:
+            notify(self.observers, 'request.finished', url=url, method=method, code=response.code, timing=timing)
         keepalive = response.version >= (1, 1)
+        reason = keepalive and 'keep-alive' or 'http/1.0'
         connection = response.headers.get('Connection')
         if connection:
             connection = [value.strip().lower() for value in connection.split(',')]
@@ -393,64 +1029,379 @@ class Agent(object):
                 keepalive = True
             if 'close' in connection:
                 keepalive = False
+                reason = 'server-close'
         if ignore_content_length:
             keepalive = False
-        if not keepalive or (not self.keepalive and self.keepalive is not None):
-            self.close()
+            reason = 'ignore-content-length'
+        if client.bodyskipped:
+            # the server is still waiting for the body it has rejected
+            keepalive = False
+            reason = 'body-skipped'
+        if keepalive and not self.keepalive and self.keepalive is not None:
+            keepalive = False
+            reason = 'keepalive-disabled'
+        if attempt is not None and attempt.detach():
+            # the socket may have been shut down by the winner
+            keepalive = False
+            reason = 'hedge-cancelled'
+        if not keepalive:
+            client.close()
+            if self.observers:
+                notify(self.observers, 'connection.closed', address=address, reason=reason)
+        else:
+            self.pool.release(address, client)
         return response
     
+    def __fetchRetrying(self, url, headers, kwargs):
+        policy = self.retry
+        body = kwargs.get('body')
+        if policy is None or kwargs.get('output') is not None or (body is not None and not isinstance(body, basestring)):
+            return self.__fetch(url, headers, kwargs)
+        method = kwargs.get('method', 'GET')
+        if policy.budget is not None:
+            policy.budget.request()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = self.__fetch(url, headers, kwargs)
+                error = None
+            except Exception:
+                response, error = None, sys.exc_info()
+            delay = policy.delay(attempt, method, response, error and error[1])
+            expires = kwargs.get('expires')
+            if delay is not None and expires is not None and monotonic() + delay >= expires:
+                # the request would not finish in time anyway
+                delay = None
+            if delay is not None and policy.budget is not None and not policy.budget.withdraw():
+                if self.observers:
+                    notify(self.observers, 'retry.denied', url=url, method=method, attempt=attempt)
+                delay = None
+            if delay is None:
+                if error is not None:
+                    raise error[0], error[1], error[2]
+                return response
+            if self.observers:
+                notify(self.observers, 'request.retry', url=url, method=method, attempt=attempt, delay=delay,
+                    code=response and response.code, error=error and error[1])
+            time.sleep(delay)
+    
+    def __fetch(self, url, headers, kwargs):
+        coalescer = self.coalescer
+        method = kwargs.get('method', 'GET')
+        if coalescer is None or method not in ('GET', 'HEAD') or kwargs.get('body') is not None or kwargs.get('output') is not None:
+            return self.__fetchCached(url, headers, kwargs)
+        requestheaders = Headers(self.headers)
+        requestheaders.update(headers)
+        key = (method, url.split('#', 1)[0],
+            tuple(sorted((name.lower(), value) for (name, value) in requestheaders.iteritems())),
+            tuple(sorted(item for item in kwargs.iteritems() if item[0] != 'expires')))
+        return coalescer.call(key, self.__fetchCached, url, headers, kwargs)
+    
+    def __makeHedgedRequest(self, url, **kwargs):
+        hedge = self.hedge
+        if hedge is None or kwargs.get('method', 'GET') not in ('GET', 'HEAD') or kwargs.get('body') is not None or kwargs.get('output') is not None:
+            return self.__makeRequest(url, **kwargs)
+        import Queue
+        host = self.__parseURL(url)[1]
+        if hedge.budget is not None:
+            hedge.budget.request()
+        results = Queue.Queue()
+        attempts = []
+        def run(attempt):
+            try:
+                response = self.__makeRequest(url, attempt=attempt, **kwargs)
+            except Exception:
+                results.put((attempt, None, sys.exc_info()))
+            else:
+                results.put((attempt, response, None))
+        def start():
+            attempt = _Attempt()
+            attempts.append(attempt)
+            thread = threading.Thread(target=run, args=(attempt,))
+            thread.daemon = True
+            thread.start()
+        delay = hedge.delay(host)
+        start()
+        outstanding = 1
+        waiting = True
+        while True:
+            if waiting:
+                # only the first wait is bounded by the hedging delay
+                try:
+                    attempt, response, error = results.get(timeout=delay)
+                except Queue.Empty:
+                    waiting = False
+                    if not attempts[0].responding() and (hedge.budget is None or hedge.budget.withdraw()):
+                        if self.observers:
+                            notify(self.observers, 'request.hedged', url=url, delay=delay)
+                        start()
+                        outstanding += 1
+                    continue
+            else:
+                attempt, response, error = results.get()
+            waiting = False
+            outstanding -= 1
+            if error is None or not outstanding:
+                break
+        for other in attempts:
+            if other is not attempt:
+                other.cancel()
+        if error is not None:
+            raise error[0], error[1], error[2]
+        timing = response.timing
+        if timing is not None and timing.headers is not None:
+            hedge.observe(host, timing.headers - timing.start)
+        return response
+    
+    def __fetchCached(self, url, headers, kwargs):
+        cache = self.cache
+        if cache is None or kwargs.get('output') is not None:
+            return self.__makeHedgedRequest(url, headers=headers, **kwargs)
+        method = kwargs.get('method', 'GET')
+        if method != 'GET':
+            response = self.__makeHedgedRequest(url, headers=headers, **kwargs)
+            if method != 'HEAD' and response.code < 400:
+                # unsafe methods invalidate stored responses
+                cache.invalidate(url)
+            return response
+        requestheaders = Headers(self.headers)
+        requestheaders.update(headers)
+        def send(validators):
+            if validators:
+                conditional = Headers(headers)
+                conditional.update(validators)
+                return self.__makeHedgedRequest(url, headers=conditional, **kwargs)
+            return self.__makeHedgedRequest(url, headers=headers, **kwargs)
+        return cache.request(url, requestheaders, send)
+    
+    def __schedulingKey(self, url):
+        return self.__parseURL(url.strip())[1].lower()
+    
     def makeRequest(self, url, **kwargs):
+        priority = kwargs.pop('priority', 0)
+        return self.__makeRequestChain(url, kwargs, priority)
+    
+    def __makeRequestChain(self, url, kwargs, priority=0, held=None):
+        """Follows redirects, held is the scheduling key of a slot already acquired by the caller"""
+        scheduler = self.scheduler
+        if scheduler is None:
+            return self.__followRedirects(url, kwargs, None)
+        # retries run within the slot of their hop, redirects to
+        # other hosts wait for a slot of the new host
+        slot = [held]
+        def schedule(url):
+            host = self.__schedulingKey(url)
+            if host != slot[0]:
+                if slot[0] is not None:
+                    scheduler.release(slot[0])
+                    slot[0] = None
+                scheduler.acquire(host, priority)
+                slot[0] = host
+        try:
+            return self.__followRedirects(url, kwargs, schedule)
+        finally:
+            if slot[0] is not None:
+                scheduler.release(slot[0])
+    
+    def __followRedirects(self, url, kwargs, schedule):
         url = url.strip()
         urlchain = []
+        timings = []
         headers = Headers(kwargs.pop('headers', ()))
         redirectlimit = kwargs.pop('redirectlimit', self.redirectlimit)
+        deadline = kwargs.pop('deadline', self.deadline)
+        if deadline is not None:
+            # the deadline covers all redirects and retries
+            kwargs['expires'] = monotonic() + deadline
         while True:
-            response = self.__makeRequest(url, headers=headers, **kwargs)
+            if schedule is not None:
+                schedule(url)
+            response = self.__fetchRetrying(url, headers, kwargs)
+            if response.timing is None:
+                # served without network activity
+                response.timing = Timing(url)
+                response.timing.mark('done')
             urlchain.append(url)
+            timings.append(response.timing)
             if response.code in (301, 302, 303, 307) and redirectlimit > 0:
                 redirectlimit -= 1
                 location = response.headers.getlist('Location')
                 if location:
                     location = location[0].strip()
                 if location:
+                    if self.observers:
+                        notify(self.observers, 'redirect', url=url, location=location, code=response.code)
                     for name in self.no_redirect_headers:
                         headers.poplist(name, None)
                     for name in headers.keys():
                         if name.startswith('If-'):
                             headers.poplist(name, None)
                     kwargs['referer'] = url
-                    url = urlparse.urljoin(url, location)
+                    url = _join_url(url, location)
                     kwargs['method'] = 'GET'
                     kwargs['body'] = None
                     continue
             break
         response.urlchain = urlchain
+        response.timings = timings
         response.url = url
         return response
+    
+    def download(self, url, filename, validator=None, retries=3, **kwargs):
+        from kitsu.http.download import Download
+        return Download(self, url, filename, validator=validator, retries=retries).run(**kwargs)
+    
+    def fetch_many(self, urls, concurrency=4, ordered=False, **kwargs):
+        """Fetches urls (or (url, options) pairs) concurrently, yields (url, response or exception)"""
+        # Threads become greenlets when gevent or eventlet monkey patching is active.
+        # Closing the generator cancels requests that have not started yet.
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1, got %r" % (concurrency,))
+        import Queue
+        jobs = []
+        for url in urls:
+            if isinstance(url, basestring):
+                options = kwargs
+            else:
+                url, options = url
+                options = dict(kwargs, **options)
+            jobs.append((len(jobs), url, options))
+        jobs.reverse()
+        count = len(jobs)
+        results = Queue.Queue()
+        cancelled = threading.Event()
+        scheduler = self.scheduler
+        if scheduler is not None:
+            # jobs are handed out to workers as soon as their hosts have capacity
+            batch = scheduler.batch()
+            while jobs:
+                job = jobs.pop()
+                options = dict(job[2])
+                priority = options.pop('priority', 0)
+                try:
+                    host = self.__schedulingKey(job[1])
+                except Exception:
+                    # the request fails with the same error once it runs
+                    host = ''
+                batch.submit(host, (job[0], job[1], options, priority), priority)
+            batch.close()
+        def worker():
+            while not cancelled.is_set():
+                if scheduler is None:
+                    try:
+                        index, url, options = jobs.pop()
+                    except IndexError:
+                        break
+                    try:
+                        result = self.makeRequest(url, **options)
+                    except Exception, e:
+                        result = e
+                else:
+                    job = batch.next()
+                    if job is None:
+                        break
+                    host, (index, url, options, priority) = job
+                    try:
+                        result = self.__makeRequestChain(url, dict(options), priority, host)
+                    except Exception, e:
+                        result = e
+                results.put((index, url, result))
+        workers = []
+        for i in xrange(min(concurrency, count)):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            workers.append(thread)
+        try:
+            pending = {}
+            nextindex = 0
+            for i in xrange(count):
+                index, url, result = results.get()
+                if not ordered:
+                    yield url, result
+                    continue
+                pending[index] = (url, result)
+                while nextindex in pending:
+                    yield pending.pop(nextindex)
+                    nextindex += 1
+        finally:
+            cancelled.set()
+            if scheduler is not None:
+                batch.cancel()
 
 class Connector(object):
-    def __init__(self, proxy=None, headers=(), timeout=30):
+    def __init__(self, proxy=None, headers=(), timeout=30, observers=(), sockopts=None, upstreams=None, poolsize=10, minidle=0, capture=None):
         self.proxy = proxy
         self.headers = Headers(headers)
         self.timeout = timeout
+        self.sockopts = sockopts
+        self.capture = capture
+        self.upstreams = dict((name.lower(), upstream) for (name, upstream) in (upstreams or {}).iteritems())
+        self.observers = list(observers)
+        # preconnected sockets, wrapped in clients for staleness checks
+        self.pool = ConnectionPool(poolsize, self.observers)
+        self.minidle = minidle
+        self.__warmer = _Warmer(self.pool, self.observers)
         self.create_socket = create_socket
         self.wrap_ssl = wrap_ssl
     
+    def close(self):
+        self.pool.clear()
+    
+    def __createSocket(self, address):
+        if self.sockopts is None:
+            return self.create_socket(address, self.timeout)
+        return self.create_socket(address, self.timeout, self.sockopts)
+    
+    def __warm(self, address, ssl, keyfile, certfile, count):
+        def connect():
+            return HTTPClient(self.__open(address, ssl, keyfile, certfile))
+        return self.__warmer.warm((address, ssl, keyfile, certfile), count, connect)
+    
+    def preconnect(self, addresses, count=1, ssl=False, keyfile=None, certfile=None):
+        """Opens up to count idle connections per address in the background, returns the started threads"""
+        threads = []
+        for address in addresses:
+            threads.extend(self.__warm(address, ssl, keyfile, certfile, count))
+        return threads
+    
     def connect(self, address, ssl=False, keyfile=None, certfile=None):
-        if self.proxy:
-            proxytype, proxyauth, proxynetloc, proxypath, proxyfragment = _parse_uri(self.proxy)
-            proxytype = proxytype.lower()
-            if proxytype not in ('http', 'https'):
-                raise HTTPError("Unsupported proxy type %r" % (proxytype,))
+        client = self.pool.acquire((address, ssl, keyfile, certfile))
+        if self.minidle:
+            self.__warm(address, ssl, keyfile, certfile, self.minidle)
+        if client is not None:
+            return client.detach()
+        return self.__open(address, ssl, keyfile, certfile)
+    
+    def __open(self, address, ssl, keyfile, certfile):
+        upstream = self.upstreams and not isinstance(address, basestring) and self.upstreams.get(address[0].lower())
+        if not upstream:
+            return self.__connect(address, ssl, keyfile, certfile)
+        endpoint = upstream.choose()
+        upstream.start(endpoint)
+        try:
+            sock = self.__connect(_parse_netloc(endpoint.netloc, address[1]), ssl, keyfile, certfile)
+        except Agent.endpoint_errors:
+            if upstream.finish(endpoint, failed=True) and self.observers:
+                notify(self.observers, 'upstream.ejected', netloc=endpoint.netloc, failures=endpoint.failures)
+            raise
+        upstream.finish(endpoint)
+        return sock
+    
+    def __connect(self, address, ssl, keyfile, certfile):
+        if self.proxy and not isinstance(address, basestring):
+            proxytype, proxynetloc, proxyauthorization = _parse_proxy(self.proxy)
             proxyheaders = Headers(self.headers)
-            if proxyauth:
-                proxyauth = re.sub(r"\s", "", base64.encodestring(proxyauth))
-                proxyheaders['Proxy-Authorization'] = 'Basic %s' % proxyauth
-            sock = self.create_socket(_parse_netloc(proxynetloc, proxytype == 'https' and 443 or 80), self.timeout)
-            sock = HTTPProxyClient(sock, proxyheaders)
+            if proxyauthorization:
+                proxyheaders['Proxy-Authorization'] = proxyauthorization
+            sock = self.__createSocket(_parse_netloc(proxynetloc, proxytype == 'https' and 443 or 80))
+            sock = HTTPProxyClient(sock, proxyheaders, self.capture)
             sock.connect(address)
         else:
-            sock = self.create_socket(address, self.timeout)
+            sock = self.__createSocket(address)
         if ssl:
             sock = self.wrap_ssl(sock, keyfile, certfile)
+        if self.observers:
+            notify(self.observers, 'connection.opened', address=address)
         return sock
@@ -0,0 +1,55 @@
+__all__ = [
+    'Coalescer',
+]
+
+import sys
+import threading
+from kitsu.http.response import Response
+
+class _Call(object):
+    __slots__ = ('event', 'result', 'error')
+    
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+def _share(response):
+    """Returns a copy of response sharing the same read-only body"""
+    copy = Response(version=response.version, code=response.code, phrase=response.phrase, headers=response.headers, body=response.body)
+    copy.interim = list(response.interim)
+    copy.timing = response.timing
+    return copy
+
+class Coalescer(object):
+    """Shares a single call between concurrent callers with the same key"""
+    
+    def __init__(self, share=_share):
+        self.share = share
+        self.__lock = threading.Lock()
+        self.__calls = {}
+    
+    def __len__(self):
+        return len(self.__calls)
+    
+    def call(self, key, function, *args, **kwargs):
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.__calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error[0], call.error[1], call.error[2]
+            return self.share(call.result)
+        try:
+            call.result = function(*args, **kwargs)
+        except:
+            call.error = sys.exc_info()
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call.event.set()
+        return call.result
@@ -146,6 +146,17 @@ class CompoundDecoder(Parser):
     requestMethodsWithoutBody = frozenset(('HEAD', 'CONNECT'))
     responseCodesWithoutBody = frozenset((204, 304))
     
+    @classmethod
+    def from_request(cls, request):
+        """Returns a decoder for the body of request or None"""
+        encodings = request.headers.get('Transfer-Encoding')
+        if encodings and 'chunked' in encodings.lower():
+            return cls(ChunkedDecoder())
+        contentLength = request.headers.get('Content-Length', '').strip()
+        if contentLength.isdigit() and int(contentLength):
+            return cls(IdentityDecoder(int(contentLength)))
+        return None
+    
     @classmethod
     def from_response(cls, request, response):
         # process Content-Length
@@ -0,0 +1,140 @@
+__all__ = [
+    'Download',
+]
+
+import os
+import socket
+from kitsu.http.errors import *
+from kitsu.http.headers import Headers
+from kitsu.http.client import _join_url, _parse_uri
+
+def _parse_content_range(value):
+    """Parses 'bytes start-end/total' into (start, end, total)"""
+    if not value:
+        return None
+    parts = value.strip().split(None, 1)
+    if len(parts) != 2 or parts[0].lower() != 'bytes':
+        return None
+    span, _, total = parts[1].partition('/')
+    try:
+        total = total.strip() != '*' and int(total) or None
+        if span.strip() == '*':
+            return None, None, total
+        start, end = span.split('-', 1)
+        return int(start), int(end), total
+    except ValueError:
+        return None
+
+def _origin(url):
+    scheme, auth, netloc, path, fragment = _parse_uri(url)
+    return scheme.lower(), netloc.lower()
+
+def _get_validator(response):
+    """Returns a validator suitable for If-Range, if any"""
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        # If-Range requires a strong validator
+        return etag
+    return response.headers.get('Last-Modified')
+
+class Download(object):
+    """Resumable download of a url into a file"""
+    
+    redirectCodes = frozenset((301, 302, 303, 307))
+    crossOriginHeaders = ('Cookie', 'Proxy-Authorization')
+    retryErrors = (HTTPDataError, HTTPTimeoutError, socket.error)
+    
+    def __init__(self, agent, url, filename, validator=None, retries=3):
+        self.agent = agent
+        self.url = url
+        self.filename = filename
+        self.validator = validator
+        self.retries = retries
+        self.__file = None
+    
+    @property
+    def offset(self):
+        try:
+            return os.path.getsize(self.filename)
+        except OSError:
+            return 0
+    
+    def __open(self, mode):
+        self.__file = open(self.filename, mode)
+        return self.__file
+    
+    def __close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+    
+    def __output(self, offset):
+        def output(response):
+            if response.code == 206:
+                contentRange = _parse_content_range(response.headers.get('Content-Range'))
+                if not contentRange or contentRange[0] != offset:
+                    # start over on the next attempt
+                    self.validator = None
+                    raise HTTPDataError("unexpected Content-Range: %r" % (response.headers.get('Content-Range'),))
+                if not offset:
+                    # a range starting at zero is the whole file
+                    self.validator = _get_validator(response)
+                    return self.__open('wb')
+                return self.__open('ab')
+            if response.code == 200:
+                self.validator = _get_validator(response)
+                return self.__open('wb')
+            return None
+        return output
+    
+    def __download(self, url, headers=(), redirectlimit=None, **kwargs):
+        headers = Headers(headers)
+        offset = self.offset
+        if offset and self.validator:
+            headers['Range'] = 'bytes=%d-' % offset
+            headers['If-Range'] = self.validator
+        else:
+            offset = 0
+        if redirectlimit is None:
+            redirectlimit = self.agent.redirectlimit
+        while True:
+            try:
+                response = self.agent.makeRequest(url, headers=headers, redirectlimit=0, output=self.__output(offset), **kwargs)
+            finally:
+                self.__close()
+            if response.code in self.redirectCodes and redirectlimit > 0:
+                location = response.headers.getlist('Location')
+                if location and location[0].strip():
+                    redirectlimit -= 1
+                    kwargs['referer'] = url
+                    location = _join_url(url, location[0].strip())
+                    if _origin(location) != _origin(url):
+                        # credentials must not leak to other origins, the range is still needed
+                        for name in self.agent.no_redirect_headers + self.crossOriginHeaders:
+                            if name not in ('Range', 'If-Range'):
+                                headers.poplist(name, None)
+                    url = location
+                    continue
+            break
+        if response.code in (200, 206):
+            # body has been written to the file
+            response.body = None
+        elif response.code == 416 and offset:
+            contentRange = _parse_content_range(response.headers.get('Content-Range'))
+            if not contentRange or contentRange[2] != offset:
+                # partial file is no longer valid
+                self.validator = None
+        return response
+    
+    def run(self, **kwargs):
+        """Downloads the url, returns the final response (416 if file is already complete)"""
+        retries = self.retries
+        while True:
+            try:
+                return self.__download(self.url, **kwargs)
+            except self.retryErrors:
+                if retries <= 0:
+                    raise
+                retries -= 1
+    
+    resume = run
@@ -6,6 +6,8 @@ __all__ = [
     'HTTPTimeoutError',
 ]
 
+import socket
+
 class HTTPError(Exception):
     def __str__(self):
         cls = type(self)
@@ -24,5 +26,13 @@ class HTTPDataError(HTTPError):
 class HTTPLimitError(HTTPError):
     """Data limit exceeded"""
 
-class HTTPTimeoutError(HTTPError):
+class HTTPTimeoutError(HTTPError, socket.timeout):
     """Timeout limit exceeded"""
+    
+    # socket.timeout base keeps handlers written for plain sockets working
+    
+    def __init__(self, phase=None, *args):
+        if phase is not None:
+            args = (phase,) + args
+        HTTPError.__init__(self, *args)
+        self.phase = phase
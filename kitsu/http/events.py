@@ -0,0 +1,168 @@
+__all__ = [
+    'notify',
+    'Histogram',
+    'Metrics',
+    'StatsdSink',
+]
+
+import socket
+import threading
+
+def notify(observers, event, **info):
+    """Calls observer(event, info) for every observer"""
+    for observer in observers:
+        observer(event, info)
+
+class Histogram(object):
+    """Fixed-bucket histogram of observed values"""
+    
+    # seconds, roughly exponential from 100us to 60s
+    defaultBounds = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    
+    def __init__(self, bounds=defaultBounds):
+        self.bounds = tuple(bounds)
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+    
+    def add(self, value):
+        index = 0
+        for bound in self.bounds:
+            if value <= bound:
+                break
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+    
+    def percentile(self, fraction):
+        """Returns upper bound of the bucket holding the given fraction of values"""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                if index < len(self.bounds):
+                    return min(self.bounds[index], self.max)
+                return self.max
+        return self.max
+    
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.count and float(self.sum) / self.count or None,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'buckets': zip(self.bounds + (None,), self.buckets),
+        }
+
+class Metrics(object):
+    """Observer aggregating events into counters and latency histograms"""
+    
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+    
+    def increment(self, name, value=1):
+        with self.__lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+    
+    def observe(self, name, value):
+        with self.__lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(value)
+    
+    def __call__(self, event, info):
+        if event == 'bytes':
+            self.increment('bytes.in', info.get('received', 0))
+            self.increment('bytes.out', info.get('sent', 0))
+            return
+        self.increment(event)
+        if event == 'connection.closed':
+            self.increment('connection.closed.%s' % info.get('reason', 'unknown'))
+        elif event == 'request.finished':
+            self.increment('response.%dxx' % (info['code'] // 100))
+            timing = info.get('timing')
+            if timing is not None:
+                if timing.total is not None:
+                    self.observe('request.latency', timing.total)
+                for phase, duration in timing.durations():
+                    self.observe('request.%s' % phase, duration)
+    
+    def snapshot(self, reset=False):
+        """Returns counters, derived gauges and histogram summaries"""
+        with self.__lock:
+            counters = dict(self.counters)
+            histograms = dict((name, histogram.snapshot()) for (name, histogram) in self.histograms.iteritems())
+            if reset:
+                self.counters = {}
+                self.histograms = {}
+        gauges = {}
+        opened = counters.get('connection.opened', 0)
+        reused = counters.get('connection.reused', 0)
+        if opened or reused:
+            gauges['pool.hit_ratio'] = float(reused) / (opened + reused)
+        return {
+            'counters': counters,
+            'gauges': gauges,
+            'histograms': histograms,
+        }
+    
+    def flush(self, sink):
+        """Sends snapshot to the sink and resets all values"""
+        snapshot = self.snapshot(reset=True)
+        sink.send(snapshot)
+        return snapshot
+
+class StatsdSink(object):
+    """Sends metrics snapshots to a statsd server over UDP"""
+    
+    def __init__(self, host='127.0.0.1', port=8125, prefix='kitsu.http', packetsize=512):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.packetsize = packetsize
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    
+    def close(self):
+        self.sock.close()
+    
+    def lines(self, snapshot):
+        prefix = self.prefix and self.prefix + '.' or ''
+        for name, value in sorted(snapshot['counters'].iteritems()):
+            yield '%s%s:%d|c' % (prefix, name, value)
+        for name, value in sorted(snapshot['gauges'].iteritems()):
+            yield '%s%s:%g|g' % (prefix, name, value)
+        for name, histogram in sorted(snapshot['histograms'].iteritems()):
+            yield '%s%s.count:%d|c' % (prefix, name, histogram['count'])
+            for key in ('mean', 'p50', 'p90', 'p99', 'max'):
+                if histogram[key] is not None:
+                    # statsd timers are in milliseconds
+                    yield '%s%s.%s:%g|ms' % (prefix, name, key, histogram[key] * 1000)
+    
+    def send(self, snapshot):
+        packet = []
+        size = 0
+        for line in self.lines(snapshot):
+            if packet and size + len(line) + 1 > self.packetsize:
+                self.sock.sendto('\n'.join(packet), self.address)
+                packet = []
+                size = 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            self.sock.sendto('\n'.join(packet), self.address)
@@ -1,7 +1,9 @@
 __all__ = [
     'Headers',
+    'LazyHeaders',
 ]
 
+import threading
 from kitsu.http.errors import *
 
 _canonicalHeaderParts = { 'www' : 'WWW' }
@@ -306,3 +308,115 @@ class Headers(object):
             if self.__partialHeader:
                 self.__partialHeader.append(line)
         return line and True or False
+
+_materializeLock = threading.Lock()
+
+class LazyHeaders(Headers):
+    """Headers that keep raw parsed lines until first access to non-framing fields"""
+    __slots__ = ('__lines', '__index')
+    
+    framingKeys = frozenset(('content-length', 'transfer-encoding', 'connection'))
+    
+    def __init__(self, data=(), encoding='utf-8'):
+        self.__lines = []
+        self.__index = {}
+        Headers.__init__(self, data, encoding)
+    
+    @property
+    def materialized(self):
+        return self.__lines is None
+    
+    def materialize(self):
+        if self.__lines is None:
+            return
+        # Responses shared between threads may be materialized concurrently,
+        # other threads must not see the headers before they are complete.
+        with _materializeLock:
+            lines = self.__lines
+            if lines is None:
+                return
+            if lines:
+                parsed = Headers(encoding=self.encoding)
+                for line in lines:
+                    parsed.parseLine(line)
+                parsed.parseFlush()
+                for name, value in parsed.iteritems():
+                    Headers.add(self, name, value)
+            self.__index = None
+            self.__lines = None
+    
+    def __framing(self, name):
+        """Returns indexed values of a framing header, or None if not possible"""
+        if self.__lines is None or self.__index is None:
+            return None
+        if not isinstance(name, basestring):
+            return None
+        key = name.lower()
+        if key not in self.framingKeys:
+            return None
+        return self.__index.get(key, ())
+    
+    def parseLine(self, line):
+        lines = self.__lines
+        if lines is None:
+            return Headers.parseLine(self, line)
+        if not line:
+            return False
+        if line[0] in ' \t':
+            if lines and self.__index is not None:
+                key = lines[-1].split(':', 1)[0].rstrip().lower()
+                if key in self.framingKeys:
+                    # folded framing header, give up on the index
+                    self.__index = None
+            lines.append(line)
+            return True
+        parts = line.split(':', 1)
+        if len(parts) == 2:
+            key = parts[0].rstrip().lower()
+            if key in self.framingKeys and self.__index is not None:
+                self.__index.setdefault(key, []).append(parts[1].strip())
+        lines.append(line)
+        return True
+    
+    def __contains__(self, name):
+        values = self.__framing(name)
+        if values is not None:
+            return bool(values)
+        self.materialize()
+        return Headers.__contains__(self, name)
+    
+    def getlist(self, name, default=nil):
+        values = self.__framing(name)
+        if values is not None:
+            if values:
+                return list(values)
+            if default is nil:
+                return []
+            return default
+        self.materialize()
+        return Headers.getlist(self, name, default)
+    
+    def get(self, name, default=None):
+        values = self.__framing(name)
+        if values is not None:
+            if values:
+                return ', '.join(values)
+            return default
+        self.materialize()
+        return Headers.get(self, name, default)
+
+def _materializing(name):
+    method = getattr(Headers, name)
+    def wrapper(self, *args, **kwargs):
+        if not self.materialized:
+            self.materialize()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+for _name in ('__getitem__', '__setitem__', '__delitem__', '__iter__', 'iterkeys', 'itervalues', 'iteritems',
+        'keys', 'values', 'items', 'poplist', 'pop', 'setdefault', 'setdefaultlist', 'add', 'clear', 'update',
+        'toLines', 'toString', '__str__', '__repr__', 'parseClear', 'parseFlush'):
+    setattr(LazyHeaders, _name, _materializing(_name))
+del _name
@@ -0,0 +1,52 @@
+__all__ = [
+    'HedgePolicy',
+]
+
+import threading
+from kitsu.http.events import Histogram
+from kitsu.http.retry import RetryBudget
+
+class HedgePolicy(object):
+    """Decides when a slow idempotent request is sent again on another connection"""
+    
+    def __init__(self, delay=None, percentile=0.95, mindelay=0.005, maxdelay=1.0, initialdelay=0.1, minsamples=20, window=1000, budget=None):
+        self.fixed = delay
+        self.percentile = percentile
+        self.mindelay = mindelay
+        self.maxdelay = maxdelay
+        self.initialdelay = initialdelay
+        self.minsamples = minsamples
+        self.window = window
+        if budget is None:
+            budget = RetryBudget(ratio=0.05, minimum=1)
+        self.budget = budget
+        self.__lock = threading.Lock()
+        self.__hosts = {} # host -> [histogram, last estimate]
+    
+    def observe(self, host, seconds):
+        """Records time to response headers for host"""
+        with self.__lock:
+            state = self.__hosts.get(host)
+            if state is None:
+                state = self.__hosts[host] = [Histogram(), None]
+            histogram = state[0]
+            histogram.add(seconds)
+            if histogram.count >= self.window:
+                # start over, so estimates follow changes in latency
+                state[0] = Histogram()
+                state[1] = histogram.percentile(self.percentile)
+    
+    def delay(self, host):
+        """Returns seconds to wait for response headers before hedging"""
+        if self.fixed is not None:
+            return self.fixed
+        with self.__lock:
+            state = self.__hosts.get(host)
+            if state is None:
+                return self.initialdelay
+            histogram, estimate = state
+            if histogram.count >= self.minsamples:
+                estimate = histogram.percentile(self.percentile)
+        if estimate is None:
+            return self.initialdelay
+        return max(self.mindelay, min(self.maxdelay, estimate))
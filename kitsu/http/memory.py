@@ -0,0 +1,208 @@
+__all__ = [
+    'MemorySocket',
+    'MemoryTransport',
+]
+
+import time
+import errno
+import socket
+import threading
+from collections import deque
+from kitsu.http.headers import Headers
+from kitsu.http.request import RequestParser
+from kitsu.http.response import Response
+from kitsu.http.decoders import CompoundDecoder
+from kitsu.http.timing import monotonic
+
+def _serialize(response):
+    """Returns (packets, close) for a scripted or generated response"""
+    if isinstance(response, basestring):
+        return [response], False
+    if isinstance(response, (list, tuple)):
+        # packets with explicit boundaries
+        return list(response), False
+    body = response.body or ''
+    headers = response.headers
+    if 'Content-Length' not in headers and 'Transfer-Encoding' not in headers and response.code not in (204, 304) and response.code >= 200:
+        headers = Headers(headers)
+        headers['Content-Length'] = str(len(body))
+        response = Response(response.version, response.code, response.phrase, headers)
+    close = 'close' in headers.get('Connection', '').lower()
+    return [response.toString() + body], close
+
+class _Connection(object):
+    """Server end of a memory socket"""
+    __slots__ = ('transport', 'parser', 'request', 'decoder', 'body')
+    
+    def __init__(self, transport):
+        self.transport = transport
+        self.parser = RequestParser()
+        self.request = None
+        self.decoder = None
+        self.body = []
+    
+    def feed(self, data):
+        """Consumes data sent by the client, returns (packets, close)"""
+        output = []
+        while data:
+            if self.decoder is None:
+                requests = self.parser.parse(data)
+                if not requests:
+                    break
+                self.request = requests[0]
+                data = self.parser.clear()
+                self.parser = RequestParser()
+                self.decoder = CompoundDecoder.from_request(self.request)
+            if self.decoder is not None:
+                for chunk in self.decoder.parse(data):
+                    if not isinstance(chunk, Headers):
+                        self.body.append(chunk)
+                if not self.decoder.done:
+                    break
+                data = self.decoder.clear()
+            request, self.request = self.request, None
+            request.body = ''.join(self.body)
+            self.decoder = None
+            self.body = []
+            response = self.transport.respond(request)
+            if response is None:
+                # the server closes the connection without an answer
+                return output, True
+            packets, close = _serialize(response)
+            output.extend(packets)
+            if close:
+                return output, True
+        return output, False
+
+class MemorySocket(object):
+    """Client end of an in-memory connection to a MemoryTransport"""
+    
+    def __init__(self, transport, address=None):
+        self.transport = transport
+        self.address = address
+        self.timeout = None
+        self.closed = False
+        self.eof = False
+        self.__server = _Connection(transport)
+        self.__packets = deque() # (delivery time, data)
+    
+    def settimeout(self, timeout):
+        self.timeout = timeout
+    
+    def gettimeout(self):
+        return self.timeout
+    
+    def setblocking(self, flag):
+        self.timeout = not flag and 0.0 or None
+    
+    def setsockopt(self, level, option, value):
+        pass
+    
+    def getpeername(self):
+        return self.address
+    
+    def pending(self):
+        """Returns True if recv would not block, the same way select reports a socket readable"""
+        return bool(self.__packets) or self.eof
+    
+    def sendall(self, data):
+        if self.closed:
+            raise socket.error(errno.EBADF, 'Bad file descriptor')
+        if self.eof:
+            raise socket.error(errno.EPIPE, 'Broken pipe')
+        packets, close = self.__server.feed(data)
+        if packets:
+            transport = self.transport
+            delivery = transport.latency and monotonic() + transport.latency or 0
+            fragment = transport.fragment
+            for packet in packets:
+                if fragment:
+                    for index in xrange(0, len(packet), fragment):
+                        self.__packets.append((delivery, packet[index:index+fragment]))
+                elif packet:
+                    self.__packets.append((delivery, packet))
+        if close:
+            self.eof = True
+    
+    def send(self, data):
+        self.sendall(data)
+        return len(data)
+    
+    def recv(self, size):
+        if self.closed:
+            raise socket.error(errno.EBADF, 'Bad file descriptor')
+        packets = self.__packets
+        if not packets:
+            if self.eof:
+                return ''
+            # the server only answers complete requests, nothing would arrive later
+            raise socket.timeout('timed out')
+        delivery, data = packets[0]
+        if delivery:
+            wait = delivery - monotonic()
+            if wait > 0:
+                if self.timeout is not None and wait > self.timeout:
+                    time.sleep(self.timeout)
+                    raise socket.timeout('timed out')
+                time.sleep(wait)
+        if len(data) > size:
+            packets[0] = (0, data[size:])
+            return data[:size]
+        packets.popleft()
+        return data
+    
+    def shutdown(self, how):
+        self.eof = True
+        self.__packets.clear()
+    
+    def close(self):
+        self.closed = True
+        self.__packets.clear()
+
+class MemoryTransport(object):
+    """In-process server for Agent, Connector and HTTPClient without sockets"""
+    
+    def __init__(self, server, fragment=None, latency=0.0, record=True):
+        # server is a callable receiving each request (with its body) or
+        # a sequence of responses used in order; a response is a Response
+        # with a string body, a raw string, a list of raw packets or None
+        # to close the connection
+        if callable(server):
+            self.handler = server
+        else:
+            script = iter(server)
+            lock = threading.Lock()
+            def handler(request):
+                with lock:
+                    return next(script, None)
+            self.handler = handler
+        self.fragment = fragment
+        self.latency = latency
+        self.record = record
+        self.requests = []
+        self.connections = 0
+    
+    def respond(self, request):
+        if self.record:
+            self.requests.append(request)
+        return self.handler(request)
+    
+    def create_socket(self, address=None, timeout=None, options=None):
+        self.connections += 1
+        sock = MemorySocket(self, address)
+        sock.settimeout(timeout)
+        return sock
+    
+    def resolve_address(self, address):
+        return [address]
+    
+    def wrap_ssl(self, sock, keyfile=None, certfile=None, **kwargs):
+        return sock
+    
+    def install(self, target):
+        """Makes an Agent or Connector use this transport, returns target"""
+        target.create_socket = self.create_socket
+        target.wrap_ssl = self.wrap_ssl
+        if hasattr(target, 'resolve_address'):
+            target.resolve_address = self.resolve_address
+        return target
@@ -8,13 +8,23 @@ from kitsu.http.errors import *
 from kitsu.http.headers import Headers
 from kitsu.http.parsers import LineParser
 
+_versions = {
+    'HTTP/1.0': (1, 0),
+    'HTTP/1.1': (1, 1),
+}
+_internedVersions = dict((version, version) for version in _versions.itervalues())
+_methods = dict((method, method) for method in ('GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'CONNECT', 'OPTIONS', 'TRACE', 'PATCH'))
+
 class Request(object):
+    __slots__ = ('method', 'target', 'version', 'headers', 'body', 'ignore_content_length', '__parserState')
+    
     def __init__(self, method="GET", target="/", version=(1,1), headers=(), body=None):
         self.method = method
         self.target = target
-        self.version = version
+        self.version = _internedVersions.get(version, version)
         self.headers = Headers(headers)
         self.body = body
+        self.ignore_content_length = False
         self.__parserState = 'COMMAND'
     
     def toLines(self, lines=None):
@@ -40,16 +50,19 @@ class Request(object):
         if len(parts) != 3:
             raise HTTPDataError("request must be in 'METHOD target HTTP/n.n' format: %r" % (line,))
         method, target, version = parts
-        if not version.startswith('HTTP/'):
-            raise HTTPDataError("protocol must be HTTP: %r" % (line,))
-        version = version[5:].split('.')
-        if len(version) != 2:
-            raise HTTPDataError("invalid version: %r" % (line,))
-        try:
-            version = (int(version[0]), int(version[1]))
-        except ValueError:
-            raise HTTPDataError("invalid version: %r" % (line,))
-        self.method = method
+        if version in _versions:
+            version = _versions[version]
+        else:
+            if not version.startswith('HTTP/'):
+                raise HTTPDataError("protocol must be HTTP: %r" % (line,))
+            version = version[5:].split('.')
+            if len(version) != 2:
+                raise HTTPDataError("invalid version: %r" % (line,))
+            try:
+                version = (int(version[0]), int(version[1]))
+            except ValueError:
+                raise HTTPDataError("invalid version: %r" % (line,))
+        self.method = _methods.get(method, method)
         self.target = target
         self.version = version
     
@@ -4,16 +4,49 @@ __all__ = [
 ]
 
 from kitsu.http.errors import *
-from kitsu.http.headers import Headers
+from kitsu.http.headers import Headers, LazyHeaders
 from kitsu.http.parsers import LineParser
 
+_versions = {
+    'HTTP/1.0': (1, 0),
+    'HTTP/1.1': (1, 1),
+}
+_internedVersions = dict((version, version) for version in _versions.itervalues())
+
+_phrases = dict((code, phrase) for (code, phrase) in (
+    (100, 'Continue'), (101, 'Switching Protocols'), (103, 'Early Hints'),
+    (200, 'OK'), (201, 'Created'), (202, 'Accepted'), (203, 'Non-Authoritative Information'),
+    (204, 'No Content'), (205, 'Reset Content'), (206, 'Partial Content'),
+    (300, 'Multiple Choices'), (301, 'Moved Permanently'), (302, 'Found'), (303, 'See Other'),
+    (304, 'Not Modified'), (307, 'Temporary Redirect'), (308, 'Permanent Redirect'),
+    (400, 'Bad Request'), (401, 'Unauthorized'), (403, 'Forbidden'), (404, 'Not Found'),
+    (405, 'Method Not Allowed'), (408, 'Request Timeout'), (409, 'Conflict'), (410, 'Gone'),
+    (411, 'Length Required'), (412, 'Precondition Failed'), (413, 'Request Entity Too Large'),
+    (414, 'Request-URI Too Long'), (416, 'Requested Range Not Satisfiable'), (417, 'Expectation Failed'),
+    (429, 'Too Many Requests'), (500, 'Internal Server Error'), (501, 'Not Implemented'),
+    (502, 'Bad Gateway'), (503, 'Service Unavailable'), (504, 'Gateway Timeout'),
+))
+_internedPhrases = dict((phrase, phrase) for phrase in _phrases.itervalues())
+_internedPhrases[''] = ''
+
+# Precomputed results for the most common status lines
+_statusLines = {}
+for _version, _versionTuple in _versions.iteritems():
+    for _code, _phrase in _phrases.iteritems():
+        _statusLines['%s %d %s' % (_version, _code, _phrase)] = (_versionTuple, _code, _phrase)
+del _version, _versionTuple, _code, _phrase
+
 class Response(object):
+    __slots__ = ('version', 'code', 'phrase', 'headers', 'body', 'url', 'urlchain', 'timing', 'timings', 'interim', '__parserState')
+    
     def __init__(self, version=(1,1), code=200, phrase='OK', headers=(), body=None):
-        self.version = version
+        self.version = _internedVersions.get(version, version)
         self.code = code
         self.phrase = phrase
         self.headers = Headers(headers)
         self.body = body
+        self.timing = None
+        self.interim = ()
         self.__parserState = 'STATUS'
     
     def toLines(self, lines=None):
@@ -31,6 +64,10 @@ class Response(object):
         return self.toString()
     
     def __parseStatus(self, line):
+        status = _statusLines.get(line)
+        if status is not None:
+            self.version, self.code, self.phrase = status
+            return
         parts = line.split(None, 2)
         if len(parts) not in (2, 3):
             raise HTTPDataError("response must be in 'HTTP/n.n status message' format: %r" % (line,))
@@ -39,20 +76,23 @@ class Response(object):
         phrase = len(parts) >= 3 and parts[2] or ""
         if not version.startswith('HTTP/'):
             raise HTTPDataError("protocol must be HTTP: %r" % (line,))
-        version = version[5:].split('.')
-        if len(version) != 2:
-            raise HTTPDataError("invalid version: %r" % (line,))
-        try:
-            version = (int(version[0]), int(version[1]))
-        except ValueError:
-            raise HTTPDataError("invalid version: %r" % (line,))
+        if version in _versions:
+            version = _versions[version]
+        else:
+            version = version[5:].split('.')
+            if len(version) != 2:
+                raise HTTPDataError("invalid version: %r" % (line,))
+            try:
+                version = (int(version[0]), int(version[1]))
+            except ValueError:
+                raise HTTPDataError("invalid version: %r" % (line,))
         try:
             code = int(code)
         except ValueError:
             raise HTTPDataError("status code must be a number: %r" % (line,))
         self.version = version
         self.code = code
-        self.phrase = phrase
+        self.phrase = _internedPhrases.get(phrase, phrase)
     
     def parseLine(self, line):
         if self.__parserState == 'STATUS':
@@ -73,11 +113,24 @@ class Response(object):
 class ResponseParser(LineParser):
     """Response parser"""
     
-    def __init__(self):
+    def __init__(self, lazy=False):
+        self.lazy = lazy
+        self.interim = []
         self.response = Response()
+        if lazy:
+            self.response.headers = LazyHeaders()
     
     def parseLine(self, line):
         if not self.response.parseLine(line):
+            response = self.response
+            if 100 <= response.code < 200 and response.code != 101:
+                # interim responses (100 Continue, 103 Early Hints) precede the final one
+                self.interim.append(response)
+                self.response = Response()
+                if self.lazy:
+                    self.response.headers = LazyHeaders()
+                return []
+            response.interim = self.interim
             self.done = True
-            return [self.response]
+            return [response]
         return []
@@ -0,0 +1,100 @@
+__all__ = [
+    'RetryBudget',
+    'RetryPolicy',
+]
+
+import socket
+import random
+import threading
+from collections import deque
+from kitsu.http.errors import *
+from kitsu.http.timing import monotonic
+
+class RetryBudget(object):
+    """Limits retries to a fraction of requests over a sliding window"""
+    
+    def __init__(self, ratio=0.1, minimum=10, window=10.0):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.window = window
+        self.__lock = threading.Lock()
+        self.__requests = deque()
+        self.__retries = deque()
+    
+    def __expire(self, now):
+        deadline = now - self.window
+        for events in (self.__requests, self.__retries):
+            while events and events[0] < deadline:
+                events.popleft()
+    
+    def request(self):
+        """Records a request, which earns a fraction of a retry"""
+        now = monotonic()
+        with self.__lock:
+            self.__expire(now)
+            self.__requests.append(now)
+    
+    def withdraw(self):
+        """Records a retry if the budget allows it, returns False otherwise"""
+        now = monotonic()
+        with self.__lock:
+            self.__expire(now)
+            if len(self.__retries) >= self.minimum + self.ratio * len(self.__requests):
+                return False
+            self.__retries.append(now)
+            return True
+
+def _parse_retry_after(value):
+    """Returns Retry-After in seconds or None"""
+    value = value.strip()
+    try:
+        return max(0, int(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_tz, mktime_tz
+    import time
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0, mktime_tz(date) - time.time())
+
+class RetryPolicy(object):
+    """Decides which failures are retried and how long to wait before each attempt"""
+    
+    idempotentMethods = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS', 'TRACE'])
+    retryErrors = (socket.error, HTTPDNSError, HTTPDataError, HTTPTimeoutError)
+    retryCodes = frozenset([429, 502, 503, 504])
+    
+    def __init__(self, retries=3, backoff=0.1, maxbackoff=10.0, maxretryafter=60.0, jitter=True, methods=None, codes=None, errors=None, budget=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.maxbackoff = maxbackoff
+        self.maxretryafter = maxretryafter
+        self.jitter = jitter
+        self.methods = methods is None and self.idempotentMethods or frozenset(methods)
+        self.codes = codes is None and self.retryCodes or frozenset(codes)
+        self.errors = errors is None and self.retryErrors or tuple(errors)
+        self.budget = budget
+    
+    def delay(self, attempt, method, response=None, error=None):
+        """Returns seconds to wait before retry number attempt (starting with 1) or None to give up"""
+        if attempt > self.retries or method not in self.methods:
+            return None
+        if error is not None:
+            if not isinstance(error, self.errors):
+                return None
+        elif response is None or response.code not in self.codes:
+            return None
+        delay = min(self.maxbackoff, self.backoff * (2 ** (attempt - 1)))
+        if self.jitter:
+            # full jitter keeps clients that failed together from retrying together
+            delay = random.uniform(0, delay)
+        if response is not None:
+            retryafter = response.headers.get('Retry-After')
+            if retryafter:
+                retryafter = _parse_retry_after(retryafter)
+                if retryafter is not None:
+                    if retryafter > self.maxretryafter:
+                        return None
+                    delay = max(delay, retryafter)
+        return delay
@@ -0,0 +1,211 @@
+__all__ = [
+    'TokenBucket',
+    'Scheduler',
+    'Batch',
+]
+
+import heapq
+import threading
+from contextlib import contextmanager
+from kitsu.http.timing import monotonic
+
+class TokenBucket(object):
+    """Allows rate events per second with bursts of up to burst events"""
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+    
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.stamp = monotonic()
+    
+    def delay(self, now):
+        """Returns seconds until a token is available"""
+        if self.tokens < self.burst:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+    
+    def take(self):
+        self.tokens -= 1
+
+class _Host(object):
+    __slots__ = ('bucket', 'maxinflight', 'inflight')
+    
+    def __init__(self, rate, burst, maxinflight):
+        self.bucket = rate and TokenBucket(rate, burst) or None
+        self.maxinflight = maxinflight
+        self.inflight = 0
+    
+    def delay(self, now):
+        """Returns seconds until a request may start, None if waiting for a release"""
+        if self.maxinflight is not None and self.inflight >= self.maxinflight:
+            return None
+        if self.bucket is None:
+            return 0
+        return self.bucket.delay(now)
+    
+    def idle(self, now):
+        """Returns True if the state is no different from a new one"""
+        if self.inflight:
+            return False
+        if self.bucket is None:
+            return True
+        self.bucket.delay(now)
+        return self.bucket.tokens >= self.bucket.burst
+
+def _pick(scheduler, pending, now):
+    """Returns the best dispatchable host in pending and the delay until the next one may become ready"""
+    best = None
+    delay = None
+    for host, heap in pending.iteritems():
+        wait = scheduler.host(host).delay(now)
+        if wait is None:
+            continue
+        if wait > 0:
+            if delay is None or wait < delay:
+                delay = wait
+            continue
+        if best is None or heap[0] < pending[best][0]:
+            best = host
+    return best, delay
+
+class Scheduler(object):
+    """Per-host rate and concurrency limits shared by all requests of an Agent"""
+    
+    # idle host states are dropped when their number doubles, starting from this
+    minSweep = 64
+    
+    def __init__(self, rate=None, burst=1, maxinflight=None):
+        self.rate = rate
+        self.burst = burst
+        self.maxinflight = maxinflight
+        self.condition = threading.Condition()
+        self.__limits = {}
+        self.__hosts = {}
+        self.__sweep = self.minSweep
+        self.__waiters = {} # host -> heap of (priority, seq, marker)
+        self.__seq = 0
+    
+    def limit(self, host, rate=None, burst=1, maxinflight=None):
+        """Overrides default limits for host"""
+        with self.condition:
+            self.__limits[host] = (rate, burst, maxinflight)
+            state = self.__hosts.pop(host, None)
+            if state is not None:
+                self.host(host).inflight = state.inflight
+            self.condition.notify_all()
+    
+    def host(self, host):
+        """Returns limits state of host, must be called with condition held"""
+        state = self.__hosts.get(host)
+        if state is None:
+            if len(self.__hosts) >= self.__sweep:
+                self.__evict()
+            rate, burst, maxinflight = self.__limits.get(host, (self.rate, self.burst, self.maxinflight))
+            state = self.__hosts[host] = _Host(rate, burst, maxinflight)
+        return state
+    
+    def __evict(self):
+        """Drops states of idle hosts, they are recreated on demand"""
+        now = monotonic()
+        for host, state in self.__hosts.items():
+            if host not in self.__waiters and state.idle(now):
+                del self.__hosts[host]
+        self.__sweep = max(self.minSweep, 2 * len(self.__hosts))
+    
+    def sequence(self):
+        """Returns increasing numbers keeping equal priorities in FIFO order"""
+        self.__seq += 1
+        return self.__seq
+    
+    def dispatch(self, host):
+        """Accounts a request to host, must be called with condition held"""
+        state = self.host(host)
+        if state.bucket is not None:
+            state.bucket.take()
+        state.inflight += 1
+    
+    def acquire(self, host, priority=0):
+        """Blocks until a request to host may start, lower priority values go first"""
+        with self.condition:
+            entry = (priority, self.sequence(), object())
+            heap = self.__waiters.setdefault(host, [])
+            heapq.heappush(heap, entry)
+            while True:
+                best, delay = _pick(self, self.__waiters, monotonic())
+                if best == host and heap[0] is entry:
+                    heapq.heappop(heap)
+                    if not heap:
+                        del self.__waiters[host]
+                    self.dispatch(host)
+                    self.condition.notify_all()
+                    return
+                if best is not None:
+                    # wake up the waiter that can go now
+                    self.condition.notify_all()
+                self.condition.wait(delay)
+    
+    def release(self, host):
+        with self.condition:
+            state = self.host(host)
+            state.inflight -= 1
+            if host not in self.__waiters and state.idle(monotonic()):
+                del self.__hosts[host]
+            self.condition.notify_all()
+    
+    @contextmanager
+    def slot(self, host, priority=0):
+        self.acquire(host, priority)
+        try:
+            yield
+        finally:
+            self.release(host)
+    
+    def batch(self):
+        return Batch(self)
+
+class Batch(object):
+    """Queue of jobs handed out as soon as their hosts have capacity"""
+    
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.closed = False
+        self.__pending = {} # host -> heap of (priority, seq, item)
+    
+    def submit(self, host, item, priority=0):
+        with self.scheduler.condition:
+            heapq.heappush(self.__pending.setdefault(host, []), (priority, self.scheduler.sequence(), item))
+            self.scheduler.condition.notify_all()
+    
+    def close(self):
+        """No more jobs will be submitted"""
+        with self.scheduler.condition:
+            self.closed = True
+            self.scheduler.condition.notify_all()
+    
+    def cancel(self):
+        """Drops jobs that have not been handed out yet"""
+        with self.scheduler.condition:
+            self.closed = True
+            self.__pending.clear()
+            self.scheduler.condition.notify_all()
+    
+    def next(self):
+        """Returns (host, item) after accounting it with the scheduler, None when there are no more jobs"""
+        scheduler = self.scheduler
+        with scheduler.condition:
+            while True:
+                host, delay = _pick(scheduler, self.__pending, monotonic())
+                if host is not None:
+                    heap = self.__pending[host]
+                    priority, seq, item = heapq.heappop(heap)
+                    if not heap:
+                        del self.__pending[host]
+                    scheduler.dispatch(host)
+                    return host, item
+                if self.closed and not self.__pending:
+                    return None
+                scheduler.condition.wait(delay)
@@ -0,0 +1,65 @@
+__all__ = [
+    'SocketOptions',
+    'LATENCY',
+    'THROUGHPUT',
+]
+
+import socket
+
+class SocketOptions(object):
+    """Profile of options applied to every socket created by Agent or Connector"""
+    __slots__ = ('nodelay', 'keepalive', 'keepidle', 'keepinterval', 'keepcount', 'quickack', 'rcvbuf', 'sndbuf', 'packetsize')
+    
+    def __init__(self, nodelay=None, keepalive=None, keepidle=None, keepinterval=None, keepcount=None, quickack=None, rcvbuf=None, sndbuf=None, packetsize=4096):
+        self.nodelay = nodelay
+        self.keepalive = keepalive
+        self.keepidle = keepidle
+        self.keepinterval = keepinterval
+        self.keepcount = keepcount
+        self.quickack = quickack
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+        self.packetsize = packetsize
+    
+    def replace(self, **kwargs):
+        """Returns a copy with some of the options changed"""
+        options = dict((name, getattr(self, name)) for name in self.__slots__)
+        options.update(kwargs)
+        return SocketOptions(**options)
+    
+    def items(self):
+        """Returns (level, option, value) for options supported on this platform"""
+        items = []
+        def add(level, name, value):
+            option = getattr(socket, name, None)
+            if value is not None and option is not None:
+                items.append((level, option, int(value)))
+        # buffer sizes affect window scaling and must be set before connect
+        add(socket.SOL_SOCKET, 'SO_RCVBUF', self.rcvbuf)
+        add(socket.SOL_SOCKET, 'SO_SNDBUF', self.sndbuf)
+        add(socket.IPPROTO_TCP, 'TCP_NODELAY', self.nodelay)
+        add(socket.SOL_SOCKET, 'SO_KEEPALIVE', self.keepalive)
+        if self.keepalive:
+            add(socket.IPPROTO_TCP, 'TCP_KEEPIDLE', self.keepidle)
+            add(socket.IPPROTO_TCP, 'TCP_KEEPINTVL', self.keepinterval)
+            add(socket.IPPROTO_TCP, 'TCP_KEEPCNT', self.keepcount)
+        add(socket.IPPROTO_TCP, 'TCP_QUICKACK', self.quickack)
+        return items
+    
+    def apply(self, sock):
+        # tcp options are not supported by unix domain sockets
+        tcp = getattr(sock, 'family', None) != getattr(socket, 'AF_UNIX', None)
+        for level, option, value in self.items():
+            if tcp or level != socket.IPPROTO_TCP:
+                sock.setsockopt(level, option, value)
+        return sock
+    
+    def __repr__(self):
+        return "SocketOptions(%s)" % (', '.join("%s=%r" % (name, getattr(self, name)) for name in self.__slots__),)
+
+# Small requests: no Nagle delays, immediate acks, dead peers detected quickly
+# (TCP_QUICKACK is one-shot on linux, Agent re-arms it after every read)
+LATENCY = SocketOptions(nodelay=True, quickack=True, keepalive=True, keepidle=30, keepinterval=5, keepcount=3, packetsize=16384)
+
+# Bulk transfers: large kernel buffers and reads
+THROUGHPUT = SocketOptions(nodelay=True, keepalive=True, keepidle=60, keepinterval=10, keepcount=5, rcvbuf=4*1024*1024, sndbuf=1024*1024, packetsize=256*1024)
@@ -0,0 +1,88 @@
+__all__ = [
+    'Timing',
+    'monotonic',
+]
+
+import sys
+import time
+
+def _make_monotonic():
+    monotonic = getattr(time, 'monotonic', None)
+    if monotonic is not None:
+        return monotonic
+    if sys.platform.startswith('linux'):
+        try:
+            import ctypes
+            import ctypes.util
+        except ImportError:
+            return time.time
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+        try:
+            # find_library runs external tools, only use it as a last resort
+            librt = ctypes.CDLL('librt.so.1', use_errno=True)
+        except OSError:
+            try:
+                librt = ctypes.CDLL(ctypes.util.find_library('rt'), use_errno=True)
+            except OSError:
+                return time.time
+        try:
+            clock_gettime = librt.clock_gettime
+        except AttributeError:
+            return time.time
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        CLOCK_MONOTONIC = 1
+        def monotonic():
+            t = timespec()
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.pointer(t)) != 0:
+                return time.time()
+            return t.tv_sec + t.tv_nsec * 1e-9
+        return monotonic
+    return time.time
+
+_monotonic = None
+
+def monotonic():
+    """Returns seconds from an unspecified point, never going backwards"""
+    # The clock is resolved on first use, since loading ctypes
+    # is a noticeable part of import time on Python 2.
+    global _monotonic, monotonic
+    if _monotonic is None:
+        _monotonic = monotonic = _make_monotonic()
+    return _monotonic()
+
+class Timing(object):
+    """Monotonic timestamps marking the end of each request phase"""
+    __slots__ = ('url', 'start', 'dns', 'connect', 'proxy', 'tls', 'sent', 'firstbyte', 'headers', 'done', 'reused')
+    
+    phases = ('dns', 'connect', 'proxy', 'tls', 'sent', 'firstbyte', 'headers', 'done')
+    
+    def __init__(self, url=None):
+        self.url = url
+        self.start = monotonic()
+        for phase in self.phases:
+            setattr(self, phase, None)
+        self.reused = False
+    
+    def mark(self, phase):
+        setattr(self, phase, monotonic())
+    
+    def durations(self):
+        """Returns (phase, seconds) for phases that happened"""
+        result = []
+        last = self.start
+        for phase in self.phases:
+            value = getattr(self, phase)
+            if value is not None:
+                result.append((phase, value - last))
+                last = value
+        return result
+    
+    @property
+    def total(self):
+        if self.done is None:
+            return None
+        return self.done - self.start
+    
+    def __repr__(self):
+        return "<Timing(url=%r, reused=%r, %s)>" % (self.url, self.reused, ', '.join("%s=%.6f" % item for item in self.durations()))
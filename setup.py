@@ -1,9 +1,45 @@
 import os
-from setuptools import setup
+from setuptools import setup, Command
+from distutils.errors import DistutilsError
 
 def read(name):
     return open(os.path.join(os.path.dirname(__file__), name), 'r').read()
 
+class bench(Command):
+    description = "run benchmarks and compare results with the stored baseline"
+    user_options = [
+        ('suite=', None, "benchmark suite from the benchmarks directory (default: parsers)"),
+        ('filter=', 'k', "run benchmarks with names containing this string"),
+        ('baseline=', 'b', "baseline file to compare with"),
+        ('threshold=', 't', "allowed slowdown fraction (default: 0.1)"),
+        ('save', 's', "save results as the new baseline"),
+    ]
+    boolean_options = ['save']
+    
+    def initialize_options(self):
+        self.suite = 'parsers'
+        self.filter = None
+        self.baseline = None
+        self.threshold = None
+        self.save = False
+    
+    def finalize_options(self):
+        pass
+    
+    def run(self):
+        argv = []
+        if self.filter:
+            argv += ['--filter', self.filter]
+        if self.baseline:
+            argv += ['--baseline', self.baseline]
+        if self.threshold:
+            argv += ['--threshold', self.threshold]
+        if self.save:
+            argv += ['--save']
+        suite = __import__('benchmarks.bench_%s' % self.suite, fromlist=['main'])
+        if suite.main(argv):
+            raise DistutilsError("benchmark results regressed")
+
 setup(
     name="kitsu.http",
     version="0.0.7",
@@ -14,9 +50,9 @@ setup(
     url="https://github.com/snaury/kitsu.http",
     license="MIT License",
     platforms=['any'],
-    namespace_packages=['kitsu', 'kitsu.http'],
     packages=['kitsu', 'kitsu.http'],
     test_suite='tests.test_suite',
+    cmdclass={'bench': bench},
     classifiers=[
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
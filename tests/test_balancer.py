@@ -0,0 +1,51 @@
+import time
+import unittest
+from kitsu.http.balancer import *
+
+class UpstreamTests(unittest.TestCase):
+    def test_round_robin(self):
+        upstream = Upstream(['a', 'b', 'c'])
+        self.assertEqual([upstream.choose().netloc for i in xrange(6)], ['a', 'b', 'c', 'a', 'b', 'c'])
+    
+    def test_least_outstanding(self):
+        upstream = Upstream(['a', 'b', 'c'], strategy='least-outstanding')
+        a = upstream.choose()
+        upstream.start(a)
+        b = upstream.choose()
+        upstream.start(b)
+        self.assertEqual(upstream.choose().netloc, 'c')
+        upstream.finish(a)
+        self.assertEqual(upstream.choose().netloc, 'a')
+    
+    def test_p2c(self):
+        upstream = Upstream(['a', 'b'], strategy='p2c')
+        a, b = upstream.endpoints
+        for endpoint, latency in ((a, 0.5), (b, 0.01)):
+            upstream.start(endpoint)
+            upstream.finish(endpoint, latency)
+        self.assertEqual(set(upstream.choose().netloc for i in xrange(10)), set(['b']))
+    
+    def test_ejection(self):
+        upstream = Upstream(['a', 'b'], maxfailures=2, cooldown=0.05)
+        a, b = upstream.endpoints
+        upstream.start(a)
+        self.assertFalse(upstream.finish(a, failed=True))
+        upstream.start(a)
+        self.assertTrue(upstream.finish(a, failed=True))
+        self.assertEqual(set(upstream.choose().netloc for i in xrange(4)), set(['b']))
+        time.sleep(0.06)
+        self.assertEqual(set(upstream.choose().netloc for i in xrange(4)), set(['a', 'b']))
+        # a single failure after the cool-down ejects it again
+        upstream.start(a)
+        self.assertTrue(upstream.finish(a, failed=True))
+    
+    def test_all_ejected(self):
+        upstream = Upstream(['a'], maxfailures=1)
+        a = upstream.choose()
+        upstream.start(a)
+        upstream.finish(a, failed=True)
+        self.assertTrue(upstream.choose() is a)
+    
+    def test_invalid(self):
+        self.assertRaises(ValueError, Upstream, [])
+        self.assertRaises(ValueError, Upstream, ['a'], strategy='random')
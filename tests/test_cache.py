@@ -0,0 +1,184 @@
+import os
+import mmap
+import shutil
+import tempfile
+import unittest
+from kitsu.http.headers import Headers
+from kitsu.http.response import Response
+from kitsu.http.cache import *
+from kitsu.http import cache as cachemodule
+
+URL = 'http://example.com/config'
+
+class HTTPCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = HTTPCache()
+        self.sent = []
+    
+    def request(self, response, headers=()):
+        def send(validators):
+            self.sent.append(Headers(validators))
+            return response
+        return self.cache.request(URL, Headers(headers), send)
+    
+    def test_fresh(self):
+        response = self.request(Response(headers={'Cache-Control': 'max-age=60'}, body='data'))
+        self.assertEqual(response.body, 'data')
+        response = self.request(None)
+        self.assertEqual(response.body, 'data')
+        self.assertEqual(len(self.sent), 1)
+    
+    def test_request_no_cache(self):
+        self.request(Response(headers={'Cache-Control': 'max-age=60'}, body='data'))
+        response = self.request(Response(body='new'), headers={'Cache-Control': 'no-cache'})
+        self.assertEqual(response.body, 'new')
+        self.assertEqual(len(self.sent), 2)
+    
+    def test_revalidate(self):
+        self.request(Response(headers={'Cache-Control': 'max-age=0', 'ETag': '"v1"', 'X-Test': 'old'}, body='data'))
+        response = self.request(Response(code=304, phrase='Not Modified', headers={'ETag': '"v1"', 'X-Test': 'new'}))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, 'data')
+        self.assertEqual(response.headers['X-Test'], 'new')
+        self.assertEqual(self.sent[1]['If-None-Match'], '"v1"')
+        self.assertFalse('If-Modified-Since' in self.sent[1])
+    
+    def test_vary(self):
+        self.request(Response(headers={'Cache-Control': 'max-age=60', 'Vary': 'Accept'}, body='json'), headers={'Accept': 'application/json'})
+        response = self.request(Response(headers={'Cache-Control': 'max-age=60', 'Vary': 'Accept'}, body='xml'), headers={'Accept': 'text/xml'})
+        self.assertEqual(response.body, 'xml')
+        self.assertEqual(len(self.sent), 2)
+    
+    def test_no_store(self):
+        self.request(Response(headers={'Cache-Control': 'no-store, max-age=60'}, body='data'))
+        self.assertEqual(len(self.cache.storage), 0)
+    
+    def test_expires(self):
+        headers = {'Date': 'Mon, 01 Jan 2001 00:00:00 GMT', 'Expires': 'Mon, 01 Jan 2001 00:01:00 GMT'}
+        entry = self.cache.store(URL, 'GET', Headers(), Response(headers=headers, body='data'), 0, 0)
+        self.assertEqual(self.cache.lifetime(entry), 60)
+
+class MemoryCacheStorageTests(unittest.TestCase):
+    def entry(self, url, body=''):
+        return CacheEntry(url, (1, 1), 200, 'OK', (), body)
+    
+    def test_max_entries(self):
+        storage = MemoryCacheStorage(maxentries=2)
+        for key in ('a', 'b'):
+            storage.set(key, self.entry(key))
+        storage.get('a')
+        storage.set('c', self.entry('c'))
+        self.assertTrue(storage.get('b') is None)
+        self.assertFalse(storage.get('a') is None)
+        self.assertFalse(storage.get('c') is None)
+    
+    def test_max_bytes(self):
+        storage = MemoryCacheStorage(maxbytes=25)
+        storage.set('a', self.entry('a', 'x' * 10))
+        storage.set('b', self.entry('b', 'x' * 10))
+        storage.set('c', self.entry('c', 'x' * 10))
+        self.assertEqual(len(storage), 2)
+        self.assertTrue(storage.get('a') is None)
+        storage.set('d', self.entry('d', 'x' * 100))
+        self.assertTrue(storage.get('d') is None)
+        self.assertEqual(storage.size, 22)
+
+class DiskCacheStorageTests(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.path)
+    
+    def entry(self, url, body=''):
+        return CacheEntry(url, (1, 1), 200, 'OK', [('ETag', '"v1"')], body)
+    
+    def test_shared(self):
+        storage = DiskCacheStorage(self.path)
+        storage.set('a', self.entry('a', 'data'))
+        entry = DiskCacheStorage(self.path).get('a')
+        self.assertEqual(entry.body, 'data')
+        self.assertEqual(entry.headers, [('ETag', '"v1"')])
+        storage.set('a', self.entry('a', 'new data'))
+        self.assertEqual(entry.body, 'data')
+        self.assertEqual(storage.get('a').body, 'new data')
+        storage.delete('a')
+        self.assertTrue(storage.get('a') is None)
+        self.assertEqual(len([name for name in os.listdir(self.path) if name.endswith('.body')]), 0)
+    
+    def test_mapped(self):
+        storage = DiskCacheStorage(self.path, mapsize=8)
+        storage.set('a', self.entry('a', 'new data'))
+        storage.set('b', self.entry('b', 'data'))
+        entry = storage.get('a')
+        self.assertTrue(isinstance(entry.body, mmap.mmap))
+        self.assertEqual(storage.get('b').body, 'data')
+        storage.set('a', self.entry('a', 'newer data'))
+        # old mapping stays valid after the body is replaced
+        self.assertEqual(entry.body[:], 'new data')
+        entry.body.close()
+        self.assertEqual(storage.get('a').body[:], 'newer data')
+    
+    def test_private(self):
+        path = os.path.join(self.path, 'cache')
+        storage = DiskCacheStorage(path)
+        storage.set('a', self.entry('a', 'data'))
+        self.assertEqual(os.stat(path).st_mode & 0777, 0700)
+        self.assertEqual(os.stat(os.path.join(path, 'journal')).st_mode & 0077, 0)
+    
+    def test_max_bytes(self):
+        storage = DiskCacheStorage(self.path, maxbytes=50)
+        storage.set('a', self.entry('a', 'x' * 10))
+        storage.set('b', self.entry('b', 'x' * 10))
+        storage.get('a')
+        storage.set('c', self.entry('c', 'x' * 10))
+        self.assertEqual(len(storage), 2)
+        self.assertTrue(storage.get('b') is None)
+        self.assertFalse(storage.get('a') is None)
+    
+    def test_max_entries(self):
+        storage = DiskCacheStorage(self.path, maxentries=3)
+        for key in 'abc':
+            storage.set(key, self.entry(key))
+        storage.get('a')
+        storage.set('d', self.entry('d'))
+        # eviction follows the order of use kept in the index
+        self.assertTrue(storage.get('b') is None)
+        self.assertEqual(len(DiskCacheStorage(self.path)), 3)
+        self.assertFalse(storage.get('a') is None)
+    
+    def test_journal(self):
+        storage = DiskCacheStorage(self.path)
+        other = DiskCacheStorage(self.path)
+        for i in xrange(300):
+            storage.set('k%d' % (i % 10), self.entry('k', str(i)))
+            if i % 100 == 0:
+                self.assertEqual(other.get('k0').body, str(i))
+        storage.delete('k1')
+        # the journal has been compacted into the snapshot in between
+        self.assertTrue(os.path.getsize(os.path.join(self.path, 'journal')) < 300 * 50)
+        self.assertEqual(len(other), 9)
+        self.assertEqual(other.size, storage.size)
+        self.assertEqual(DiskCacheStorage(self.path).get('k9').body, '299')
+        self.assertEqual(len([name for name in os.listdir(self.path) if name.endswith('.body')]), 9)
+    
+    def test_without_fcntl(self):
+        fcntl, cachemodule.fcntl = cachemodule.fcntl, None
+        try:
+            storage = DiskCacheStorage(self.path)
+            storage.set('a', self.entry('a', 'data'))
+            self.assertEqual(storage.get('a').body, 'data')
+            self.assertFalse(os.path.exists(os.path.join(self.path, 'lock.exclusive')))
+            # a lock left by a crashed process expires
+            open(os.path.join(self.path, 'lock.exclusive'), 'w').close()
+            os.utime(os.path.join(self.path, 'lock.exclusive'), (0, 0))
+            self.assertEqual(len(storage), 1)
+        finally:
+            cachemodule.fcntl = fcntl
+    
+    def test_http_cache(self):
+        cache = HTTPCache(DiskCacheStorage(self.path))
+        cache.request(URL, Headers(), lambda validators: Response(headers={'Cache-Control': 'max-age=60'}, body='data'))
+        cache = HTTPCache(DiskCacheStorage(self.path))
+        response = cache.request(URL, Headers(), None)
+        self.assertEqual(response.body, 'data')
@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from kitsu.http.response import Response
+from kitsu.http.client import Agent, HTTPProxyClient
+from kitsu.http.memory import MemoryTransport
+from kitsu.http.capture import *
+
+CHUNKED = 'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n0\r\nX-Trailer: 1\r\n\r\n'
+
+class CaptureTests(unittest.TestCase):
+    def record(self, capture):
+        transport = MemoryTransport([
+            CHUNKED,
+            Response(headers={'Content-Length': '100'}),
+            ['HTTP/1.1 100 Continue\r\n\r\n', 'HTTP/1.1 201 Created\r\nContent-Length: 2\r\n\r\nok'],
+        ], fragment=7)
+        agent = transport.install(Agent(capture=capture))
+        agent.makeRequest('http://example.com/a')
+        agent.makeRequest('http://example.com/b', method='HEAD')
+        agent.makeRequest('http://example.com/c', method='POST', body='data', headers={'Content-Length': '4'})
+        capture.close()
+    
+    def test_replay(self):
+        f = StringIO()
+        self.record(CaptureWriter(f))
+        f.seek(0)
+        records = list(read_capture(f))
+        self.assertEqual(set(stream for (stream, kind, data) in records), set([1]))
+        # received packets keep the boundaries of every recv
+        self.assertEqual(max(len(data) for (stream, kind, data) in records if kind == 'R'), 7)
+        f.seek(0)
+        streams = load_capture(f)
+        self.assertEqual([request.method for request in streams[0][0]], ['GET', 'HEAD', 'POST'])
+        for packetsize in (None, 1, 4096):
+            replay = Replay(streams, packetsize)
+            self.assertEqual(replay.run(), 3)
+            self.assertEqual(replay.size, sum(len(data) for (stream, kind, data) in records if kind == 'R'))
+    
+    def test_file(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir, 'capture.gz')
+            self.record(CaptureWriter(filename))
+            self.assertEqual(Replay(load_capture(filename)).run(), 3)
+        finally:
+            shutil.rmtree(tempdir)
+    
+    def test_proxy(self):
+        f = StringIO()
+        capture = CaptureWriter(f)
+        transport = MemoryTransport(['HTTP/1.1 200 Connection established\r\n\r\n'])
+        sock = HTTPProxyClient(transport.create_socket(('proxy', 3128)), capture=capture)
+        sock.connect(('example.com', 443))
+        f.seek(0)
+        streams = load_capture(f)
+        self.assertEqual([request.method for request in streams[0][0]], ['CONNECT'])
+        self.assertEqual(Replay(streams).run(), 1)
+    
+    def test_invalid(self):
+        self.assertRaises(ValueError, list, read_capture(StringIO('HTTP/1.1 200 OK\r\n')))
+        f = StringIO()
+        capture = CaptureWriter(f)
+        capture.write(capture.stream(), 'R', 'HTTP/1.1 200 OK\r\n')
+        self.assertRaises(ValueError, list, read_capture(StringIO(f.getvalue()[:-1])))
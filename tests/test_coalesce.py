@@ -0,0 +1,61 @@
+import time
+import threading
+import unittest
+from kitsu.http.response import Response
+from kitsu.http.coalesce import *
+from kitsu.http.timing import Timing
+
+class CoalescerTests(unittest.TestCase):
+    def run_concurrently(self, coalescer, function, count=5):
+        results = []
+        def worker():
+            try:
+                results.append(coalescer.call('key', function))
+            except Exception, e:
+                results.append(e)
+        threads = [threading.Thread(target=worker) for i in xrange(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+    
+    def test_shared_result(self):
+        coalescer = Coalescer()
+        started = threading.Event()
+        finish = threading.Event()
+        calls = []
+        def function():
+            calls.append(1)
+            started.set()
+            finish.wait()
+            response = Response(body='shared')
+            response.interim = [Response(code=103, phrase='Early Hints')]
+            response.timing = Timing('http://example.com/')
+            return response
+        threads, results = self.run_concurrently(coalescer, function)
+        started.wait()
+        # give other threads a chance to join the call
+        time.sleep(0.1)
+        finish.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len(set(id(result) for result in results)), 5)
+        for result in results:
+            self.assertTrue(result.body is results[0].body)
+            self.assertEqual([interim.code for interim in result.interim], [103])
+            self.assertTrue(result.timing is results[0].timing and result.timing is not None)
+        self.assertEqual(len(coalescer), 0)
+    
+    def test_shared_error(self):
+        coalescer = Coalescer()
+        finish = threading.Event()
+        def function():
+            finish.wait()
+            raise ValueError('failed')
+        threads, results = self.run_concurrently(coalescer, function, count=3)
+        finish.set()
+        for thread in threads:
+            thread.join()
+        for result in results:
+            self.assertTrue(isinstance(result, ValueError))
@@ -0,0 +1,58 @@
+import socket
+import unittest
+from kitsu.http.timing import Timing
+from kitsu.http.events import *
+
+class MetricsTests(unittest.TestCase):
+    def test_counters(self):
+        metrics = Metrics()
+        metrics('connection.opened', {})
+        metrics('connection.reused', {})
+        metrics('connection.reused', {})
+        metrics('connection.closed', {'reason': 'server-close'})
+        metrics('bytes', {'sent': 10, 'received': 100})
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters']['connection.closed.server-close'], 1)
+        self.assertEqual(snapshot['counters']['bytes.in'], 100)
+        self.assertEqual(snapshot['counters']['bytes.out'], 10)
+        self.assertAlmostEqual(snapshot['gauges']['pool.hit_ratio'], 2.0 / 3)
+    
+    def test_latency(self):
+        metrics = Metrics()
+        timing = Timing()
+        timing.mark('sent')
+        timing.mark('done')
+        metrics('request.finished', {'code': 204, 'timing': timing})
+        snapshot = metrics.snapshot(reset=True)
+        self.assertEqual(snapshot['counters']['response.2xx'], 1)
+        self.assertEqual(snapshot['histograms']['request.latency']['count'], 1)
+        self.assertTrue('request.sent' in snapshot['histograms'])
+        self.assertEqual(metrics.snapshot()['counters'], {})
+    
+    def test_histogram(self):
+        histogram = Histogram((1, 2, 3))
+        for value in (0.5, 1.5, 1.5, 2.5, 10):
+            histogram.add(value)
+        self.assertEqual(histogram.buckets, [1, 2, 1, 1])
+        self.assertEqual(histogram.percentile(0.5), 2)
+        self.assertEqual(histogram.percentile(1.0), 10)
+
+class StatsdSinkTests(unittest.TestCase):
+    def test_send(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.settimeout(5)
+        try:
+            metrics = Metrics()
+            metrics.increment('requests', 3)
+            metrics.observe('latency', 0.25)
+            sink = StatsdSink(*listener.getsockname(), prefix='test', packetsize=64)
+            metrics.flush(sink)
+            sink.close()
+            lines = []
+            while 'test.latency.max:250|ms' not in lines:
+                lines.extend(listener.recv(65536).split('\n'))
+            self.assertTrue('test.requests:3|c' in lines)
+            self.assertTrue('test.latency.count:1|c' in lines)
+        finally:
+            listener.close()
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
+import threading
 import unittest
+from kitsu.http.errors import *
 from kitsu.http.headers import *
 
 HEADERS_NORMAL = """\
@@ -111,6 +113,58 @@ class HeadersTests(unittest.TestCase):
         self.assertFalse(res)
         self.assertEqual(headers.toString(), HEADERS_PARSING)
 
+class LazyHeadersTests(unittest.TestCase):
+    def parse(self, data):
+        headers = LazyHeaders()
+        for line in data.split("\r\n"):
+            res = headers.parseLine(line)
+        self.assertFalse(res)
+        return headers
+    
+    def test_framing(self):
+        headers = self.parse(HEADERS_PARSING + "Content-Length: 10\r\nTransfer-Encoding: chunked\r\n")
+        self.assertEqual(headers.getlist('content-length'), ['10'])
+        self.assertEqual(headers.get('Transfer-Encoding'), 'chunked')
+        self.assertFalse('Connection' in headers)
+        self.assertEqual(headers.get('Connection', 'default'), 'default')
+        self.assertFalse(headers.materialized)
+        self.assertEqual(headers['Header3'], 'more values')
+        self.assertTrue(headers.materialized)
+        self.assertEqual(headers.getlist('Content-Length'), ['10'])
+    
+    def test_parsing(self):
+        headers = self.parse(HEADERS_PARSING)
+        self.assertEqual(headers.toString(), HEADERS_PARSING)
+        self.assertEqual(Headers(self.parse(HEADERS_PARSING)).toString(), HEADERS_PARSING)
+    
+    def test_folded_framing(self):
+        headers = self.parse("Connection: keep-alive,\r\n close\r\n")
+        self.assertEqual(headers.get('Connection'), 'keep-alive,\r\n close')
+        self.assertTrue(headers.materialized)
+    
+    def test_invalid(self):
+        headers = self.parse("invalid header\r\n")
+        self.assertRaises(HTTPDataError, headers.keys)
+    
+    def test_concurrent(self):
+        # coalesced responses are copied from several threads at once
+        data = ''.join('X-Header-%d: value %d\r\n' % (i, i) for i in xrange(200))
+        expected = self.parse(data).items()
+        for trial in xrange(20):
+            headers = self.parse(data)
+            start = threading.Event()
+            results = []
+            def reader():
+                start.wait()
+                results.append(headers.items())
+            threads = [threading.Thread(target=reader) for i in xrange(8)]
+            for thread in threads:
+                thread.start()
+            start.set()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(results, [expected] * 8)
+
 if False:
     def whiny(self, *args, **kwargs):
         print "whiny: %r" % (self,)
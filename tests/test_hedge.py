@@ -0,0 +1,19 @@
+import unittest
+from kitsu.http.hedge import *
+from kitsu.http.retry import RetryBudget
+
+class HedgePolicyTests(unittest.TestCase):
+    def test_fixed(self):
+        self.assertEqual(HedgePolicy(delay=0.2).delay('a'), 0.2)
+    
+    def test_percentile(self):
+        policy = HedgePolicy(minsamples=10, window=100)
+        self.assertEqual(policy.delay('a'), policy.initialdelay)
+        for i in xrange(100):
+            policy.observe('a', i < 90 and 0.001 or 0.04)
+        # window is full, the estimate survives until new samples arrive
+        self.assertEqual(policy.delay('a'), 0.04)
+        for i in xrange(10):
+            policy.observe('a', 0.001)
+        self.assertEqual(policy.delay('a'), policy.mindelay)
+        self.assertEqual(policy.delay('b'), policy.initialdelay)
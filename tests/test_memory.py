@@ -0,0 +1,65 @@
+import time
+import unittest
+from kitsu.http.errors import *
+from kitsu.http.request import Request
+from kitsu.http.response import Response
+from kitsu.http.client import Agent, Connector, HTTPClient
+from kitsu.http.memory import *
+
+class MemoryTransportTests(unittest.TestCase):
+    def test_script(self):
+        transport = MemoryTransport([Response(body='hello'), 'HTTP/1.1 204 No Content\r\n\r\n'])
+        agent = transport.install(Agent())
+        self.assertEqual(agent.makeRequest('http://example.com/a').body, 'hello')
+        response = agent.makeRequest('http://example.com/b')
+        self.assertEqual(response.code, 204)
+        self.assertTrue(response.timing.reused)
+        self.assertEqual(transport.connections, 1)
+        self.assertEqual([request.target for request in transport.requests], ['/a', '/b'])
+        # the script is over, so the server closes the connection
+        self.assertRaises(HTTPDataError, agent.makeRequest, 'https://example.com/c')
+    
+    def test_callback(self):
+        def echo(request):
+            return Response(headers={'Connection': 'close'}, body=request.body)
+        events = []
+        transport = MemoryTransport(echo)
+        agent = transport.install(Agent(observers=[lambda event, info: events.append((event, info.get('reason')))]))
+        response = agent.makeRequest('http://example.com/', method='POST', body='data', headers={'Content-Length': '4'})
+        self.assertEqual(response.body, 'data')
+        self.assertTrue(('connection.closed', 'server-close') in events)
+    
+    def test_fragment(self):
+        body = '5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n'
+        transport = MemoryTransport(lambda request: 'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n' + body, fragment=1)
+        sock = transport.create_socket(('example.com', 80))
+        client = HTTPClient(sock)
+        response = client.makeRequest(Request(headers={'Host': 'example.com'}))
+        self.assertEqual(response.body, 'hello world')
+        self.assertFalse(sock.pending())
+    
+    def test_packets(self):
+        transport = MemoryTransport([['HTTP/1.1 200 OK\r\nContent-', 'Length: 2\r\n\r\n', 'ok']])
+        sock = transport.create_socket()
+        sock.sendall('GET / HTTP/1.1\r\n\r\n')
+        self.assertEqual([sock.recv(1024) for i in xrange(3)], ['HTTP/1.1 200 OK\r\nContent-', 'Length: 2\r\n\r\n', 'ok'])
+    
+    def test_latency(self):
+        transport = MemoryTransport(lambda request: Response(body='ok'), latency=0.05)
+        agent = transport.install(Agent())
+        start = time.time()
+        self.assertEqual(agent.makeRequest('http://example.com/').body, 'ok')
+        self.assertTrue(time.time() - start >= 0.05)
+        agent.readtimeout = 0.01
+        try:
+            agent.makeRequest('http://example.com/')
+        except HTTPTimeoutError, e:
+            self.assertEqual(e.phase, 'read')
+        else:
+            self.fail("HTTPTimeoutError not raised")
+    
+    def test_connector(self):
+        transport = MemoryTransport([])
+        sock = transport.install(Connector()).connect(('example.com', 443), ssl=True)
+        self.assertTrue(isinstance(sock, MemorySocket))
+        self.assertEqual(sock.getpeername(), ('example.com', 443))
@@ -0,0 +1,46 @@
+import unittest
+from kitsu.http.errors import *
+from kitsu.http.request import RequestParser
+from kitsu.http.response import Response, ResponseParser
+
+class ResponseParserTests(unittest.TestCase):
+    def parse(self, data):
+        parser = ResponseParser()
+        response = parser.parse(data)
+        self.assertEqual(len(response), 1)
+        return response[0]
+    
+    def test_interned(self):
+        a = self.parse('HTTP/1.1 200 OK\r\n\r\n')
+        b = self.parse('HTTP/1.1 404 Not Found\r\n\r\n')
+        self.assertEqual((a.version, a.code, a.phrase), ((1, 1), 200, 'OK'))
+        self.assertEqual((b.version, b.code, b.phrase), ((1, 1), 404, 'Not Found'))
+        self.assertTrue(a.version is b.version)
+        self.assertTrue(b.phrase is self.parse('HTTP/1.0 404 Not Found\r\n\r\n').phrase)
+    
+    def test_uncommon(self):
+        response = self.parse('HTTP/1.2 299 Custom phrase\r\n\r\n')
+        self.assertEqual((response.version, response.code, response.phrase), ((1, 2), 299, 'Custom phrase'))
+        self.assertRaises(HTTPDataError, self.parse, 'HTTP/1.1 abc OK\r\n\r\n')
+    
+    def test_interim(self):
+        parser = ResponseParser()
+        self.assertEqual(parser.parse('HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 103 Early Hints\r\nLink: </a>\r\n'), [])
+        self.assertEqual([interim.code for interim in parser.interim], [100])
+        response = parser.parse('\r\nHTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')[0]
+        self.assertEqual(response.code, 200)
+        self.assertEqual([(interim.code, interim.headers.get('Link')) for interim in response.interim], [(100, None), (103, '</a>')])
+        self.assertEqual(self.parse('HTTP/1.1 101 Switching Protocols\r\n\r\n').code, 101)
+    
+    def test_slots(self):
+        response = Response()
+        self.assertFalse(hasattr(response, '__dict__'))
+        self.assertTrue(response.timing is None)
+        self.assertRaises(AttributeError, setattr, response, 'unknown', 1)
+
+class RequestParserTests(unittest.TestCase):
+    def test_interned(self):
+        request = RequestParser().parse('GET / HTTP/1.1\r\n\r\n')[0]
+        self.assertEqual((request.method, request.target, request.version), ('GET', '/', (1, 1)))
+        self.assertFalse(hasattr(request, '__dict__'))
+        self.assertFalse(request.ignore_content_length)
@@ -0,0 +1,34 @@
+import socket
+import unittest
+from kitsu.http.errors import *
+from kitsu.http.response import Response
+from kitsu.http.retry import *
+
+class RetryPolicyTests(unittest.TestCase):
+    def test_backoff(self):
+        policy = RetryPolicy(retries=4, backoff=1, maxbackoff=5, jitter=False)
+        error = socket.error()
+        self.assertEqual([policy.delay(attempt, 'GET', error=error) for attempt in xrange(1, 6)], [1, 2, 4, 5, None])
+        policy.jitter = True
+        for i in xrange(100):
+            self.assertTrue(0 <= policy.delay(3, 'GET', error=error) <= 4)
+    
+    def test_rules(self):
+        policy = RetryPolicy(jitter=False)
+        self.assertEqual(policy.delay(1, 'POST', error=socket.error()), None)
+        self.assertEqual(policy.delay(1, 'GET', error=HTTPLimitError()), None)
+        self.assertEqual(policy.delay(1, 'GET', Response(code=500)), None)
+        self.assertEqual(policy.delay(1, 'GET', Response(code=503)), 0.1)
+    
+    def test_retry_after(self):
+        policy = RetryPolicy(maxretryafter=30)
+        self.assertEqual(policy.delay(1, 'GET', Response(code=429, headers={'Retry-After': '20'})), 20)
+        self.assertEqual(policy.delay(1, 'GET', Response(code=429, headers={'Retry-After': '120'})), None)
+        self.assertEqual(policy.delay(1, 'GET', Response(code=503, headers={'Retry-After': 'Mon, 01 Jan 2001 00:00:00 GMT'})) <= 0.1, True)
+
+class RetryBudgetTests(unittest.TestCase):
+    def test_budget(self):
+        budget = RetryBudget(ratio=0.5, minimum=1)
+        for i in xrange(4):
+            budget.request()
+        self.assertEqual([budget.withdraw() for i in xrange(4)], [True, True, True, False])
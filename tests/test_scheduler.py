@@ -0,0 +1,105 @@
+import time
+import threading
+import unittest
+from kitsu.http.scheduler import *
+from kitsu.http.timing import monotonic
+
+class TokenBucketTests(unittest.TestCase):
+    def test_refill(self):
+        bucket = TokenBucket(10, burst=2)
+        now = bucket.stamp
+        for i in xrange(2):
+            self.assertEqual(bucket.delay(now), 0)
+            bucket.take()
+        self.assertAlmostEqual(bucket.delay(now), 0.1)
+        self.assertAlmostEqual(bucket.delay(now + 0.05), 0.05)
+        self.assertEqual(bucket.delay(now + 1), 0)
+        self.assertEqual(bucket.tokens, 2)
+
+class SchedulerTests(unittest.TestCase):
+    def test_idle_hosts(self):
+        scheduler = Scheduler(rate=1000000, maxinflight=2)
+        scheduler.acquire('busy')
+        scheduler.limit('limited', rate=1)
+        with scheduler.slot('limited'):
+            pass
+        scheduler.limit('custom', maxinflight=1)
+        for i in xrange(1000):
+            with scheduler.slot('host%d' % i):
+                pass
+        hosts = scheduler._Scheduler__hosts
+        # hosts with requests in flight or without tokens keep their state
+        # until they are no different from new ones
+        self.assertTrue(len(hosts) < 2 * Scheduler.minSweep, len(hosts))
+        self.assertEqual(hosts['busy'].inflight, 1)
+        self.assertTrue(hosts['limited'].delay(monotonic()) > 0)
+        with scheduler.condition:
+            self.assertEqual(scheduler.host('custom').maxinflight, 1)
+    
+    def test_maxinflight(self):
+        scheduler = Scheduler(maxinflight=1)
+        scheduler.acquire('a')
+        # other hosts are not affected
+        scheduler.acquire('b')
+        started = []
+        def waiter(priority):
+            scheduler.acquire('a', priority)
+            started.append(priority)
+        threads = [threading.Thread(target=waiter, args=(priority,)) for priority in (5, 1)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+        self.assertEqual(started, [])
+        scheduler.release('a')
+        time.sleep(0.05)
+        self.assertEqual(started, [1])
+        scheduler.release('a')
+        for thread in threads:
+            thread.join()
+        self.assertEqual(started, [1, 5])
+    
+    def test_rate(self):
+        scheduler = Scheduler(rate=20, burst=2)
+        start = time.time()
+        for i in xrange(4):
+            with scheduler.slot('a'):
+                pass
+        # two requests in a burst, then one every 50ms
+        self.assertTrue(time.time() - start >= 0.09)
+    
+    def test_limit(self):
+        scheduler = Scheduler(maxinflight=1)
+        scheduler.acquire('a')
+        scheduler.limit('a', maxinflight=2)
+        scheduler.acquire('a')
+        self.assertEqual(scheduler.host('a').inflight, 2)
+
+class BatchTests(unittest.TestCase):
+    def test_order(self):
+        scheduler = Scheduler(maxinflight=1)
+        batch = scheduler.batch()
+        batch.submit('a', 1)
+        batch.submit('a', 2)
+        batch.submit('a', 0, priority=-1)
+        batch.submit('b', 3)
+        batch.close()
+        self.assertEqual(batch.next(), ('a', 0))
+        # host a is busy, so b goes next
+        self.assertEqual(batch.next(), ('b', 3))
+        scheduler.release('a')
+        self.assertEqual(batch.next(), ('a', 1))
+        scheduler.release('a')
+        self.assertEqual(batch.next(), ('a', 2))
+        scheduler.release('a')
+        self.assertEqual(batch.next(), None)
+    
+    def test_cancel(self):
+        scheduler = Scheduler(maxinflight=1)
+        batch = scheduler.batch()
+        batch.submit('a', 1)
+        batch.submit('a', 2)
+        self.assertEqual(batch.next(), ('a', 1))
+        timer = threading.Timer(0.05, batch.cancel)
+        timer.start()
+        self.assertEqual(batch.next(), None)
+        timer.join()
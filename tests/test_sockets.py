@@ -1,6 +1,8 @@
 import os
 import sys
 import time
+import shutil
+import tempfile
 import ssl
 import socket
 import select
@@ -11,7 +13,15 @@ from kitsu.http.headers import *
 from kitsu.http.request import *
 from kitsu.http.response import *
 from kitsu.http.client import *
-from kitsu.http.client import HTTPClient
+from kitsu.http import client as clientmodule
+from kitsu.http.client import HTTPClient, ConnectionPool, create_socket, resolve_address
+from kitsu.http.cache import HTTPCache
+from kitsu.http.memory import MemoryTransport
+from kitsu.http.sockopts import *
+from kitsu.http.retry import *
+from kitsu.http.hedge import *
+from kitsu.http.balancer import *
+from kitsu.http.scheduler import *
 import unittest
 
 server_keyfile = os.path.join(os.path.dirname(__file__), 'certs', 'server.key')
@@ -19,14 +29,19 @@ server_certfile = os.path.join(os.path.dirname(__file__), 'certs', 'server.crt')
 server_ca_certs = os.path.join(os.path.dirname(__file__), 'certs', 'ca.crt')
 
 class Server(threading.Thread):
-    def __init__(self, host='127.0.0.1', port=0):
+    def __init__(self, host='127.0.0.1', port=0, path=None):
         threading.Thread.__init__(self)
-        self.sock = socket.socket()
-        self.sock.bind((host, port))
+        if path is None:
+            self.sock = socket.socket()
+            self.sock.bind((host, port))
+            self.host, self.port = self.sock.getsockname()
+        else:
+            self.sock = socket.socket(socket.AF_UNIX)
+            self.sock.bind(path)
         self.sock.listen(1)
         self.sock.settimeout(5)
-        self.host, self.port = self.sock.getsockname()
         self.responses = Queue.Queue()
+        self.requests = []
         self.deadsockets = []
         self.secure = False
     
@@ -55,6 +70,7 @@ class Server(threading.Thread):
                             assert len(request) == 1
                             request = request[0]
                             break
+                    self.requests.append(request)
                     #print "%s %s -> %d %s%s" % (request.method, request.target, response.code, response.phrase, response.body and " (%d bytes)" % len(response.body) or "")
                     sock.sendall(response.toString())
                     if response.body:
@@ -157,6 +173,7 @@ CHUNKED_HEADER = ("""\
 %%s: %%s
 
 """ % dict(size=len(NORMAL_BODY), chunk=NORMAL_BODY)).replace("\n", "\r\n")
+UPLOAD_BODY = "x" * (1024 * 1024)
 
 def make_response(body, chunked=False, length=None, code=200, headers=()):
     headers = Headers(headers)
@@ -307,6 +324,59 @@ class AgentTests(unittest.TestCase):
         self.assertEqual(response.url, self._make_url('/test'))
         self.assertEqual(response.urlchain, [self._make_url(), self._make_url('/test')])
     
+    def test_timing(self):
+        response = self.request([
+            make_response("", code=302, headers={'Location': '/test'}),
+            make_response(NORMAL_BODY),
+        ])
+        self.assertEqual([timing.url for timing in response.timings], response.urlchain)
+        timing = response.timing
+        self.assertTrue(timing is response.timings[-1])
+        self.assertFalse(timing.reused)
+        # names are resolved by create_socket unless the agent resolves them itself
+        self.assertTrue(timing.dns is None and timing.proxy is None and timing.tls is None)
+        values = [timing.start, timing.connect, timing.sent, timing.firstbyte, timing.headers, timing.done]
+        self.assertEqual(values, sorted(values))
+    
+    def test_create_socket(self):
+        addresses = []
+        def create(address, timeout):
+            addresses.append(address)
+            return create_socket(address, timeout)
+        agent = Agent(timeout=10, keepalive=False)
+        agent.create_socket = create
+        self.server.enqueue(make_response(NORMAL_BODY), autoclose=True)
+        # localhost may resolve to ::1 first, the server only listens on IPv4
+        self.assertEqual(agent.makeRequest('http://localhost:%s/' % (self.server.port,)).body, NORMAL_BODY)
+        self.assertEqual(addresses, [('localhost', self.server.port)])
+    
+    def test_resolve(self):
+        addresses = []
+        def create(address, timeout):
+            addresses.append(address)
+            return create_socket(address, timeout)
+        agent = Agent(timeout=10, keepalive=False, resolve=True)
+        agent.resolve_address = lambda address: [('127.0.0.2', 1), ('127.0.0.1', address[1])]
+        agent.create_socket = create
+        self.server.enqueue(make_response(NORMAL_BODY), autoclose=True)
+        response = agent.makeRequest('http://localhost:%s/' % (self.server.port,))
+        self.assertEqual(response.body, NORMAL_BODY)
+        # unreachable addresses are skipped
+        self.assertEqual(addresses, [('127.0.0.2', 1), ('127.0.0.1', self.server.port)])
+        timing = response.timing
+        self.assertTrue(timing.start <= timing.dns <= timing.connect)
+        self.assertTrue(('127.0.0.1', 80) in resolve_address(('127.0.0.1', 80)))
+        self.assertRaises(HTTPDNSError, resolve_address, ('nonexistent.invalid', 80))
+    
+    def test_observers(self):
+        self.server.enqueue(make_response(NORMAL_BODY), autoclose=True)
+        events = []
+        agent = Agent(timeout=10, keepalive=False, observers=[lambda event, info: events.append((event, info))])
+        agent.makeRequest(self._make_url())
+        self.assertEqual([event for (event, info) in events], ['connection.opened', 'request.started', 'bytes', 'request.finished', 'connection.closed'])
+        self.assertEqual(events[2][1]['received'], len(make_response(NORMAL_BODY).toString() + NORMAL_BODY))
+        self.assertEqual(events[4][1]['reason'], 'keepalive-disabled')
+    
     def test_secure_url(self):
         self.server.secure = True
         url = self._make_url()
@@ -337,3 +407,728 @@ class AgentTests(unittest.TestCase):
         self._use_proxy()
         self.server.secure = True
         self.test_redirect()
+
+    def test_fetch_many(self):
+        for i in xrange(3):
+            self.server.enqueue(make_response(NORMAL_BODY), autoclose=True)
+        urls = [self._make_url('/%d' % i) for i in xrange(3)]
+        urls.insert(1, 'ftp://%s/' % self.server.host)
+        agent = Agent(timeout=10, keepalive=False)
+        results = list(agent.fetch_many(urls, concurrency=2, ordered=True))
+        self.assertEqual([url for (url, result) in results], urls)
+        self.assertTrue(isinstance(results[1][1], HTTPError))
+        for url, result in results[:1] + results[2:]:
+            self.assertEqual(result.body, NORMAL_BODY)
+        for concurrency in (0, -1):
+            self.assertRaises(ValueError, list, agent.fetch_many(urls, concurrency=concurrency))
+
+    def test_cache(self):
+        self.server.enqueue(make_response(NORMAL_BODY, headers={'Cache-Control': 'max-age=60'}), autoclose=True)
+        agent = Agent(timeout=10, keepalive=False, cache=HTTPCache())
+        for i in xrange(2):
+            response = agent.makeRequest(self._make_url())
+            self.assertEqual(response.body, NORMAL_BODY)
+            self.assertEqual(response.url, self._make_url())
+        self.assertEqual(len(self.server.requests), 1)
+    
+    def test_origin_cache(self):
+        agent = Agent(timeout=10, keepalive=False)
+        for path in ('/a?x=1#frag', '/b', '?'):
+            self.server.enqueue(make_response(NORMAL_BODY), autoclose=True)
+            url = 'http://user:secret@%s:%s%s' % (self.server.host, self.server.port, path)
+            agent.makeRequest(url)
+        self.assertEqual([request.target for request in self.server.requests], ['/a?x=1', '/b', '/'])
+        for request in self.server.requests:
+            self.assertEqual(request.headers['Authorization'], 'Basic dXNlcjpzZWNyZXQ=')
+            self.assertEqual(request.headers['Host'], '%s:%s' % (self.server.host, self.server.port))
+        self.assertRaises(HTTPError, agent.makeRequest, 'ftp://%s/' % (self.server.host,))
+        self.assertRaises(HTTPError, setattr, agent, 'proxy', 'socks://127.0.0.1:1080')
+
+class RetryTests(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.server.start()
+        self.is_stale = clientmodule._is_stale
+    
+    def tearDown(self):
+        clientmodule._is_stale = self.is_stale
+        self.server.stop()
+        self.server.join()
+        self.server = None
+    
+    def request(self, method, retried=True):
+        # server closes the connection, but the pool does not notice
+        clientmodule._is_stale = lambda client: False
+        events = []
+        agent = Agent(timeout=10, observers=[lambda event, info: events.append(event)])
+        url = 'http://%s:%s/' % (self.server.host, self.server.port)
+        self.server.enqueue(make_response(NORMAL_BODY), autoclose=True)
+        agent.makeRequest(url)
+        time.sleep(0.05)
+        if retried:
+            self.server.enqueue(make_response(NORMAL_BODY), autoclose=True)
+        try:
+            return agent.makeRequest(url, method=method, body=method == 'POST' and 'data' or None), events
+        finally:
+            agent.close()
+    
+    def test_idempotent(self):
+        response, events = self.request('GET')
+        self.assertEqual(response.body, NORMAL_BODY)
+        self.assertFalse(response.timing.reused)
+        self.assertEqual(events.count('request.retried'), 1)
+        self.assertEqual(len(self.server.requests), 2)
+    
+    def test_not_idempotent(self):
+        self.assertRaises((HTTPDataError, socket.error), self.request, 'POST', retried=False)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_policy(self):
+        self.server.enqueue(make_response('', code=503, headers={'Retry-After': '0'}), autoclose=True)
+        self.server.enqueue(make_response(NORMAL_BODY), autoclose=True)
+        events = []
+        agent = Agent(timeout=10, keepalive=False, retry=RetryPolicy(backoff=0.01), observers=[lambda event, info: events.append(event)])
+        response = agent.makeRequest('http://%s:%s/' % (self.server.host, self.server.port))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, NORMAL_BODY)
+        self.assertEqual(events.count('request.retry'), 1)
+    
+    def test_budget(self):
+        self.server.enqueue(make_response('', code=503), autoclose=True)
+        agent = Agent(timeout=10, keepalive=False, retry=RetryPolicy(backoff=0.01, budget=RetryBudget(ratio=0, minimum=0)))
+        response = agent.makeRequest('http://%s:%s/' % (self.server.host, self.server.port))
+        self.assertEqual(response.code, 503)
+
+class TimeoutTests(unittest.TestCase):
+    def setUp(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(1)
+        self.url = 'http://%s:%s/' % self.sock.getsockname()
+        self.thread = None
+    
+    def tearDown(self):
+        self.sock.close()
+        if self.thread is not None:
+            self.thread.join()
+    
+    def serve(self, data, delay):
+        """Accepts one connection and sends data one byte per delay"""
+        def run():
+            sock, addr = self.sock.accept()
+            try:
+                sock.recv(4096)
+                for c in data:
+                    time.sleep(delay)
+                    sock.sendall(c)
+            except socket.error:
+                pass
+            finally:
+                sock.close()
+        self.thread = threading.Thread(target=run)
+        self.thread.start()
+    
+    def assertTimeout(self, phase, agent, **kwargs):
+        start = time.time()
+        try:
+            agent.makeRequest(self.url, **kwargs)
+        except HTTPTimeoutError, e:
+            self.assertEqual(e.phase, phase)
+            self.assertEqual(str(e), 'Timeout limit exceeded: %s' % (phase,))
+        else:
+            self.fail("HTTPTimeoutError not raised")
+        return time.time() - start
+    
+    def test_read(self):
+        self.serve('H', 0.3)
+        elapsed = self.assertTimeout('read', Agent(readtimeout=0.1, keepalive=False))
+        self.assertTrue(elapsed < 0.25, elapsed)
+    
+    def test_deadline(self):
+        # every byte arrives well within the read timeout
+        self.serve(make_response('x' * 100).toString() + 'x' * 100, 0.02)
+        elapsed = self.assertTimeout('deadline', Agent(readtimeout=1, keepalive=False), deadline=0.2)
+        self.assertTrue(0.15 < elapsed < 0.5, elapsed)
+    
+    def test_connect(self):
+        def create(address, timeout):
+            time.sleep(timeout)
+            raise socket.timeout('timed out')
+        agent = Agent(connecttimeout=0.1, keepalive=False)
+        agent.create_socket = create
+        elapsed = self.assertTimeout('connect', agent)
+        self.assertTrue(elapsed < 0.25, elapsed)
+    
+    def test_proxy(self):
+        # the proxy never answers CONNECT in time
+        self.serve('H', 0.3)
+        proxy = self.url.rstrip('/')
+        self.url = 'https://example.com/'
+        elapsed = self.assertTimeout('proxy', Agent(proxy=proxy, connecttimeout=0.1, keepalive=False))
+        self.assertTrue(elapsed < 0.25, elapsed)
+    
+    def test_tls(self):
+        # the server never answers the handshake in time
+        self.serve('H', 0.3)
+        self.url = self.url.replace('http://', 'https://')
+        elapsed = self.assertTimeout('tls', Agent(tlstimeout=0.1, keepalive=False))
+        self.assertTrue(elapsed < 0.25, elapsed)
+    
+    def test_client(self):
+        # plain socket timeouts of HTTPClient without phase timeouts are not translated
+        self.serve('H', 0.3)
+        sock = socket.create_connection(self.sock.getsockname(), 0.1)
+        client = HTTPClient(sock)
+        try:
+            client.makeRequest(Request(headers={'Host': 'example.com'}))
+        except socket.timeout, e:
+            self.assertFalse(isinstance(e, HTTPTimeoutError))
+        else:
+            self.fail("socket.timeout not raised")
+        finally:
+            client.close()
+    
+    def test_send_deadline(self):
+        # the server stops reading, so the body fills the socket buffers
+        self.serve('H', 0.5)
+        agent = Agent(readtimeout=5, keepalive=False, sockopts=SocketOptions(sndbuf=4096))
+        body = 'x' * (8 * 1024 * 1024)
+        elapsed = self.assertTimeout('deadline', agent, method='POST', body=body, headers={'Content-Length': str(len(body))}, deadline=0.2)
+        self.assertTrue(elapsed < 0.5, elapsed)
+
+class ContinueTests(unittest.TestCase):
+    def setUp(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(1)
+        self.url = 'http://%s:%s/' % self.sock.getsockname()
+        self.received = None
+        self.thread = None
+    
+    def tearDown(self):
+        self.sock.close()
+        if self.thread is not None:
+            self.thread.join()
+    
+    def serve(self, interim, final, readbody=True):
+        """Accepts one connection, sends interim responses, reads the body and sends the final response"""
+        def run():
+            sock, addr = self.sock.accept()
+            sock.settimeout(5)
+            try:
+                data = ''
+                while '\r\n\r\n' not in data:
+                    data += sock.recv(4096)
+                headers, data = data.split('\r\n\r\n', 1)
+                self.received = headers
+                sock.sendall(interim)
+                if readbody:
+                    while len(data) < len(UPLOAD_BODY):
+                        data += sock.recv(65536)
+                    self.received += '\r\n\r\n' + data
+                sock.sendall(final)
+            except socket.error:
+                pass
+            finally:
+                sock.close()
+        self.thread = threading.Thread(target=run)
+        self.thread.start()
+    
+    def request(self, agent):
+        events = []
+        agent.observers.append(lambda event, info: events.append((event, info.get('reason'))))
+        response = agent.makeRequest(self.url, method='PUT', body=UPLOAD_BODY, headers={'Content-Length': str(len(UPLOAD_BODY))})
+        return response, events
+    
+    def test_continue(self):
+        self.serve('HTTP/1.1 100 Continue\r\n\r\n', 'HTTP/1.1 103 Early Hints\r\nLink: </style.css>\r\n\r\n' + make_response('ok').toString() + 'ok')
+        response, events = self.request(Agent(expectcontinue=1024, continuetimeout=5))
+        self.assertEqual((response.code, response.body), (200, 'ok'))
+        self.assertEqual([interim.code for interim in response.interim], [100, 103])
+        self.assertEqual(response.interim[1].headers['Link'], '</style.css>')
+        self.assertTrue('Expect: 100-continue' in self.received)
+        self.assertTrue(self.received.endswith(UPLOAD_BODY))
+    
+    def test_rejected(self):
+        self.serve('', make_response('', code=413).toString(), readbody=False)
+        response, events = self.request(Agent(expectcontinue=1024, continuetimeout=5))
+        self.assertEqual(response.code, 413)
+        self.assertEqual(response.interim, [])
+        self.assertTrue(('connection.closed', 'body-skipped') in events)
+    
+    def test_ignored(self):
+        # the server does not know Expect, so the body is sent after the timeout
+        self.serve('', make_response('ok').toString() + 'ok')
+        response, events = self.request(Agent(keepalive=False, expectcontinue=1024, continuetimeout=0.05))
+        self.assertEqual(response.body, 'ok')
+        self.assertTrue(self.received.endswith(UPLOAD_BODY))
+    
+    def test_small(self):
+        self.serve('', make_response('ok').toString() + 'ok')
+        response, events = self.request(Agent(keepalive=False, expectcontinue=len(UPLOAD_BODY) + 1))
+        self.assertEqual(response.body, 'ok')
+        self.assertFalse('Expect' in self.received)
+
+class HedgeTests(unittest.TestCase):
+    def setUp(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.url = 'http://%s:%s/' % self.sock.getsockname()
+        self.delays = Queue.Queue()
+        self.thread = threading.Thread(target=self.accept)
+        self.thread.start()
+    
+    def tearDown(self):
+        self.delays.put(None)
+        self.thread.join()
+        self.sock.close()
+    
+    def accept(self):
+        """Serves connections concurrently, delaying each response by the next queued delay"""
+        def serve(sock, delay):
+            try:
+                sock.recv(4096)
+                time.sleep(delay)
+                response = make_response(NORMAL_BODY)
+                sock.sendall(response.toString() + response.body)
+            except socket.error:
+                pass
+            finally:
+                sock.close()
+        while True:
+            delay = self.delays.get()
+            if delay is None:
+                break
+            sock, addr = self.sock.accept()
+            thread = threading.Thread(target=serve, args=(sock, delay))
+            thread.daemon = True
+            thread.start()
+    
+    def test_hedged(self):
+        self.delays.put(2)
+        self.delays.put(0)
+        events = []
+        agent = Agent(timeout=10, keepalive=False, hedge=HedgePolicy(delay=0.05, budget=RetryBudget(minimum=1)),
+            observers=[lambda event, info: events.append((event, info.get('reason')))])
+        start = time.time()
+        response = agent.makeRequest(self.url)
+        self.assertTrue(time.time() - start < 1, "hedged request was not used")
+        self.assertEqual(response.body, NORMAL_BODY)
+        self.assertTrue(('request.hedged', None) in events)
+        for i in xrange(50):
+            if ('connection.closed', 'hedge-cancelled') in events:
+                break
+            time.sleep(0.01)
+        self.assertTrue(('connection.closed', 'hedge-cancelled') in events)
+    
+    def test_fast(self):
+        self.delays.put(0)
+        events = []
+        threads = threading.active_count()
+        agent = Agent(timeout=10, keepalive=False, hedge=HedgePolicy(delay=5), observers=[lambda event, info: events.append(event)])
+        self.assertEqual(agent.makeRequest(self.url).body, NORMAL_BODY)
+        self.assertFalse('request.hedged' in events)
+        # nothing keeps waiting for the hedging delay after the response
+        for i in xrange(100):
+            if threading.active_count() <= threads:
+                break
+            time.sleep(0.01)
+        self.assertTrue(threading.active_count() <= threads)
+
+class UpstreamTests(unittest.TestCase):
+    def setUp(self):
+        self.servers = [Server(), Server()]
+        for server in self.servers:
+            server.start()
+    
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+            server.join()
+    
+    def test_agent(self):
+        # nothing listens on the port of a closed socket
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        dead = '%s:%s' % sock.getsockname()
+        sock.close()
+        netlocs = ['%s:%s' % (server.host, server.port) for server in self.servers]
+        events = []
+        upstream = Upstream(netlocs + [dead], maxfailures=1)
+        agent = Agent(timeout=10, keepalive=False, upstreams={'Backend': upstream}, observers=[lambda event, info: events.append((event, info.get('netloc')))])
+        for server in self.servers:
+            server.enqueue(make_response(NORMAL_BODY), autoclose=True)
+        for i in xrange(2):
+            self.assertEqual(agent.makeRequest('http://backend/test').body, NORMAL_BODY)
+        self.assertRaises(socket.error, agent.makeRequest, 'http://backend/test')
+        self.assertTrue(('upstream.ejected', dead) in events)
+        for server in self.servers:
+            self.assertEqual([(request.target, request.headers['Host']) for request in server.requests], [('/test', 'backend')])
+            server.enqueue(make_response(NORMAL_BODY), autoclose=True)
+        for i in xrange(2):
+            self.assertEqual(agent.makeRequest('http://backend/test').body, NORMAL_BODY)
+    
+    def test_connector(self):
+        upstream = Upstream(['%s:%s' % (server.host, server.port) for server in self.servers])
+        connector = Connector(upstreams={'backend': upstream})
+        for server in self.servers:
+            sock = connector.connect(('backend', 80))
+            self.assertEqual(sock.getpeername(), (server.host, server.port))
+            sock.close()
+        self.assertEqual([endpoint.outstanding for endpoint in upstream.endpoints], [0, 0])
+
+class SchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.server.start()
+    
+    def tearDown(self):
+        self.server.stop()
+        self.server.join()
+        self.server = None
+    
+    def test_fetch_many(self):
+        base = 'http://%s:%s' % (self.server.host, self.server.port)
+        scheduler = Scheduler(maxinflight=1)
+        agent = Agent(timeout=10, keepalive=False, scheduler=scheduler)
+        for i in xrange(3):
+            self.server.enqueue(make_response(NORMAL_BODY), autoclose=True)
+        urls = [(base + '/low', {'priority': 2}), (base + '/high', {'priority': 0}), (base + '/normal', {'priority': 1})]
+        results = list(agent.fetch_many(urls, concurrency=3))
+        self.assertEqual(sorted(response.body for url, response in results), [NORMAL_BODY] * 3)
+        # one request at a time, in the order of priorities
+        self.assertEqual([request.target for request in self.server.requests], ['/high', '/normal', '/low'])
+        self.assertEqual(scheduler.host('%s:%s' % (self.server.host, self.server.port)).inflight, 0)
+    
+    def test_agent(self):
+        self.server.enqueue(make_response(NORMAL_BODY), autoclose=True)
+        scheduler = Scheduler(maxinflight=1)
+        agent = Agent(timeout=10, keepalive=False, scheduler=scheduler)
+        response = agent.makeRequest('http://%s:%s/' % (self.server.host, self.server.port), priority=5)
+        self.assertEqual(response.body, NORMAL_BODY)
+        self.assertEqual(scheduler.host('%s:%s' % (self.server.host, self.server.port)).inflight, 0)
+    
+    def test_redirect(self):
+        origin = '%s:%s' % (self.server.host, self.server.port)
+        other = 'localhost:%s' % (self.server.port,)
+        self.server.enqueue(make_response('', code=302, headers={'Location': 'http://%s/b' % (other,)}), autoclose=True)
+        self.server.enqueue(make_response(NORMAL_BODY), autoclose=True)
+        scheduler = Scheduler(maxinflight=1)
+        agent = Agent(timeout=10, keepalive=False, scheduler=scheduler)
+        # the redirect target is busy
+        scheduler.acquire(other)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(agent.makeRequest('http://%s/a' % (origin,))))
+        thread.start()
+        for i in xrange(100):
+            if len(self.server.requests) == 1:
+                break
+            time.sleep(0.01)
+        time.sleep(0.05)
+        self.assertEqual(results, [])
+        with scheduler.condition:
+            # the slot of the first hop is not held while waiting
+            self.assertEqual(scheduler.host(origin).inflight, 0)
+        scheduler.release(other)
+        thread.join()
+        self.assertEqual(results[0].body, NORMAL_BODY)
+        self.assertEqual([request.target for request in self.server.requests], ['/a', '/b'])
+        with scheduler.condition:
+            self.assertEqual(scheduler.host(other).inflight, 0)
+
+class PreconnectTests(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.server.start()
+        self.address = (('http', '%s:%s' % (self.server.host, self.server.port)),)
+    
+    def tearDown(self):
+        self.server.stop()
+        self.server.join()
+        self.server = None
+    
+    def waitIdle(self, pool, address, count):
+        for i in xrange(100):
+            if pool.count(address) >= count:
+                break
+            time.sleep(0.01)
+        return pool.count(address)
+    
+    def test_agent(self):
+        agent = Agent(timeout=10)
+        base = 'http://%s:%s' % (self.server.host, self.server.port)
+        # both urls share the same origin
+        threads = agent.preconnect([base + '/a', base + '/b'])
+        self.assertEqual(len(threads), 1)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(agent.pool.count(self.address), 1)
+        self.assertEqual(agent.preconnect(base + '/a'), [])
+        self.server.enqueue(make_response(NORMAL_BODY))
+        response = agent.makeRequest(base + '/a')
+        self.assertEqual(response.body, NORMAL_BODY)
+        self.assertTrue(response.timing.reused)
+        agent.close()
+    
+    def test_minidle(self):
+        agent = Agent(timeout=10, minidle=1)
+        url = 'http://%s:%s/' % (self.server.host, self.server.port)
+        # the server accepts connections in order, so the request must use the first one
+        for thread in agent.preconnect(url):
+            thread.join()
+        self.server.enqueue(make_response(NORMAL_BODY))
+        response = agent.makeRequest(url)
+        self.assertTrue(response.timing.reused)
+        # the connection used by the request and a warm one
+        self.assertEqual(self.waitIdle(agent.pool, self.address, 2), 2)
+        agent.close()
+    
+    def test_connector(self):
+        address = (self.server.host, self.server.port)
+        connector = Connector()
+        for thread in connector.preconnect([address], count=1):
+            thread.join()
+        self.assertEqual(connector.pool.count((address, False, None, None)), 1)
+        sock = connector.connect(address)
+        self.assertEqual(sock.getpeername(), address)
+        self.assertEqual(connector.pool.count((address, False, None, None)), 0)
+        sock.close()
+        connector.close()
+
+class UnixSocketTests(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'server.sock')
+        self.server = Server(path=self.path)
+        self.server.start()
+    
+    def tearDown(self):
+        self.server.stop()
+        self.server.join()
+        self.server = None
+        shutil.rmtree(self.tempdir)
+    
+    def test_agent(self):
+        import urllib
+        netloc = urllib.quote(self.path, '')
+        url = 'http+unix://%s/a' % (netloc,)
+        self.server.enqueue(make_response('', code=302, headers={'Location': 'b'}), autoclose=True)
+        self.server.enqueue(make_response(NORMAL_BODY))
+        agent = Agent(timeout=10, sockopts=LATENCY)
+        response = agent.makeRequest(url)
+        self.assertEqual(response.body, NORMAL_BODY)
+        self.assertEqual(response.url, url[:-1] + 'b')
+        self.assertEqual([request.target for request in self.server.requests], ['/a', '/b'])
+        self.assertEqual(self.server.requests[0].headers['Host'], 'localhost')
+        # keep-alive works the same as over tcp
+        self.assertEqual(agent.pool.count((('http+unix', netloc),)), 1)
+        agent.close()
+    
+    def test_download(self):
+        import urllib
+        url = 'http+unix://%s/dir/a' % (urllib.quote(self.path, ''),)
+        self.server.enqueue(make_response('', code=302, headers={'Location': 'b?next=http://x/'}), autoclose=True)
+        self.server.enqueue(make_response(NORMAL_BODY), autoclose=True)
+        filename = os.path.join(self.tempdir, 'download')
+        response = Agent(timeout=10, keepalive=False).download(url, filename)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(open(filename, 'rb').read(), NORMAL_BODY)
+        self.assertEqual([request.target for request in self.server.requests], ['/dir/a', '/dir/b?next=http://x/'])
+    
+    def test_join_url(self):
+        url = 'http+unix://%2Ftmp%2Fs.sock/a/b'
+        self.assertEqual(clientmodule._join_url(url, 'c'), 'http+unix://%2Ftmp%2Fs.sock/a/c')
+        self.assertEqual(clientmodule._join_url(url, '/login?next=http://x/'), 'http+unix://%2Ftmp%2Fs.sock/login?next=http://x/')
+        self.assertEqual(clientmodule._join_url(url, 'http://example.com/'), 'http://example.com/')
+    
+    def test_connector(self):
+        connector = Connector(proxy='http://127.0.0.1:1')
+        sock = connector.connect(self.path)
+        self.assertEqual(sock.getpeername(), self.path)
+        sock.close()
+
+class SocketOptionsTests(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.server.start()
+    
+    def tearDown(self):
+        self.server.stop()
+        self.server.join()
+        self.server = None
+    
+    def test_agent(self):
+        sockets = []
+        def create(address, timeout, options):
+            sock = create_socket(address, timeout, options)
+            sockets.append(sock)
+            return sock
+        self.server.enqueue(make_response(NORMAL_BODY), autoclose=True)
+        # keep the connection pooled, so its socket stays open
+        agent = Agent(timeout=10, sockopts=LATENCY.replace(sndbuf=65536))
+        agent.create_socket = create
+        response = agent.makeRequest('http://%s:%s/' % (self.server.host, self.server.port))
+        self.assertEqual(response.body, NORMAL_BODY)
+        sock = sockets[0]
+        self.assertTrue(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+        self.assertTrue(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE))
+        # linux doubles the requested buffer size
+        self.assertTrue(sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) >= 65536)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            self.assertEqual(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE), 30)
+        agent.close()
+    
+    def test_quickack(self):
+        if not hasattr(socket, 'TCP_QUICKACK'):
+            return
+        transport = MemoryTransport([make_response(NORMAL_BODY).toString() + NORMAL_BODY], fragment=16)
+        options = []
+        def create(address, timeout, sockopts):
+            sock = transport.create_socket(address, timeout)
+            sock.setsockopt = lambda level, option, value: options.append(option)
+            return sock
+        agent = Agent(timeout=10, sockopts=LATENCY)
+        agent.create_socket = create
+        self.assertEqual(agent.makeRequest('http://example.com/').body, NORMAL_BODY)
+        # quick acks are turned on again after every read
+        self.assertTrue(options.count(socket.TCP_QUICKACK) > 1, options)
+    
+    def test_replace(self):
+        options = THROUGHPUT.replace(packetsize=1024)
+        self.assertEqual(options.packetsize, 1024)
+        self.assertEqual(options.rcvbuf, THROUGHPUT.rcvbuf)
+        self.assertEqual(SocketOptions().items(), [])
+
+class ConnectionPoolTests(unittest.TestCase):
+    class Client(object):
+        closed = False
+        sock = object()
+        data = ''
+        def close(self):
+            self.closed = True
+    
+    def test_lifo_and_limit(self):
+        pool = ConnectionPool(2)
+        clients = [self.Client() for i in xrange(3)]
+        for client in clients:
+            pool.release('a', client)
+        self.assertTrue(clients[0].closed)
+        self.assertEqual(pool.count('a'), 2)
+        self.assertTrue(pool.acquire('b') is None)
+        self.assertTrue(pool.acquire('a') is clients[2])
+        pool.clear()
+        self.assertTrue(clients[1].closed)
+        self.assertEqual(len(pool), 0)
+    
+    def test_stale(self):
+        a, b = socket.socketpair()
+        events = []
+        pool = ConnectionPool(observers=[lambda event, info: events.append((event, info['reason']))])
+        client = HTTPClient(a)
+        pool.release('a', client)
+        self.assertTrue(pool.acquire('a') is client)
+        pool.release('a', client)
+        b.close()
+        self.assertTrue(pool.acquire('a') is None)
+        self.assertEqual(events, [('connection.closed', 'stale')])
+    
+    def test_stale_high_fd(self):
+        import resource
+        fd = 1100
+        if resource.getrlimit(resource.RLIMIT_NOFILE)[0] <= fd:
+            return
+        a, b = socket.socketpair()
+        os.dup2(a.fileno(), fd)
+        try:
+            class Socket(object):
+                def fileno(self):
+                    return fd
+                def close(self):
+                    pass
+            pool = ConnectionPool()
+            client = HTTPClient(Socket())
+            pool.release('a', client)
+            self.assertTrue(pool.acquire('a') is client)
+            pool.release('a', client)
+            b.close()
+            self.assertTrue(pool.acquire('a') is None)
+        finally:
+            os.close(fd)
+            a.close()
+
+class DownloadTests(unittest.TestCase):
+    def setUp(self):
+        self.server = Server()
+        self.server.start()
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'download')
+    
+    def tearDown(self):
+        self.server.stop()
+        self.server.join()
+        self.server = None
+        shutil.rmtree(self.tempdir)
+    
+    def download(self, responses, **kwargs):
+        for response in responses:
+            self.server.enqueue(response, autoclose=True)
+        url = "http://%s:%s/" % (self.server.host, self.server.port)
+        return Agent(timeout=10, keepalive=False).download(url, self.filename, **kwargs)
+    
+    def test_resume(self):
+        response = self.download([
+            make_response(NORMAL_BODY[:5], length=len(NORMAL_BODY), headers={'ETag': '"v1"'}),
+            make_response(NORMAL_BODY[5:], code=206, headers={'ETag': '"v1"', 'Content-Range': 'bytes 5-%d/%d' % (len(NORMAL_BODY) - 1, len(NORMAL_BODY))}),
+        ])
+        self.assertEqual(response.code, 206)
+        self.assertEqual(open(self.filename, 'rb').read(), NORMAL_BODY)
+        request = self.server.requests[1]
+        self.assertEqual(request.headers['Range'], 'bytes=5-')
+        self.assertEqual(request.headers['If-Range'], '"v1"')
+    
+    def test_resume_changed(self):
+        # Server ignoring the range sends the whole body
+        response = self.download([
+            make_response(NORMAL_BODY[:5], length=len(NORMAL_BODY), headers={'ETag': '"v1"'}),
+            make_response(NORMAL_BODY, headers={'ETag': '"v2"'}),
+        ])
+        self.assertEqual(response.code, 200)
+        self.assertEqual(open(self.filename, 'rb').read(), NORMAL_BODY)
+    
+    def test_redirect_origin(self):
+        self.server.enqueue(make_response(NORMAL_BODY[:5], length=len(NORMAL_BODY), headers={'ETag': '"v1"'}), autoclose=True)
+        self.assertRaises(HTTPDataError, self.download, [], retries=0)
+        headers = {'Authorization': 'Basic dXNlcjpzZWNyZXQ=', 'Cookie': 'session=1'}
+        other = 'http://localhost:%s/file' % (self.server.port,)
+        response = self.download([
+            make_response('', code=302, headers={'Location': '/moved'}),
+            make_response('', code=302, headers={'Location': other}),
+            make_response(NORMAL_BODY[5:], code=206, headers={'ETag': '"v1"', 'Content-Range': 'bytes 5-%d/%d' % (len(NORMAL_BODY) - 1, len(NORMAL_BODY))}),
+        ], headers=headers, validator='"v1"', retries=0)
+        self.assertEqual(response.code, 206)
+        self.assertEqual(open(self.filename, 'rb').read(), NORMAL_BODY)
+        same, moved, cross = self.server.requests[1:]
+        # the same origin gets everything
+        self.assertEqual(moved.headers['Cookie'], 'session=1')
+        self.assertEqual(moved.headers['Authorization'], headers['Authorization'])
+        self.assertFalse('Cookie' in cross.headers or 'Authorization' in cross.headers)
+        self.assertEqual(cross.headers['Host'], 'localhost:%s' % (self.server.port,))
+        self.assertEqual(cross.headers['Range'], 'bytes=5-')
+        self.assertEqual(cross.headers['If-Range'], '"v1"')
+    
+    def test_partial_from_start(self):
+        # Server answering without a Range with a partial response of everything
+        response = self.download([
+            make_response(NORMAL_BODY, code=206, headers={'ETag': '"v1"', 'Content-Range': 'bytes 0-%d/%d' % (len(NORMAL_BODY) - 1, len(NORMAL_BODY))}),
+        ])
+        self.assertEqual(response.code, 206)
+        self.assertEqual(open(self.filename, 'rb').read(), NORMAL_BODY)
+        self.assertFalse('Range' in self.server.requests[0].headers)
+    
+    def test_retry_limit(self):
+        self.assertRaises(HTTPDataError, self.download, [
+            make_response(NORMAL_BODY[:5], length=len(NORMAL_BODY), headers={'ETag': '"v1"'}),
+            make_response("", code=206, length=len(NORMAL_BODY) - 5, headers={'ETag': '"v1"', 'Content-Range': 'bytes 5-%d/%d' % (len(NORMAL_BODY) - 1, len(NORMAL_BODY))}),
+        ], retries=1)
+        self.assertEqual(open(self.filename, 'rb').read(), NORMAL_BODY[:5])